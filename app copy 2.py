@@ -8,6 +8,8 @@ from lib.auth_session import (
     get_q_user, apply_q_user_to_session,
     debug_query_and_session, ensure_current_user
 )
+from lib import login_sweeper
+from lib.json_lookup import MemberView, lookup_member
 
 # ===== 共有データの場所を「相対で」特定（pages/からの実行にも対応）=====
 HERE = Path(__file__).resolve()
@@ -32,12 +34,8 @@ def load_json(p: Path, default):
     except Exception:
         return default
 
-def save_json(p: Path, data: dict) -> None:
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-
 # ---------- データ読込（そのまま。表記ゆれの正規化は一切しない）----------
-users_db       = load_json(USERS_FILE, {"users": {}}).get("users", {})
+users_db       = MemberView(USERS_FILE, ("users",))   # 全体は読まない（参照したユーザー分だけ）
 login_users    = load_json(LOGIN_USERS_FILE, {})   # キーや値はそのまま使う
 
 # ---------- クエリ ?user=xxx をまず表示 ----------
@@ -72,7 +70,7 @@ debug_query_and_session(q_user)
 
 # 3) 現在ユーザーの確定（UI込み）
 #    - login_users: 例 {"maeda": {...}, "ym": {...}}
-#    - users_db:    例 {"maeda": {"apps":[...]}, ...}  # ここは読み取り済みの dict を渡す
+#    - users_db:    例 {"maeda": {"apps":[...]}, ...}  # dict と同じように引ける読み取り専用ビューを渡す
 cur = ensure_current_user(
     login_users=login_users,
     users_db=users_db,
@@ -84,6 +82,7 @@ cur = ensure_current_user(
     },
 )
 st.success(f"ログイン中: **{cur}**")
+login_sweeper.touch(LOGIN_USERS_FILE, cur)   # 期限切れの掃除（LOGIN_TEST_LOGIN_TTL_MINUTES 有効時）
 
 
 # # ========= URLクエリ =========
@@ -157,8 +156,8 @@ st.success(f"ログイン中: **{cur}**")
 
 # ---------- ACL: users.json を優先、無ければ login_users.json.apps ----------
 def allowed_apps(user: str) -> set[str]:
-    rec = users_db.get(user, {})
-    apps = rec.get("apps")
+    # users.json は巨大になりうるので、このユーザーの apps だけを読む（索引つき・全体はパースしない）
+    apps = lookup_member(USERS_FILE, ("users", user, "apps"))
     if not apps:
         # login_users の値はそのまま使う（apps が無ければ空扱い）
         apps = (login_users.get(user, {}) or {}).get("apps", [])
@@ -184,13 +183,13 @@ st.markdown("- **公開テスト**（ログイン不要） → サイドバー
 st.divider()
 st.subheader("ログアウト（login_users.json から除去）")
 if st.button("ログアウト", key="btn_logout_root"):
-    data = load_json(LOGIN_USERS_FILE, {})
-    if cur in data:
-        del data[cur]
-        save_json(LOGIN_USERS_FILE, data)
-    st.session_state.pop("current_user", None)
-    st.success("ログアウトしました。")
-    st.markdown(f'<meta http-equiv="refresh" content="0; url={PORTAL_URL}/"/>', unsafe_allow_html=True)
+    if login_sweeper.remove_users(LOGIN_USERS_FILE, [cur]) is None:
+        # login_users.json がポータルの書き込みと競合し続けて書き戻せなかった（ユーザーは残っている）
+        st.error("ログアウトできませんでした（login_users.json を更新できませんでした）。もう一度お試しください。")
+    else:
+        st.session_state.pop("current_user", None)
+        st.success("ログアウトしました。")
+        st.markdown(f'<meta http-equiv="refresh" content="0; url={PORTAL_URL}/"/>', unsafe_allow_html=True)
 
 # ---------- デバッグ ----------
 with st.expander("🔎 Debug — ファイル/状態"):
@@ -4,6 +4,9 @@ import json
 from pathlib import Path
 import streamlit as st
 
+from lib import login_sweeper
+from lib.json_lookup import lookup_member
+
 # ===== 共有データの場所を「相対で」特定（pages/からの実行にも対応）=====
 HERE = Path(__file__).resolve()
 app_dir = HERE.parent if HERE.parent.name != "pages" else HERE.parent.parent  # .../login_test_app
@@ -27,12 +30,11 @@ def load_json(p: Path, default):
     except Exception:
         return default
 
-def save_json(p: Path, data: dict) -> None:
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+def user_registered(user: str) -> bool:
+    """users.json に登録があるか（全体は読まない）。"""
+    return lookup_member(USERS_FILE, ("users", user)) is not None
 
 # ---------- データ読込（そのまま。表記ゆれの正規化は一切しない）----------
-users_db       = load_json(USERS_FILE, {"users": {}}).get("users", {})
 login_users    = load_json(LOGIN_USERS_FILE, {})   # キーや値はそのまま使う
 
 # ---------- クエリ ?user=xxx をまず表示 ----------
@@ -99,7 +101,7 @@ if not cur and len(login_users) == 1:
     st.session_state["current_user"] = cur
 
 # cur があるのに login_users にいない場合でも、users.json に登録があれば有効とみなす
-if cur and (cur not in login_users) and (cur in users_db):
+if cur and (cur not in login_users) and user_registered(cur):
     pass  # そのまま通す
 
 # まだ未確定なら選択UI
@@ -125,11 +127,12 @@ if not st.session_state.get("current_user"):
 # ここまで来れば確定
 cur = st.session_state.get("current_user")
 st.success(f"ログイン中: **{cur}**")
+login_sweeper.touch(LOGIN_USERS_FILE, cur)   # 期限切れの掃除（LOGIN_TEST_LOGIN_TTL_MINUTES 有効時）
 
 # ---------- ACL: users.json を優先、無ければ login_users.json.apps ----------
 def allowed_apps(user: str) -> set[str]:
-    rec = users_db.get(user, {})
-    apps = rec.get("apps")
+    # users.json は巨大になりうるので、このユーザーの apps だけを読む（索引つき・全体はパースしない）
+    apps = lookup_member(USERS_FILE, ("users", user, "apps"))
     if not apps:
         # login_users の値はそのまま使う（apps が無ければ空扱い）
         apps = (login_users.get(user, {}) or {}).get("apps", [])
@@ -155,13 +158,13 @@ st.markdown("- **公開テスト**（ログイン不要） → サイドバー
 st.divider()
 st.subheader("ログアウト（login_users.json から除去）")
 if st.button("ログアウト", key="btn_logout_root"):
-    data = load_json(LOGIN_USERS_FILE, {})
-    if cur in data:
-        del data[cur]
-        save_json(LOGIN_USERS_FILE, data)
-    st.session_state.pop("current_user", None)
-    st.success("ログアウトしました。")
-    st.markdown(f'<meta http-equiv="refresh" content="0; url={PORTAL_URL}/"/>', unsafe_allow_html=True)
+    if login_sweeper.remove_users(LOGIN_USERS_FILE, [cur]) is None:
+        # login_users.json がポータルの書き込みと競合し続けて書き戻せなかった（ユーザーは残っている）
+        st.error("ログアウトできませんでした（login_users.json を更新できませんでした）。もう一度お試しください。")
+    else:
+        st.session_state.pop("current_user", None)
+        st.success("ログアウトしました。")
+        st.markdown(f'<meta http-equiv="refresh" content="0; url={PORTAL_URL}/"/>', unsafe_allow_html=True)
 
 # ---------- デバッグ ----------
 with st.expander("🔎 Debug — ファイル/状態"):
@@ -171,6 +174,6 @@ with st.expander("🔎 Debug — ファイル/状態"):
         "LOGIN_USERS_FILE": str(LOGIN_USERS_FILE),
         "login_users_keys": list(login_users.keys()),
         "current_user": st.session_state.get("current_user"),
-        "users_db_has_current": cur in users_db if cur else None,
+        "users_db_has_current": user_registered(cur) if cur else None,
         "login_users_has_current": cur in login_users if cur else None,
     })
@@ -5,7 +5,7 @@ import sys
 import os
 import time
 import datetime as dt
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import streamlit as st
 import extra_streamlit_components as stx
@@ -16,19 +16,10 @@ import jwt  # 署名未検証で payload を覗くデバッグ用（本番の検
 # ─────────────────────────────────────────────────────────────
 HERE = Path(__file__).resolve()
 
-def _find_projects_root(start: Path) -> Optional[Path]:
-    # 祖先に 'projects' というディレクトリ名があればそれを返す
-    for p in [start, *start.parents]:
-        if p.name == "projects":
-            return p
-    # 祖先の直下に projects/ がある場合も拾う
-    for p in [start, *start.parents]:
-        candidate = p / "projects"
-        if candidate.is_dir():
-            return candidate
-    return None
+from lib import prewarm  # noqa: E402  パス解決・設定読み込みなどをプロセスにつき 1 回にする
+from lib.access_settings import find_projects_root  # noqa: E402
 
-PROJECTS_ROOT = _find_projects_root(HERE)
+PROJECTS_ROOT = prewarm.once("projects_root", lambda: find_projects_root(HERE))
 if PROJECTS_ROOT and str(PROJECTS_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECTS_ROOT))
 
@@ -45,7 +36,7 @@ def _add_commonlib_parent_to_syspath() -> Optional[str]:
         return str(PROJECTS_ROOT)
     return None
 
-_add_commonlib_parent_to_syspath()
+prewarm.once("commonlib_path", _add_commonlib_parent_to_syspath)
 
 # ─────────────────────────────────────────────────────────────
 # 1) 共通ライブラリ（JWT検証・UI）
@@ -54,81 +45,21 @@ from common_lib.ui.ui_basics import thick_divider
 from common_lib.auth.jwt_utils import verify_jwt  # JWTはユーザー名のみ想定
 from common_lib.auth.config import COOKIE_NAME, PORTAL_URL
 
+from lib.metrics import ACL_DECISIONS, TOKEN_VERIFICATIONS, start_exporter
+from lib.query_api import start_query_api
+from lib.session_auth import authenticate, clear_session_auth
+from lib.sso import cached_verifier, refresh_token_if_due
+from lib import auth_audit, file_watch
+
+start_exporter()  # 環境変数が無ければ何もしない（プロセスにつき1回）
+start_query_api()  # 同上（LOGIN_TEST_QUERY_API_PORT）
+
 # ─────────────────────────────────────────────────────────────
-# 2) settings.toml ローダ（lib.access_settings が無くても動くフォールバック）
+# 2) settings.toml ローダ（lib/access_settings.py）
 # ─────────────────────────────────────────────────────────────
-def load_access_settings() -> Dict[str, Any]:
-    """
-    auth_portal_app/.streamlit/settings.toml を読み込んで dict を返す。
-    環境変数 → 典型パス → 自動探索 の順に検索。
-    """
-    # 2.1 明示指定（最優先）
-    env_path = os.environ.get("AUTH_PORTAL_SETTINGS_FILE") or os.environ.get("ADMIN_SETTINGS_FILE")
-    if env_path:
-        p = Path(env_path).expanduser().resolve()
-        if p.is_file():
-            return _read_toml(p)
-
-    # 2.2 典型パス（projects 直下の auth_portal_project/auth_portal_app）
-    if PROJECTS_ROOT:
-        classic = PROJECTS_ROOT / "auth_portal_project" / "auth_portal_app" / ".streamlit" / "settings.toml"
-        if classic.is_file():
-            return _read_toml(classic)
-
-    # 2.3 自動探索（auth_portal_app/.streamlit/settings.toml を深さ制限付きで探索）
-    search_roots: List[Path] = []
-    if PROJECTS_ROOT:
-        search_roots.append(PROJECTS_ROOT)
-    # 祖先の下層も少し見る（大規模リポで projects が別名の時の保険）
-    search_roots.extend([p for p in HERE.parents[:3]])
-
-    visited = set()
-    for root in search_roots:
-        root = root.resolve()
-        if not root.exists() or root in visited:
-            continue
-        visited.add(root)
-        # 深さ優先で最大深さ 4 くらいに制限
-        for sub in _iter_dirs_bounded(root, max_depth=4):
-            candidate = sub / "auth_portal_app" / ".streamlit" / "settings.toml"
-            if candidate.is_file():
-                return _read_toml(candidate)
-
-    # 2.4 最後の保険：カレントから上に遡って .streamlit/settings.toml を拾う
-    for p in [HERE.parent, *HERE.parents]:
-        candidate = p / ".streamlit" / "settings.toml"
-        if candidate.is_file():
-            return _read_toml(candidate)
-
-    st.error("settings.toml が見つかりませんでした。AUTH_PORTAL_SETTINGS_FILE を環境変数で指定するか、"
-             "auth_portal_app/.streamlit/settings.toml を配置してください。")
-    return {}
-
-def _iter_dirs_bounded(root: Path, max_depth: int = 3):
-    """ルート以下のディレクトリを深さ制限付きで列挙（ファイル数が多い環境の暴走防止）。"""
-    from collections import deque
-    dq = deque([(root, 0)])
-    while dq:
-        base, d = dq.popleft()
-        if d > max_depth:
-            continue
-        yield base
-        try:
-            for child in base.iterdir():
-                if child.is_dir():
-                    dq.append((child, d + 1))
-        except Exception:
-            continue
-
-def _read_toml(path: Path) -> Dict[str, Any]:
-    try:
-        import tomllib  # Py3.11+
-        with path.open("rb") as f:
-            data = tomllib.load(f)
-        return data if isinstance(data, dict) else {}
-    except Exception as e:
-        st.error(f"TOML 読み込みに失敗しました: {path}\n{e}")
-        return {}
+# 探索・パース・ACL 展開は事前準備の "access_policy"（lib/prewarm の標準ステップ）。
+# tools/serve.py で起動していればサーバー起動時に済んでいる。そうでなければ最初の rerun で始める
+prewarm.start()
 
 # ─────────────────────────────────────────────────────────────
 # 3) 基本メタ情報（APP_BASE → APP_KEY）
@@ -201,6 +132,8 @@ cm = stx.CookieManager()
 raw_token = cm.get(COOKIE_NAME)
 
 if not raw_token:
+    clear_session_auth()
+    TOKEN_VERIFICATIONS.inc("missing")
     st.warning("Cookie が見つかりません（未ログインの可能性）。この場では自動遷移しません。")
     with st.expander("🔎 デバッグ：Cookie 状況", expanded=True):
         st.write({"cookie_present": False, "cookie_name": COOKIE_NAME})
@@ -208,14 +141,22 @@ if not raw_token:
     portal_button()
     st.stop()
 
-payload = verify_jwt(raw_token)  # sub のみ想定
-if not payload:
+# セッションに置くのは SessionAuth だけ（payload は持たない。同じ Cookie なら再検証しない）
+_t_verify = time.perf_counter()
+auth = authenticate(raw_token, cached_verifier(verify_jwt))  # sub のみ想定。検証結果はプロセス間で共有
+verify_ms = (time.perf_counter() - _t_verify) * 1000
+if auth is None:
     weak = decode_without_verify(raw_token)
     exp  = weak.get("exp")
     now  = int(time.time())
     reason = "トークンが無効です（署名不一致・破損等の可能性）。"
+    outcome = "invalid"
     if isinstance(exp, int) and exp < now:
         reason = "トークンの有効期限が切れています。"
+        outcome = "expired"
+    TOKEN_VERIFICATIONS.inc(outcome)
+    # ユーザー名は署名未検証の sub（監査の手がかり用）
+    auth_audit.record(str(weak.get("sub") or ""), APP_KEY, False, f"token_{outcome}", exp=exp, verify_ms=verify_ms)
 
     st.error(f"{reason}（このページは自動遷移しません）")
     with st.expander("🔎 デバッグ：JWT の推定内容（署名未検証）", expanded=True):
@@ -229,27 +170,26 @@ if not payload:
     portal_button("🔐 ポータルで再ログイン")
     st.stop()
 
-current_user: str = (payload.get("sub") or "unknown")
+TOKEN_VERIFICATIONS.inc("ok")
+current_user: str = auth.user
 
 # ─────────────────────────────────────────────────────────────
 # 8) ACL 読み込み & 権限チェック（settings.toml 直接参照）
 # ─────────────────────────────────────────────────────────────
-ACL = load_access_settings()
-
-ACCESS = ACL.get("access", {}) if isinstance(ACL, dict) else {}
-PUBLIC = (ACCESS.get("public", {}) or {}).get("apps", []) or []
-USER   = (ACCESS.get("user", {}) or {}).get("apps", []) or []
-RESTR  = (ACCESS.get("restricted", {}) or {}).get("apps", []) or []
-ADMIN  = (ACCESS.get("admin", {}) or {}).get("apps", []) or []
-RU     = ACL.get("restricted_users", {}) if isinstance(ACL, dict) else {}
-
-_raw_admin = ACL.get("admin_users", []) if isinstance(ACL, dict) else []
-if isinstance(_raw_admin, dict):
-    ADMINS = set(_raw_admin.get("users", []))
-elif isinstance(_raw_admin, (list, tuple, set)):
-    ADMINS = set(_raw_admin)
-else:
-    ADMINS = set()
+# 事前準備（prewarm）の結果を使う。実行中なら待ち、設定ファイルが変わっていれば読み直す。
+# LOGIN_TEST_FILE_WATCH 有効時は settings.toml が変わるまで stat も省く
+ACL, ACL_VERSION, POLICY, ACL_ERRORS = file_watch.memoized(
+    "access_settings", lambda: prewarm.once("access_policy"), cache_if=lambda r: bool(r[1])
+)
+for _msg in ACL_ERRORS:
+    st.error(_msg)      # 読み込み時（事前準備のスレッドかもしれない）のエラーはここで表示
+
+PUBLIC = POLICY["public"]
+USER   = POLICY["user"]
+RESTR  = POLICY["restricted"]
+ADMIN  = POLICY["admin"]
+RU     = POLICY["restricted_users"]
+ADMINS = POLICY["admin_users"]
 
 allowed = False
 reason  = ""
@@ -264,12 +204,16 @@ elif APP_KEY in USER:
     allowed = True
     reason  = "user_layer"
 elif APP_KEY in RESTR:
-    allowed = current_user in (RU.get(APP_KEY, []) or [])
+    allowed = current_user in RU.get(APP_KEY, ())
     reason  = "restricted_users"
 else:
     allowed = False
     reason  = "unlisted_app"
 
+ACL_DECISIONS.inc(reason, "true" if allowed else "false")
+auth.set_decision(allowed, reason, admin=current_user in ADMINS)
+auth_audit.record(current_user, APP_KEY, allowed, reason, exp=auth.exp, verify_ms=verify_ms)
+
 if not allowed:
     st.error(f"このユーザーには **{APP_KEY}** の権限がありません。")
     with st.expander("🔎 デバッグ：ACL 状況", expanded=True):
@@ -281,7 +225,7 @@ if not allowed:
             "user_apps": sorted(set(USER)),
             "restricted_apps": sorted(set(RESTR)),
             "admin_apps": sorted(set(ADMIN)),
-            "restricted_users_for_app": RU.get(APP_KEY, []),
+            "restricted_users_for_app": sorted(RU.get(APP_KEY, ())),
             "admin_users": sorted(ADMINS),
             "PROJECTS_ROOT": str(PROJECTS_ROOT) if PROJECTS_ROOT else None,
         })
@@ -289,12 +233,18 @@ if not allowed:
     portal_button("🔐 ポータル（管理者に権限付与を依頼）")
     st.stop()
 
+# 期限間近なら同じクレームで再発行して Cookie を差し替える（LOGIN_TEST_TOKEN_REFRESH_WINDOW 有効時）。
+# Cookie は path="/" で全アプリに効くので、このアプリの権限があると分かってから
+refreshed = refresh_token_if_due(raw_token, auth.exp, user=auth.user, cookie_manager=cm, cookie_name=COOKIE_NAME)
+if refreshed:
+    auth.rebind(*refreshed)
+
 # ─────────────────────────────────────────────────────────────
 # 9) 本体
 # ─────────────────────────────────────────────────────────────
 st.success(f"✅ ログインしました — ユーザー: **{current_user}**")
-with st.expander("🔎 参考：JWT payload（検証済み。appsは含めません）", expanded=False):
-    st.write(payload)
+with st.expander("🔎 参考：セッションの認証情報（検証済み JWT から必要な項目のみ）", expanded=False):
+    st.write(auth.as_dict())
 
 thick_divider()
 
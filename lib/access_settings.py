@@ -0,0 +1,167 @@
+# login_test_app/lib/access_settings.py
+"""
+settings.toml（auth_portal_app/.streamlit/settings.toml）の探索・読み込みと ACL の展開（app.py の 2)）。
+
+Streamlit に依存しない部分をスクリプトから出しておき、事前準備（lib/prewarm の "access_policy"）が
+サーバー起動時（tools/serve.py）からでも読めるようにする。どのページから先に開かれても同じ結果を使う。
+
+- 探索順: 環境変数 → 典型パス（projects 直下）→ 自動探索（lib/settings_discovery）→ 祖先の .streamlit
+- 共有キャッシュ（LOGIN_TEST_SHARED_CACHE）があれば探索結果とパース結果を他プロセスと共有する
+- load_access_policy() はエラーを表示せずに返す（表示はスクリプト側）
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import streamlit as st
+
+from lib import file_watch
+from lib.settings_discovery import find_settings
+from lib.shared_cache import file_version, get_shared_cache
+
+HERE = Path(__file__).resolve().parent.parent / "app.py"     # 探索の起点（app.py と同じ）
+
+def find_projects_root(start: Path) -> Optional[Path]:
+    # 祖先に 'projects' というディレクトリ名があればそれを返す
+    for p in [start, *start.parents]:
+        if p.name == "projects":
+            return p
+    # 祖先の直下に projects/ がある場合も拾う
+    for p in [start, *start.parents]:
+        candidate = p / "projects"
+        if candidate.is_dir():
+            return candidate
+    return None
+
+PROJECTS_ROOT = find_projects_root(HERE)
+
+def load_access_settings() -> Dict[str, Any]:
+    """
+    auth_portal_app/.streamlit/settings.toml を読み込んで dict を返す。
+    環境変数 → 典型パス → 自動探索 の順に検索。
+    """
+    return load_access_settings_versioned()[0]
+
+def _report(errors: Optional[List[str]], message: str) -> None:
+    """errors があればそこへ積む（バックグラウンドスレッドでは st.error が表示されない）。無ければ表示。"""
+    if errors is not None:
+        errors.append(message)
+    else:
+        st.error(message)
+
+def load_access_settings_versioned(errors: Optional[List[str]] = None) -> Tuple[Dict[str, Any], str]:
+    """
+    load_access_settings と同じ内容に、設定ファイルの版（パス・mtime・サイズ）を添えて返す。
+    共有キャッシュ（LOGIN_TEST_SHARED_CACHE）があれば探索結果とパース結果を他プロセスと共有する。
+    errors を渡すとエラーは表示せずにそこへ積む（事前準備のスレッドから呼ぶとき）。
+    """
+    cache = get_shared_cache()
+    env_path = os.environ.get("AUTH_PORTAL_SETTINGS_FILE") or os.environ.get("ADMIN_SETTINGS_FILE") or ""
+    discovery_version = f"{env_path}|{PROJECTS_ROOT}|{HERE}"
+
+    path: Optional[Path] = None
+    if cache:
+        hit = cache.get("settings", "path", discovery_version)
+        if isinstance(hit, str) and Path(hit).is_file():
+            path = Path(hit)
+    if path is None:
+        path = find_settings_file()
+        if path is None:
+            _report(errors, "settings.toml が見つかりませんでした。AUTH_PORTAL_SETTINGS_FILE を環境変数で指定するか、"
+                            "auth_portal_app/.streamlit/settings.toml を配置してください。")
+            return {}, ""
+        if cache:
+            cache.put("settings", "path", str(path), discovery_version)
+
+    file_watch.watch(path)
+    version = file_version(path)
+    if cache:
+        snap = cache.get("settings", str(path), version)
+        if isinstance(snap, dict):
+            return snap, version
+    data = _read_toml(path, errors)
+    if cache and data:
+        cache.put("settings", str(path), data, version)
+    return data, version
+
+def find_settings_file() -> Optional[Path]:
+    # 2.1 明示指定（最優先）
+    env_path = os.environ.get("AUTH_PORTAL_SETTINGS_FILE") or os.environ.get("ADMIN_SETTINGS_FILE")
+    if env_path:
+        p = Path(env_path).expanduser().resolve()
+        if p.is_file():
+            return p
+
+    # 2.2 典型パス（projects 直下の auth_portal_project/auth_portal_app）
+    if PROJECTS_ROOT:
+        classic = PROJECTS_ROOT / "auth_portal_project" / "auth_portal_app" / ".streamlit" / "settings.toml"
+        if classic.is_file():
+            return classic
+
+    # 2.3 自動探索（auth_portal_app/.streamlit/settings.toml を深さ制限付きで探索）
+    search_roots: List[Path] = []
+    if PROJECTS_ROOT:
+        search_roots.append(PROJECTS_ROOT)
+    # 祖先の下層も少し見る（大規模リポで projects が別名の時の保険）
+    search_roots.extend([p for p in HERE.parents[:3]])
+
+    # 深さ 4 まで。ルートは並行に探索し、結果は上の優先順（.git / node_modules 等は降りない）
+    found = find_settings(search_roots, max_depth=4)
+    if found is not None:
+        return found
+
+    # 2.4 最後の保険：カレントから上に遡って .streamlit/settings.toml を拾う
+    for p in [HERE.parent, *HERE.parents]:
+        candidate = p / ".streamlit" / "settings.toml"
+        if candidate.is_file():
+            return candidate
+
+    return None
+
+def _read_toml(path: Path, errors: Optional[List[str]] = None) -> Dict[str, Any]:
+    try:
+        import tomllib  # Py3.11+
+        with path.open("rb") as f:
+            data = tomllib.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        _report(errors, f"TOML 読み込みに失敗しました: {path}\n{e}")
+        return {}
+
+def compile_acl(acl: Dict[str, Any]) -> Dict[str, Any]:
+    """settings.toml の dict を判定用の集合にまとめる（設定の版ごとに 1 回）。"""
+    access = acl.get("access", {}) if isinstance(acl, dict) else {}
+
+    def layer(name: str) -> frozenset:
+        return frozenset((access.get(name, {}) or {}).get("apps", []) or [])
+
+    ru = acl.get("restricted_users", {}) if isinstance(acl, dict) else {}
+    raw_admin = acl.get("admin_users", []) if isinstance(acl, dict) else []
+    if isinstance(raw_admin, dict):
+        admins = frozenset(raw_admin.get("users", []))
+    elif isinstance(raw_admin, (list, tuple, set)):
+        admins = frozenset(raw_admin)
+    else:
+        admins = frozenset()
+    return {
+        "public": layer("public"),
+        "user": layer("user"),
+        "restricted": layer("restricted"),
+        "admin": layer("admin"),
+        "restricted_users": {k: frozenset(v or []) for k, v in (ru.items() if isinstance(ru, dict) else [])},
+        "admin_users": admins,
+    }
+
+def load_access_policy() -> Tuple[Dict[str, Any], str, Dict[str, Any], Tuple[str, ...]]:
+    """
+    (settings dict, 版, compile_acl の結果, エラー)。
+    事前準備のスレッドでも動くよう、エラーは表示せずに返す（表示はスクリプト側）。
+    """
+    errors: List[str] = []
+    data, version = load_access_settings_versioned(errors)
+    return data, version, compile_acl(data), tuple(errors)
+
+def settings_unchanged(result: Tuple[Dict[str, Any], str, Dict[str, Any]]) -> bool:
+    version = result[1]     # "path:mtime_ns:size"
+    return bool(version) and file_version(Path(version.rsplit(":", 2)[0])) == version
@@ -0,0 +1,321 @@
+# login_test_app/lib/auth_audit.py
+"""
+認証・権限判定の監査記録（誰が・いつ・どのアプリに・なぜ通った/拒否されたか）。
+
+- record() は通し番号の採番とタプルの append を 1 つのロックの中で行うだけ（O(1)）。
+  リングの中は常に通し番号順で、スクリプトのスレッドはファイル I/O を待たない
+- バックグラウンドスレッドが FLUSH_INTERVAL 秒ごとにリングの新しい分（通し番号で判定）を
+  プロセスごとのファイルへまとめて追記する。ロックの中ではリングの末尾の新しい分だけを取り出す
+  （リング全体は複写しないので record() を止めない）。ファイルが MAX_BYTES を超えたら .1 … .KEEP に回す。
+  書き出す前にリングが一周していたら、その件数を取りこぼしとして数える
+- 終了したプロセス（このホストは pid で確認）のファイルは、最後の書き込みから保持日数を過ぎたら
+  PRUNE_INTERVAL ごとに消す
+- 1 行 = JSON 配列 [ts, user, app, allowed(1/0), reason, exp, verify_ms]（キー名を持たない分だけ小さい）
+- recent(user) はこのプロセスのリングの未書き出し分と全プロセスのファイルから探す。ファイルは末尾から
+  ブロック単位で読み、プロセスごとに limit 件見つかったら止める（読む量は合計 SCAN_BYTES まで）
+
+    data/audit/auth_decisions.<host>.<pid>.log(.1 … .KEEP)
+
+    LOGIN_TEST_AUTH_AUDIT=0                     # 記録しない
+    LOGIN_TEST_AUTH_AUDIT_RETENTION_DAYS=30     # 終了したプロセスのファイルを残す日数（0 なら消さない）
+"""
+from __future__ import annotations
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from lib.metrics import REGISTRY
+
+HERE = Path(__file__).resolve()
+project_dir = HERE.parent.parent.parent         # .../login_test_project
+AUDIT_DIR = Path(os.environ.get("LOGIN_TEST_DATA_DIR") or project_dir / "data") / "audit"
+AUDIT_PREFIX = "auth_decisions"
+
+RING_SIZE = 10_000
+FLUSH_INTERVAL = 1.0
+MAX_BYTES = 16 * 1024 * 1024
+KEEP = 5
+READ_BLOCK = 64 * 1024
+SCAN_BYTES = 32 * 1024 * 1024      # recent() 1 回でファイルから読む上限
+DEFAULT_RETENTION_DAYS = 30
+PRUNE_INTERVAL = 3600.0            # 終了したプロセスのファイルを見直す間隔（秒）
+
+FIELDS = ("ts", "user", "app", "allowed", "reason", "exp", "verify_ms")
+
+AUDIT_RECORDS = REGISTRY.counter("login_test_auth_audit_records_total", "監査記録の件数（書き出し時に集計）", ("allowed",))
+AUDIT_FLUSHED = REGISTRY.counter("login_test_auth_audit_flushed_total", "ファイルへ書き出した監査記録の件数")
+AUDIT_DROPPED = REGISTRY.counter("login_test_auth_audit_dropped_total", "書き出す前にリングから溢れた監査記録の件数")
+AUDIT_PRUNED = REGISTRY.counter("login_test_auth_audit_pruned_files_total", "保持日数を過ぎて消した監査ログのファイル数")
+
+# (seq, ts, user, app, allowed, reason, exp, verify_ms)
+Record = Tuple[int, float, str, str, bool, str, Optional[int], Optional[float]]
+
+_ring: Deque[Record] = deque(maxlen=RING_SIZE)
+_ring_lock = threading.Lock()       # 採番と append を一緒に（リングを通し番号順に保つ）
+_seq = itertools.count(1)
+_flusher_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+_flushed_seq = 0
+_HOST = socket.gethostname().split(".")[0].replace("_", "-") or "host"
+
+def enabled() -> bool:
+    return (os.environ.get("LOGIN_TEST_AUTH_AUDIT") or "1").lower() not in ("0", "false", "off")
+
+def retention_days() -> int:
+    try:
+        return max(0, int(os.environ.get("LOGIN_TEST_AUTH_AUDIT_RETENTION_DAYS") or DEFAULT_RETENTION_DAYS))
+    except ValueError:
+        return DEFAULT_RETENTION_DAYS
+
+def record(user: Optional[str], app: str, allowed: bool, reason: str, *,
+           exp: Optional[int] = None, verify_ms: Optional[float] = None) -> None:
+    """判定を 1 件記録する（append のみ。書き出しはバックグラウンド）。"""
+    if not enabled():
+        return
+    rest = (time.time(), user or "", app, bool(allowed), reason,
+            int(exp) if isinstance(exp, (int, float)) else None,
+            round(verify_ms, 3) if verify_ms is not None else None)
+    with _ring_lock:
+        _ring.append((next(_seq), *rest))
+    if _flusher is None:
+        _start_flusher()
+
+# ─────────────────────────────────────────────────────────────
+# 書き出し（バックグラウンド）
+# ─────────────────────────────────────────────────────────────
+def own_log() -> Path:
+    return AUDIT_DIR / f"{AUDIT_PREFIX}.{_HOST}.{os.getpid()}.log"
+
+def _ring_tail(after_seq: int) -> List[Record]:
+    """
+    リングのうち通し番号が after_seq より大きい分（古い順）。リングは通し番号が連続しているので
+    件数は末尾の番号から分かり、末尾からその件数だけ取る（ロックの中の手間は新しい分に比例）。
+    """
+    with _ring_lock:
+        if not _ring:
+            return []
+        n = min(len(_ring), _ring[-1][0] - after_seq)
+        if n <= 0:
+            return []
+        tail = list(itertools.islice(reversed(_ring), n))
+    tail.reverse()
+    return tail
+
+def _encode(r: Record) -> str:
+    _, ts, user, app, allowed, reason, exp, verify_ms = r
+    return json.dumps([round(ts, 3), user, app, 1 if allowed else 0, reason, exp, verify_ms],
+                      ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def _rotate(path: Path) -> None:
+    for i in range(KEEP - 1, 0, -1):
+        src = path.with_name(f"{path.name}.{i}")
+        if src.exists():
+            os.replace(src, path.with_name(f"{path.name}.{i + 1}"))
+    os.replace(path, path.with_name(f"{path.name}.1"))
+
+def flush() -> int:
+    """リングのうち未書き出しの分を追記する。書き出した件数を返す。"""
+    global _flushed_seq
+    with _flusher_lock:
+        new = _ring_tail(_flushed_seq)      # 通し番号順なので末尾が最大
+        if not new:
+            return 0
+        dropped = new[0][0] - _flushed_seq - 1
+        if dropped > 0:
+            AUDIT_DROPPED.inc(amount=dropped)
+        path = own_log()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = "".join(_encode(r) for r in new).encode("utf-8")
+        try:
+            if path.stat().st_size + len(data) > MAX_BYTES:
+                _rotate(path)
+        except FileNotFoundError:
+            pass
+        with path.open("ab") as f:
+            f.write(data)
+        _flushed_seq = new[-1][0]
+    AUDIT_FLUSHED.inc(amount=len(new))
+    allowed = sum(1 for r in new if r[4])
+    AUDIT_RECORDS.inc("true", amount=allowed)
+    AUDIT_RECORDS.inc("false", amount=len(new) - allowed)
+    return len(new)
+
+def _flush_loop() -> None:
+    next_prune = 0.0
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            pass    # 次の周期で再試行（リングに残っている限り）
+        if time.monotonic() >= next_prune:
+            next_prune = time.monotonic() + PRUNE_INTERVAL
+            try:
+                prune()
+            except Exception:
+                pass
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def prune(now: Optional[float] = None) -> int:
+    """
+    終了したプロセスのファイル（.log と .log.1 … をまとめて）を、最後の書き込みから保持日数を過ぎたら消す。
+    このホストのものは pid が生きていれば残す（他ホストの生死は分からないので日数だけで判断）。消した数を返す。
+    """
+    days = retention_days()
+    if not days:
+        return 0
+    now = time.time() if now is None else now
+    me = own_log().name[:-len(".log")]
+    removed = 0
+    for chain in _log_chains():
+        stem = chain[0].name.partition(".log")[0]
+        parts = stem.split(".")
+        if stem == me or len(parts) != 3:
+            continue
+        _, host, pid = parts
+        if host == _HOST and pid.isdigit() and _pid_alive(int(pid)):
+            continue
+        try:
+            newest = max(p.stat().st_mtime for p in chain)
+        except OSError:
+            continue
+        if now - newest < days * 86400:
+            continue
+        for p in chain:
+            try:
+                p.unlink()
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        AUDIT_PRUNED.inc(amount=removed)
+    return removed
+
+def _start_flusher() -> None:
+    global _flusher
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_loop, name="auth-audit-flusher", daemon=True)
+        _flusher.start()
+
+# ─────────────────────────────────────────────────────────────
+# 参照
+# ─────────────────────────────────────────────────────────────
+def _as_dict(values: List[Any]) -> Dict[str, Any]:
+    d = dict(zip(FIELDS, values))
+    d["allowed"] = bool(d["allowed"])
+    return d
+
+def _log_chains() -> List[List[Path]]:
+    """プロセスごとのファイルを [.log, .log.1, …]（新しい順）にまとめ、最近書かれたプロセスから並べる。"""
+    if not AUDIT_DIR.exists():
+        return []
+    chains: Dict[str, List[Tuple[int, Path]]] = defaultdict(list)
+    for p in AUDIT_DIR.glob(f"{AUDIT_PREFIX}.*.log*"):
+        stem, _, suffix = p.name.partition(".log")
+        if suffix and not (suffix[0] == "." and suffix[1:].isdigit()):
+            continue
+        chains[stem].append((int(suffix[1:]) if suffix else 0, p))
+
+    def mtime(chain: List[Path]) -> float:
+        try:
+            return chain[0].stat().st_mtime
+        except OSError:
+            return 0.0
+
+    out = [[p for _, p in sorted(files)] for files in chains.values()]
+    return sorted(out, key=mtime, reverse=True)
+
+def _reversed_lines(path: Path, budget: List[int]) -> Iterator[bytes]:
+    """行を末尾から返す（READ_BLOCK ずつ後ろへ読む）。読んだバイト数を budget[0] から引き、尽きたら止める。"""
+    try:
+        f = path.open("rb")
+    except OSError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        head = b""
+        while pos > 0 and budget[0] > 0:
+            step = min(READ_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + head).split(b"\n")
+            budget[0] -= step
+            head = lines[0]         # 前のブロックに続く（途中から読んだ）行
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line
+        if pos == 0 and head:
+            yield head
+
+def recent(user: Optional[str] = None, limit: int = 100, *, include_files: bool = True,
+           scan_bytes: int = SCAN_BYTES) -> List[Dict[str, Any]]:
+    """
+    直近の判定を新しい順に最大 limit 件（user 指定でそのユーザーだけ）。
+    このプロセスのリングの未書き出し分と全プロセスのファイルを合わせる（書き出し済みの分はファイルから読む。
+    include_files=False ならリング全体から）。
+    ファイルは末尾から読み、合計 scan_bytes を読んでも足りなければそこまでの分を返す。
+    """
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    ring = _ring_tail(_flushed_seq if include_files else 0)
+    for r in reversed(ring):
+        if user is None or r[2] == user:
+            out.append(_as_dict([round(r[1], 3), *r[2:]]))
+            seen.add((round(r[1], 3), r[2], r[3]))
+            if len(out) >= limit:
+                break
+    if include_files:
+        needle = json.dumps(user, ensure_ascii=False).encode("utf-8") if user is not None else None
+        budget = [scan_bytes]
+        for chain in _log_chains():
+            found = 0
+            for path in chain:
+                for line in _reversed_lines(path, budget):
+                    if needle is not None and needle not in line:
+                        continue        # JSON を解かずに絞る
+                    try:
+                        values = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(values, list) or len(values) != len(FIELDS):
+                        continue
+                    if user is not None and values[1] != user:
+                        continue
+                    if (values[0], values[1], values[2]) in seen:
+                        continue        # リングで拾った分（このプロセスの書き出し済み）
+                    out.append(_as_dict(values))
+                    found += 1
+                    if found >= limit:
+                        break
+                if found >= limit or budget[0] <= 0:
+                    break
+            if budget[0] <= 0:
+                break
+    out.sort(key=lambda d: d["ts"], reverse=True)
+    return out[:limit]
+
+def status() -> Dict[str, Any]:
+    return {
+        "enabled": enabled(),
+        "ring": len(_ring),
+        "ring_size": RING_SIZE,
+        "flushed_seq": _flushed_seq,
+        "retention_days": retention_days(),
+        "file": str(own_log()),
+    }
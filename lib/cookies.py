@@ -0,0 +1,151 @@
+# login_test_app/lib/cookies.py
+"""
+Cookie の読み書きを 1 回の実行（rerun）あたり最小のコンポーネント呼び出しにまとめる。
+
+stx.CookieManager は get_all()・set()・delete() のたびにコンポーネントを描画する（= ブラウザとの往復）。
+set() は key の重複を避けるために毎回ユニークな key が要り、呼んだ数だけ iframe が増える。
+
+- 読み取り: CookieManager の生成時に取れる全 Cookie（getAll 1 回）を不変のスナップショットにして、
+  以後の get() はすべてそこから返す
+- 書き込み: set() / delete() はキューに積むだけ。実行の最後に flush() で
+  1 つの iframe（document.cookie への代入をまとめた script）として反映する
+  （同じ名前・path への操作は最後のものだけ）
+- round_trips にこの実行のコンポーネント呼び出し回数を数え、メトリクスにも出す
+
+    jar = cookie_jar("cm_diag")
+    jar.get("prec_sso")
+    jar.set("test_cookie", "v", max_age=60)
+    ...
+    jar.flush()     # ページの最後で
+"""
+from __future__ import annotations
+import datetime as dt
+import json
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from lib.metrics import REGISTRY
+
+COOKIE_ROUND_TRIPS = REGISTRY.histogram(
+    "login_test_cookie_round_trips", "1 回の実行あたりの Cookie コンポーネント呼び出し回数",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+COOKIE_OPS = REGISTRY.counter("login_test_cookie_ops_total", "まとめて反映した Cookie 操作の件数", ("op",))
+
+_EPOCH = "Thu, 01 Jan 1970 00:00:00 GMT"
+
+def _clean_path(path: Optional[str]) -> Optional[str]:
+    """属性の区切り（; と改行）を含む path は Cookie 文字列を壊すので取り除く。"""
+    if path is None:
+        return None
+    return "".join(ch for ch in path if ch not in ";\r\n").strip() or None
+
+class CookieJar:
+    def __init__(self, manager: Any, *, initial_round_trips: int = 1):
+        """manager は生成済みの CookieManager（生成時の getAll を 1 回と数える）。"""
+        self._cm = manager
+        self.round_trips = initial_round_trips
+        raw = getattr(manager, "cookies", None)
+        if not isinstance(raw, dict):
+            try:
+                raw = manager.get_all()     # cookies 属性を持たない版だけ
+                self.round_trips += 1
+            except Exception:
+                raw = {}
+        self.snapshot: Mapping[str, Any] = MappingProxyType(dict(raw or {}))
+        self._ops: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+        self._flushed = False
+
+    # ---- 読み取り（スナップショット）----
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.snapshot.get(name, default)
+
+    def get_all(self) -> Dict[str, Any]:
+        return dict(self.snapshot)
+
+    # ---- 書き込み（キュー）----
+    def set(self, name: str, value: Any, *, path: Optional[str] = "/", max_age: Optional[int] = None,
+            expires_at: Optional[dt.datetime] = None, same_site: Optional[str] = "Lax",
+            secure: Optional[bool] = None) -> None:
+        if not name:
+            return
+        path = _clean_path(path)
+        expires = None
+        if expires_at is not None:
+            expires = expires_at.astimezone(dt.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        self._ops[(name, path)] = {
+            "op": "set", "name": name, "value": value if isinstance(value, str) else json.dumps(value),
+            "path": path, "maxAge": max_age, "expires": expires, "sameSite": same_site, "secure": bool(secure),
+        }
+
+    def delete(self, name: str, *, path: Optional[str] = "/") -> None:
+        """失効（max-age=0）で削除する。path=None は現在のパス。"""
+        if not name:
+            return
+        path = _clean_path(path)
+        self._ops[(name, path)] = {
+            "op": "delete", "name": name, "value": "", "path": path, "maxAge": 0, "expires": _EPOCH,
+            "sameSite": None, "secure": False,
+        }
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """flush() で反映予定の操作（表示用）。"""
+        return [{k: v for k, v in op.items() if v is not None} for op in self._ops.values()]
+
+    def effective(self) -> Dict[str, Any]:
+        """スナップショットに未反映の操作を重ねた見込み（ブラウザ側は次の実行で反映）。"""
+        out = dict(self.snapshot)
+        for op in self._ops.values():
+            if op["op"] == "delete":
+                out.pop(op["name"], None)
+            else:
+                out[op["name"]] = op["value"]
+        return out
+
+    # ---- 反映 ----
+    def flush(self) -> int:
+        """キューの操作を 1 回のコンポーネント描画で反映する。反映した件数を返す（実行ごとに 1 回）。"""
+        if self._flushed:
+            return 0
+        self._flushed = True
+        ops = list(self._ops.values())
+        self._ops.clear()
+        if ops:
+            _apply(ops)
+            self.round_trips += 1
+            for op in ops:
+                COOKIE_OPS.inc(op["op"])
+        COOKIE_ROUND_TRIPS.observe(self.round_trips)
+        return len(ops)
+
+def _apply(ops: List[Dict[str, Any]]) -> None:
+    import streamlit as st
+
+    # iframe は同一オリジン（allow-same-origin）なので親ドキュメントの Cookie に書ける。
+    # 値は入力由来もあるので "<" をエスケープして script の外に出さない。
+    # 同じ内容でも毎回描画し直されるよう nonce を入れる
+    payload = json.dumps(ops, ensure_ascii=False).replace("<", "\\u003c")
+    html = f"""<script>
+// {time.time_ns()}
+const ops = {payload};
+const doc = window.parent.document;
+for (const o of ops) {{
+  let c = encodeURIComponent(o.name) + "=" + encodeURIComponent(o.value);
+  if (o.path) c += "; path=" + o.path;
+  if (o.maxAge !== null) c += "; max-age=" + o.maxAge;
+  if (o.expires) c += "; expires=" + o.expires;
+  if (o.sameSite) c += "; samesite=" + o.sameSite;
+  if (o.secure) c += "; secure";
+  doc.cookie = c;
+}}
+</script>"""
+    if hasattr(st, "iframe"):       # 新しい Streamlit（components.v1.html は非推奨）
+        st.iframe(html, height=1)
+    else:
+        import streamlit.components.v1 as components
+        components.html(html, height=0)
+
+def cookie_jar(key: str = "cookie_jar") -> CookieJar:
+    """CookieManager を 1 つ生成してスナップショットを取る（ページの先頭で 1 回だけ呼ぶ）。"""
+    import extra_streamlit_components as stx
+    return CookieJar(stx.CookieManager(key=key))
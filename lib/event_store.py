@@ -0,0 +1,712 @@
+# login_test_app/lib/event_store.py
+"""
+クリックイベントの保存先（JSONL, 1 行 = 1 イベント）と読み出し・集計。
+
+保存先: <project>/data/events/
+    button_clicks.jsonl                  … 統合済み（旧来の単一ファイル）
+    button_clicks.<host>.<pid>.jsonl     … 書き込みプロセスごとのシャード
+（LOGIN_TEST_DATA_DIR で data/ を差し替え可。負荷試験など）
+
+- 各プロセスは自分のシャードにだけ追記する（inode の取り合い・行の混在が起きない）
+- 読み出し（load_events / 範囲読み出し / 末尾表示）は全シャードを ts で k-way マージ
+- 書き手のいなくなったシャード（このホストのもの）はバックグラウンドで button_clicks.jsonl へ統合。
+  他ホストのシャードは pid の生死が分からないので触らない（そのホストのプロセスが統合する）
+
+時刻範囲の読み出し用に、シャードごとの疎インデックス <shard>.idx（"ts offset" の行）を
+書き込み側が INDEX_EVERY_LINES 行ごと / INDEX_EVERY_BYTES ごとに追記する。
+イベントは時刻順に追記されるので、範囲読み出しはインデックスを二分探索して
+開始位置へ seek し、該当区間だけを読む。
+"""
+from __future__ import annotations
+import bisect
+import contextlib
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+import datetime as dt
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from lib.metrics import AGGREGATION_SECONDS, CLICK_EVENTS, EVENT_LOG_BYTES, REGISTRY
+from lib.ingest import get_ingest_client
+from lib.rate_limit import coalesce_enabled, limiter_from_env
+from lib.rollups import Rollups, read_archive, write_consolidation
+from lib.sketches import MonthlySketches, MonthSketch
+
+HERE = Path(__file__).resolve()
+app_dir = HERE.parent.parent                    # .../login_test_app
+project_dir = app_dir.parent                    # .../login_test_project
+DATA_DIR = Path(os.environ.get("LOGIN_TEST_DATA_DIR") or project_dir / "data")
+LOG_DIR  = DATA_DIR / "events"
+LOG_PREFIX = "button_clicks"
+LOG_FILE = LOG_DIR / f"{LOG_PREFIX}.jsonl"      # 統合済みログ（1行1イベント(JSON)）
+INDEX_FILE = LOG_DIR / f"{LOG_PREFIX}.idx"      # 統合済みログの疎インデックス: "ts offset"
+ROLLUP_FILE = LOG_DIR / "rollups.json"          # ロールアップのチェックポイント
+ARCHIVE_FILE = LOG_DIR / "archive_rollups.json" # 保持期間切れで削除した生イベントの月次件数
+CONSOLIDATION_FILE = LOG_DIR / "consolidated.json"  # 直近の統合の記録（ロールアップの引き継ぎ用）
+SKETCH_DIR = LOG_DIR / "sketches"               # 月別スケッチ（HLL / Top-K）
+CONSOLIDATE_LOCK = LOG_DIR / ".consolidate.lock"
+
+INDEX_EVERY_LINES = 1000
+INDEX_EVERY_BYTES = 64 * 1024
+TS_SLACK_SECONDS = 5        # 複数シャード間の ts の前後ずれの許容幅
+SHARD_IDLE_SECONDS = 600    # これ以上更新の無い他プロセスのシャードは統合対象
+CONSOLIDATE_INTERVAL = 300  # 統合ジョブの実行間隔（秒）
+
+DEFAULT_APP  = "login_test"
+DEFAULT_PAGE = "01_保護テスト"
+
+SUPPRESSED_BUTTON = "_suppressed"   # 流量制限で抑止した押下のまとめイベント
+
+CLICK_LIMITER = limiter_from_env()  # ユーザーごとのトークンバケット（None なら無制限）
+CLICKS_THROTTLED = REGISTRY.counter("login_test_click_events_throttled_total", "流量制限で記録しなかった押下", ("button",))
+EVENT_SHARDS = REGISTRY.gauge("login_test_event_shards", "イベントログのシャード数")
+EVENT_OPEN_HANDLES = REGISTRY.gauge("login_test_event_open_handles", "書き込み用に開いているシャードのファイル数")
+SHARDS_CONSOLIDATED = REGISTRY.counter("login_test_event_shards_consolidated_total", "統合したシャード数")
+
+# ─────────────────────────────────────────────────────────────
+# シャード
+# ─────────────────────────────────────────────────────────────
+_HOST = socket.gethostname().split(".")[0].replace("_", "-") or "host"
+
+def shard_name(pid: int) -> str:
+    """このホストの pid の書き手のシャード名。"""
+    return f"{LOG_PREFIX}.{_HOST}.{pid}.jsonl"
+
+def own_shard() -> Path:
+    """このプロセスの書き込み先（fork 後も pid で分かれる）。"""
+    return LOG_DIR / shard_name(os.getpid())
+
+def list_shards() -> List[Path]:
+    """統合済みログ + 全シャード（名前順）。"""
+    out: List[Path] = []
+    if LOG_FILE.exists():
+        out.append(LOG_FILE)
+    if LOG_DIR.exists():
+        out.extend(sorted(LOG_DIR.glob(f"{LOG_PREFIX}.*.jsonl")))
+    return out
+
+def _index_file(shard: Path) -> Path:
+    return shard.with_suffix(".idx")
+
+def _shard_pid(shard: Path) -> Optional[Tuple[str, int]]:
+    parts = shard.name.split(".")
+    if len(parts) != 4:
+        return None
+    try:
+        return parts[1], int(parts[2])
+    except ValueError:
+        return None
+
+_writer_lock = threading.Lock()
+_writer: Dict[str, Any] = {}       # pid / path / fh
+
+def _writer_gone() -> bool:
+    """開いているシャードがパスから外れた（消された・置き換えられた）か。"""
+    try:
+        return os.stat(_writer["path"]).st_ino != os.fstat(_writer["fh"].fileno()).st_ino
+    except OSError:
+        return True
+
+def _writer_handle() -> Tuple[Path, IO[bytes]]:
+    """
+    自シャードの追記ハンドル（プロセスにつき 1 つを開きっぱなし）。
+    パスの inode が変わっていたら（外から消された等）開き直す。消えたファイルへ書き続けて失わないように。
+    呼び出しは _writer_lock 下。
+    """
+    pid = os.getpid()
+    if _writer.get("pid") != pid or _writer.get("fh") is None or _writer_gone():
+        if _writer.get("pid") == pid and _writer.get("fh") is not None:
+            with contextlib.suppress(OSError):
+                _writer["fh"].close()
+            # 前のファイルの位置を指すインデックスは使えない（新しいファイルで作り直す）
+            _index_state.pop(_writer["path"].name, None)
+            _index_file(_writer["path"]).unlink(missing_ok=True)
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        path = own_shard()
+        _writer.update(pid=pid, path=path, fh=path.open("ab", buffering=0))
+        EVENT_OPEN_HANDLES.set(1)
+        _start_consolidator()
+    return _writer["path"], _writer["fh"]
+
+def make_click_event(
+    user: str,
+    button_id: str,
+    meta: dict | None = None,
+    *,
+    app: str = DEFAULT_APP,
+    page: str = DEFAULT_PAGE,
+    now: Optional[int] = None,
+) -> Dict[str, Any]:
+    """1イベント {ts, iso, month, app, page, user, button, meta} を作る（書き込みはしない）。"""
+    now = int(time.time()) if now is None else now
+    d = dt.datetime.fromtimestamp(now)
+    return {
+        "ts": now,
+        "iso": d.isoformat(timespec="seconds"),
+        "month": d.strftime("%Y-%m"),
+        "app": app,
+        "page": page,
+        "user": user,
+        "button": button_id,
+        "meta": meta or {},
+    }
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+def append_click_event(
+    user: str,
+    button_id: str,
+    meta: dict | None = None,
+    *,
+    app: str = DEFAULT_APP,
+    page: str = DEFAULT_PAGE,
+) -> Optional[Dict[str, Any]]:
+    """
+    JSONL（自プロセスのシャード）に追記: 1行 = 1イベント
+    {ts, iso, month, app, page, user, button, meta}
+    ユーザーごとの流量制限（CLICK_LIMITER）を超えた押下は記録せず None を返す。
+    取り込みデーモン（LOGIN_TEST_INGEST_SOCKET）が動いていればそちらへ投げるだけで戻る。
+    """
+    if CLICK_LIMITER is not None:
+        allowed, suppressed = CLICK_LIMITER.acquire(user)
+        if not allowed:
+            CLICKS_THROTTLED.inc(button_id)
+            return None
+        if suppressed and coalesce_enabled():
+            # 抑止していた分を 1 イベントにまとめて残す（集計では SUPPRESSED_BUTTON として 1 件）
+            _record(make_click_event(user, SUPPRESSED_BUTTON, {"suppressed": suppressed}, app=app, page=page))
+    return _record(make_click_event(user, button_id, meta, app=app, page=page))
+
+def _record(event: Dict[str, Any]) -> Dict[str, Any]:
+    data = encode_event(event)
+    client = get_ingest_client()
+    if client is not None and client.send(data):
+        CLICK_EVENTS.inc(event["button"])
+        return event
+    append_events([event], [data])
+    return event
+
+def append_events(events: List[Dict[str, Any]], encoded: Optional[List[bytes]] = None) -> int:
+    """
+    複数イベントを 1 回の write で自シャードへ追記し、インデックス・ロールアップ・スケッチを更新する。
+    書き込んだバイト数を返す。
+    """
+    if not events:
+        return 0
+    encoded = encoded if encoded is not None else [encode_event(e) for e in events]
+    with _writer_lock:
+        shard, fh = _writer_handle()
+        base = os.fstat(fh.fileno()).st_size
+        fh.write(b"".join(encoded))
+        offset = base
+        for event, data in zip(events, encoded):
+            _maybe_index(shard, int(event.get("ts") or 0), offset)
+            offset += len(data)
+    offset = base
+    for event, data in zip(events, encoded):
+        ROLLUPS.on_append(event, shard, offset, len(data))
+        SKETCHES.add(event)
+        CLICK_EVENTS.inc(str(event.get("button") or "-"))
+        offset += len(data)
+    EVENT_LOG_BYTES.inc(amount=offset - base)
+    return offset - base
+
+def shard_stats() -> Dict[str, Any]:
+    shards = list_shards()
+    total = 0
+    for p in shards:
+        try:
+            total += p.stat().st_size
+        except OSError:
+            pass
+    EVENT_SHARDS.set(len(shards))
+    return {
+        "shards": len(shards),
+        "bytes": total,
+        "open_handles": 1 if _writer.get("fh") is not None and _writer.get("pid") == os.getpid() else 0,
+        "own_shard": own_shard().name,
+    }
+
+# ─────────────────────────────────────────────────────────────
+# 疎タイムスタンプインデックス（シャードごと）
+# ─────────────────────────────────────────────────────────────
+_index_state: Dict[str, Dict[str, int]] = {}     # shard 名 -> last_offset / lines_since
+
+def _read_index(shard: Path) -> List[Tuple[int, int]]:
+    idx = _index_file(shard)
+    if not idx.exists():
+        return []
+    out: List[Tuple[int, int]] = []
+    with idx.open("r", encoding="ascii") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                out.append((int(parts[0]), int(parts[1])))
+    out.sort(key=lambda e: e[1])
+    return out
+
+def _maybe_index(shard: Path, ts: int, offset: int) -> None:
+    """追記した行の開始位置を、間隔を空けてインデックスへ記録する（_writer_lock 下で呼ぶ）。"""
+    state = _index_state.get(shard.name)
+    if state is None:
+        entries = _read_index(shard)
+        if not entries and offset > 0:
+            entries = rebuild_index(shard)
+        state = _index_state[shard.name] = {
+            "last_offset": entries[-1][1] if entries else -INDEX_EVERY_BYTES,
+            "lines_since": INDEX_EVERY_LINES if not entries else 0,
+        }
+    state["lines_since"] += 1
+    if state["lines_since"] < INDEX_EVERY_LINES and offset - state["last_offset"] < INDEX_EVERY_BYTES:
+        return
+    with _index_file(shard).open("a", encoding="ascii") as f:
+        f.write(f"{ts} {offset}\n")
+    state["last_offset"] = offset
+    state["lines_since"] = 0
+
+def rebuild_index(shard: Path = LOG_FILE) -> List[Tuple[int, int]]:
+    """シャード全体を走査してインデックスを作り直す（初回・破損時用）。"""
+    entries: List[Tuple[int, int]] = []
+    if shard.exists():
+        last_off, lines = -INDEX_EVERY_BYTES, INDEX_EVERY_LINES
+        with shard.open("rb") as f:
+            offset = 0
+            for raw in f:
+                lines += 1
+                if raw.strip() and (lines >= INDEX_EVERY_LINES or offset - last_off >= INDEX_EVERY_BYTES):
+                    try:
+                        ts = int(json.loads(raw).get("ts") or 0)
+                    except ValueError:
+                        ts = None
+                    if ts is not None:
+                        entries.append((ts, offset))
+                        last_off, lines = offset, 0
+                offset += len(raw)
+    idx = _index_file(shard)
+    idx.parent.mkdir(parents=True, exist_ok=True)
+    tmp = idx.with_name(f".{idx.name}.{os.getpid()}.tmp")
+    tmp.write_text("".join(f"{ts} {off}\n" for ts, off in entries), encoding="ascii")
+    os.replace(tmp, idx)
+    return entries
+
+# ─────────────────────────────────────────────────────────────
+# 読み出し（シャードの k-way マージ）
+# ─────────────────────────────────────────────────────────────
+def _iter_shard(shard: Path, offset: int = 0) -> Iterator[dict]:
+    try:
+        f = shard.open("rb")
+    except OSError:
+        return
+    with f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.strip():
+                continue
+            try:
+                yield json.loads(raw)
+            except ValueError:
+                continue
+
+def _merge(iters: Iterable[Iterator[dict]]) -> Iterator[dict]:
+    return heapq.merge(*iters, key=lambda r: r.get("ts") or 0)
+
+def iter_events() -> Iterator[dict]:
+    """全イベントを ts 順に返す（全シャードの k-way マージ）。"""
+    return _merge(_iter_shard(p) for p in list_shards())
+
+def _iter_shard_between(shard: Path, start_ts: int, end_ts: int) -> Iterator[dict]:
+    try:
+        size = shard.stat().st_size
+    except OSError:
+        return
+    entries = _read_index(shard)
+    if (not entries and size > 0) or (entries and entries[-1][1] >= size):
+        entries = rebuild_index(shard)
+    # start より（許容幅ぶん）前の最後のエントリから読み始める
+    ts_keys = [e[0] for e in entries]
+    i = bisect.bisect_left(ts_keys, start_ts - TS_SLACK_SECONDS) - 1
+    offset = entries[i][1] if i >= 0 else 0
+    for row in _iter_shard(shard, offset):
+        ts = row.get("ts") or 0
+        if ts >= end_ts + TS_SLACK_SECONDS:
+            break
+        if start_ts <= ts < end_ts:
+            yield row
+
+def iter_events_between(start_ts: int, end_ts: int) -> Iterator[dict]:
+    """
+    start_ts <= ts < end_ts のイベントを ts 順に返す。
+    シャードごとにインデックスで開始位置へ seek し、end_ts を（許容幅込みで）越えたら打ち切る。
+    """
+    return _merge(_iter_shard_between(p, start_ts, end_ts) for p in list_shards())
+
+def load_events_between(start_ts: int, end_ts: int) -> list[dict]:
+    return list(iter_events_between(start_ts, end_ts))
+
+def load_events(max_lines: int | None = None) -> list[dict]:
+    rows = list(iter_events())
+    if max_lines and max_lines > 0:
+        rows = rows[-max_lines:]
+    return rows
+
+def _tail_shard(shard: Path, n: int, chunk_size: int) -> list[dict]:
+    try:
+        f = shard.open("rb")
+    except OSError:
+        return []
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = [ln for ln in buf.split(b"\n") if ln.strip()]
+    if pos > 0:
+        lines = lines[1:]       # 先頭は途中から読んだ行かもしれない
+    rows = []
+    for ln in lines[-n:]:
+        try:
+            rows.append(json.loads(ln))
+        except ValueError:
+            continue
+    return rows
+
+def tail_events(n: int = 20, *, chunk_size: int = 64 * 1024) -> list[dict]:
+    """末尾 n 件（全シャードの末尾をマージ、古い→新しい順）。"""
+    if n <= 0:
+        return []
+    rows = list(_merge(iter(_tail_shard(p, n, chunk_size)) for p in list_shards()))
+    return rows[-n:]
+
+def store_version() -> Tuple[Tuple[str, int, int], ...]:
+    """
+    イベントストアの版（シャードごとの 名前, inode, サイズ）。追記のみなので
+    どれかのサイズが増えれば内容が変わった印。他プロセスの書き込みも拾える。
+    """
+    out = []
+    for p in list_shards():
+        try:
+            s = p.stat()
+        except OSError:
+            continue
+        out.append((p.name, s.st_ino, s.st_size))
+    return tuple(out)
+
+# ─────────────────────────────────────────────────────────────
+# 集計
+# ─────────────────────────────────────────────────────────────
+ROLLUPS = Rollups(list_shards, ROLLUP_FILE, ARCHIVE_FILE, CONSOLIDATION_FILE)  # 時・日・月の件数（書き込み時に更新）
+SKETCHES = MonthlySketches(SKETCH_DIR)          # 月間ユニークユーザー / 上位ボタン（近似）
+
+def rebuild_sketches() -> int:
+    """
+    生イベントから月別スケッチのベースを作り直す（導入前の履歴の取り込み用）。読んだ件数を返す。
+    このホストで生きている書き手のシャードは、その書き手のスケッチファイルに入っているので読まずに残す
+    （消すと書き手が次の保存で書き戻し、二重に数える）。他ホストのシャード・スケッチには触れない。
+    統合・保持期間の削除と同じロックを取り、取れなければ何もせず -1。
+    """
+    with maintenance_lock() as locked:
+        if not locked:
+            return -1
+        sources = [LOG_FILE] if LOG_FILE.exists() else []
+        for p in list_shards():
+            owner = _shard_pid(p)
+            if owner is not None and owner[0] == _HOST and not _pid_alive(owner[1]):
+                sources.append(p)
+        months: Dict[str, MonthSketch] = {}
+        n = 0
+        for p in sources:
+            for row in _iter_shard(p):
+                month = str(row.get("month") or "unknown")
+                sk = months.get(month)
+                if sk is None:
+                    sk = months[month] = MonthSketch()
+                sk.add(row)
+                n += 1
+        SKETCHES.replace_base(months, _pid_alive)
+        return n
+
+def _archive_snapshot() -> Tuple[Dict[Tuple[str, str, str], int], Dict[str, int]]:
+    """
+    archive の件数（(user, month, button) -> n）と、シャードごとに読み飛ばす先頭バイト数。
+    skip は inode が今のシャードと一致するときだけ使う（Rollups と同じ扱い）。
+    archive と skip を書いてから削除するまでの間に落ちても、畳み込み済みの先頭を二重に数えない。
+    """
+    archive = read_archive(ARCHIVE_FILE)
+    counts = {(user, month, btn): n for (month, user, btn), n in archive["counts"].items()}
+    skips: Dict[str, int] = {}
+    for p in list_shards():
+        skip = archive["skip"].get(p.name)
+        if skip is None:
+            continue
+        try:
+            if p.stat().st_ino == skip[0]:
+                skips[p.name] = skip[1]
+        except OSError:
+            pass
+    return counts, skips
+
+def aggregate_by_user_month(rows: Optional[Iterable[dict]] = None, *, include_archive: bool = False) -> list[dict]:
+    """
+    ユーザー×月×ボタンの件数を集計。rows を省くと全シャードを読む。
+    include_archive=True なら保持期間切れで削除済みの分（archive）も足し、シャードは skip の先から読む
+    （rows は渡せない。渡された行が畳み込み済みの分を含むか分からないため）。
+    """
+    if include_archive and rows is not None:
+        raise ValueError("include_archive=True では rows を渡さない（シャードを skip の先から読む）")
+    with AGGREGATION_SECONDS.time("user_month"):
+        agg = defaultdict(int)
+        if include_archive:
+            counts, skips = _archive_snapshot()
+            agg.update(counts)
+            rows = _merge(_iter_shard(p, skips.get(p.name, 0)) for p in list_shards())
+        elif rows is None:
+            rows = iter_events()
+        for r in rows:
+            user = r.get("user") or "unknown"
+            month = r.get("month") or "unknown"
+            btn = r.get("button") or "-"
+            agg[(user, month, btn)] += 1
+        return _user_month_rows(agg)
+
+def _user_month_rows(agg: Dict[Tuple[str, str, str], int]) -> list[dict]:
+    out = []
+    for (user, month, btn), cnt in sorted(agg.items(), key=lambda x: (x[0][1], x[0][0], x[0][2])):
+        out.append({"user": user, "month": month, "button": btn, "count": cnt})
+    return out
+
+# ---- 並列集計（年次レポートなど全履歴の走査用） ----
+PARALLEL_CHUNK_BYTES = 32 * 1024 * 1024
+
+def _count_range(path: str, start: int, end: int) -> Dict[Tuple[str, str, str], int]:
+    """
+    [start, end) で「始まる」行だけを数える（ワーカープロセスで実行）。
+    start が行の途中なら次の行頭まで読み飛ばすので、隣の範囲と重複・欠落しない。
+    """
+    agg: Dict[Tuple[str, str, str], int] = defaultdict(int)
+    loads = json.loads
+    with open(path, "rb") as f:
+        pos = start
+        if start > 0:
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())     # start-1 が改行なら start から
+        while pos < end:
+            raw = f.readline()
+            if not raw:
+                break
+            pos += len(raw)
+            if not raw.strip():
+                continue
+            try:
+                r = loads(raw)
+            except ValueError:
+                continue
+            agg[(r.get("user") or "unknown", r.get("month") or "unknown", r.get("button") or "-")] += 1
+    return dict(agg)
+
+def _split_ranges(shards: List[Path], chunk_bytes: int, workers: int,
+                  skips: Optional[Dict[str, int]] = None) -> List[Tuple[str, int, int]]:
+    """シャードを範囲に分ける。skips にあるシャードはその offset（行頭）から。"""
+    sizes = []
+    for p in shards:
+        try:
+            sizes.append((p, (skips or {}).get(p.name, 0), p.stat().st_size))
+        except OSError:
+            continue
+    total = sum(max(0, sz - start) for _, start, sz in sizes)
+    # 小さいログでもワーカー数ぶん程度には分ける（大きいログは chunk_bytes 単位）
+    step = max(1, min(chunk_bytes, -(-total // max(1, workers * 4)) if total else chunk_bytes))
+    return [(str(p), off, min(off + step, sz)) for p, start, sz in sizes for off in range(start, sz, step)]
+
+def aggregate_by_user_month_parallel(
+    *,
+    workers: Optional[int] = None,
+    chunk_bytes: int = PARALLEL_CHUNK_BYTES,
+    include_archive: bool = False,
+) -> list[dict]:
+    """
+    全シャードを行境界に揃えたバイト範囲に分け、ProcessPoolExecutor で数えてマージする。
+    結果は aggregate_by_user_month(include_archive=...) と同一（並び順も同じ）。
+    include_archive=True なら archive を足し、skip 済みの先頭は数えない。
+    workers=1 ならプロセスを起こさずその場で数える。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    agg: Dict[Tuple[str, str, str], int] = defaultdict(int)
+    skips: Dict[str, int] = {}
+    if include_archive:
+        counts, skips = _archive_snapshot()
+        agg.update(counts)
+    ranges = _split_ranges(list_shards(), chunk_bytes, workers, skips)
+    with AGGREGATION_SECONDS.time("user_month_parallel"):
+        if workers <= 1 or len(ranges) <= 1:
+            parts = (_count_range(*r) for r in ranges)
+            for part in parts:
+                for key, n in part.items():
+                    agg[key] += n
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for part in pool.map(_count_range, *zip(*ranges)):
+                    for key, n in part.items():
+                        agg[key] += n
+        return _user_month_rows(agg)
+
+def summary_snapshot(version: Optional[tuple] = None, tail: int = 20) -> Dict[str, Any]:
+    """
+    集計パネル用のスナップショット（末尾 tail 件 + ユーザー×月×ボタン集計）。
+    集計はロールアップから読むので、イベント量ではなくグループ数に比例する。
+    version は呼び出し側のキャッシュキー用（中身には使わない）。
+    """
+    with AGGREGATION_SECONDS.time("rollup_user_month"):
+        agg = ROLLUPS.user_month_table()
+    return {
+        "version": version if version is not None else store_version(),
+        "count": sum(r["count"] for r in agg),
+        "tail": tail_events(tail),
+        "agg": agg,
+        "shards": shard_stats(),
+    }
+
+def prewarm() -> Dict[str, Any]:
+    """
+    起動時の事前準備（lib/prewarm から呼ぶ）。索引の無いシャードの索引を作り、
+    ロールアップをチェックポイント＋未反映分まで読み込んでおく（最初の利用者が払わないように）。
+    """
+    indexed = 0
+    for shard in list_shards():
+        try:
+            if shard.stat().st_size > 0 and not _index_file(shard).exists():
+                rebuild_index(shard)
+                indexed += 1
+        except OSError:
+            continue
+    ROLLUPS.refresh()
+    return {"shards": len(list_shards()), "indexed": indexed, "events": ROLLUPS.total()}
+
+# ─────────────────────────────────────────────────────────────
+# 休止シャードの統合（バックグラウンド）
+# ─────────────────────────────────────────────────────────────
+_consolidator_started = False
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _idle_shards(now: float) -> List[Path]:
+    out = []
+    for p in LOG_DIR.glob(f"{LOG_PREFIX}.*.jsonl") if LOG_DIR.exists() else []:
+        owner = _shard_pid(p)
+        if owner is None or p == own_shard():
+            continue
+        host, pid = owner
+        if host != _HOST:
+            continue                    # 他ホストの書き手の生死はここから分からない（そのホストの統合に任せる）
+        if _pid_alive(pid):
+            continue                    # 書き手がまだ生きている
+        try:
+            if now - p.stat().st_mtime < SHARD_IDLE_SECONDS:
+                continue
+        except OSError:
+            continue
+        out.append(p)
+    return out
+
+@contextlib.contextmanager
+def maintenance_lock() -> Iterator[bool]:
+    """
+    button_clicks.jsonl を書き換える保守ジョブ（統合・保持期間の削除）どうしの排他。
+    取れなければ False（待たない）。追記側はこのロックを取らないので止まらない。
+    """
+    try:
+        import fcntl
+    except ImportError:     # Windows では保守ジョブを動かさない
+        yield False
+        return
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with CONSOLIDATE_LOCK.open("a") as lockf:
+        try:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        yield True
+
+def consolidate_idle_shards(now: Optional[float] = None) -> int:
+    """
+    書き手のいない休止シャードを button_clicks.jsonl へ ts 順にマージして削除する。
+    複数プロセスが同時に走らないよう flock で排他（取れなければ何もしない）。統合数を返す。
+    """
+    with maintenance_lock() as locked:
+        if not locked:
+            return 0
+        idle = _idle_shards(now if now is not None else time.time())
+        if not idle:
+            return 0
+        sources = ([LOG_FILE] if LOG_FILE.exists() else []) + idle
+        tmp = LOG_FILE.with_name(f".{LOG_FILE.name}.{os.getpid()}.tmp")
+        # 統合元の今の (inode, サイズ)。書き手はいないのでこの後も変わらない。
+        # 先に自分のロールアップを統合元の末尾まで追いつかせておき、置き換え後は読み直さずに引き継ぐ
+        ROLLUPS.refresh()
+        covered: Dict[str, Tuple[int, int]] = {}
+        for p in sources:
+            s = p.stat()
+            covered[p.name] = (s.st_ino, s.st_size)
+
+        def raw_lines(p: Path) -> Iterator[Tuple[int, bytes]]:
+            with p.open("rb") as f:
+                for raw in f:
+                    if not raw.strip():
+                        continue
+                    if not raw.endswith(b"\n"):
+                        raw += b"\n"
+                    try:
+                        ts = int(json.loads(raw).get("ts") or 0)
+                    except ValueError:
+                        continue
+                    yield ts, raw
+
+        with tmp.open("wb") as out:
+            for _, raw in heapq.merge(*(raw_lines(p) for p in sources), key=lambda x: x[0]):
+                out.write(raw)
+        merged = tmp.stat()
+        write_consolidation(CONSOLIDATION_FILE, (LOG_FILE.name, merged.st_ino, merged.st_size), covered)
+        os.replace(tmp, LOG_FILE)
+        for p in idle:
+            p.unlink(missing_ok=True)
+            _index_file(p).unlink(missing_ok=True)
+        rebuild_index(LOG_FILE)
+        SHARDS_CONSOLIDATED.inc(amount=len(idle))
+        return len(idle)
+
+def _consolidate_loop() -> None:
+    from lib import retention   # retention が event_store を import するのでここで読む
+    while True:
+        time.sleep(CONSOLIDATE_INTERVAL)
+        try:
+            consolidate_idle_shards()
+            SKETCHES.compact(_pid_alive)
+            retention.run_retention()
+            shard_stats()
+        except Exception:
+            pass    # 次の周期で再試行
+
+def _start_consolidator() -> None:
+    global _consolidator_started
+    if _consolidator_started:
+        return
+    _consolidator_started = True
+    threading.Thread(target=_consolidate_loop, name="event-shard-consolidator", daemon=True).start()
@@ -0,0 +1,236 @@
+# login_test_app/lib/export.py
+"""
+クリック履歴・ユーザー×月×ボタン集計のエクスポート（CSV / Parquet）。
+
+イベントストアをジェネレータで読み、ユーザー・月で絞り込み、一定行数ごとに
+エンコードしてファイルへ書き出す（行数に関係なくメモリは一定）。
+- CSV: UTF-8（BOM 付き。Excel でそのまま開ける）
+- Parquet: pyarrow があれば ROW_GROUP_ROWS 行ごとに row group を書く（任意依存）
+
+出力先: <data>/exports/（最後に使われて（表示・ダウンロード）から EXPORT_TTL_SECONDS を過ぎたものは
+次回の書き出し時に削除）。ファイル名には所有者のタグを入れ、ダウンロード時に消えていれば作り直す。
+
+ダウンロード:
+- Streamlit の st.download_button は押された時点で中身を丸ごとメモリ（メディアストア）に載せるので、
+  INLINE_MAX_BYTES 以下のファイルだけボタンで渡す
+- それより大きいものはクエリ API（lib/query_api の /api/v1/export）が CHUNK_BYTES ずつ読んで送る
+"""
+from __future__ import annotations
+import csv
+import datetime as dt
+import hashlib
+import io
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from lib.event_store import DATA_DIR, ROLLUPS, iter_events, iter_events_between
+from lib.metrics import REGISTRY
+
+EXPORT_DIR = DATA_DIR / "exports"
+EXPORT_TTL_SECONDS = 3600
+BATCH_ROWS = 5000
+ROW_GROUP_ROWS = 50_000
+CHUNK_BYTES = 1 << 20
+
+EVENT_FIELDS = ("ts", "iso", "month", "app", "page", "user", "button", "meta")
+AGG_FIELDS = ("month", "user", "button", "count")
+KINDS = ("events", "aggregate")
+FORMATS = ("csv", "parquet")
+
+_NAME_RE = re.compile(r"^(events|aggregate)_[0-9A-Za-z-]+_([0-9a-f]{12})_[0-9a-f]{32}\.(csv|parquet)$")
+
+EXPORTS = REGISTRY.counter("login_test_exports_total", "エクスポート回数", ("kind", "format"))
+EXPORT_ROWS = REGISTRY.counter("login_test_export_rows_total", "エクスポートした行数", ("kind",))
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401  任意依存
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def available_formats() -> List[str]:
+    return [f for f in FORMATS if f != "parquet" or parquet_available()]
+
+# ─────────────────────────────────────────────────────────────
+# 行の生成（絞り込み）
+# ─────────────────────────────────────────────────────────────
+def month_range(month: str) -> Tuple[int, int]:
+    """"YYYY-MM" のローカル時刻での [開始, 翌月開始) の epoch 秒。"""
+    start = dt.datetime.strptime(month, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+def iter_event_rows(user: Optional[str] = None, month: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """生イベント（ts 順）。月指定ならインデックスでその月の範囲だけ読む。"""
+    rows = iter_events_between(*month_range(month)) if month else iter_events()
+    for r in rows:
+        if user is not None and r.get("user") != user:
+            continue
+        if month is not None and r.get("month") != month:
+            continue
+        out = {f: r.get(f) for f in EVENT_FIELDS}
+        out["meta"] = json.dumps(r.get("meta") or {}, ensure_ascii=False)
+        yield out
+
+def iter_aggregate_rows(user: Optional[str] = None, month: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """ロールアップ（保持期間切れで削除済みの分も含む）から。"""
+    for r in ROLLUPS.user_month_table():
+        if user is not None and r["user"] != user:
+            continue
+        if month is not None and r["month"] != month:
+            continue
+        yield {f: r[f] for f in AGG_FIELDS}
+
+def _batched(rows: Iterable[Dict[str, Any]], n: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# ─────────────────────────────────────────────────────────────
+# エンコード
+# ─────────────────────────────────────────────────────────────
+def iter_csv(rows: Iterable[Dict[str, Any]], fields: Sequence[str], *, batch_rows: int = BATCH_ROWS) -> Iterator[bytes]:
+    """CSV を batch_rows 行ずつの bytes で返す（先頭に BOM とヘッダー）。"""
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=list(fields), lineterminator="\r\n")
+    w.writeheader()
+    yield ("\ufeff" + buf.getvalue()).encode("utf-8")
+    for batch in _batched(rows, batch_rows):
+        buf.seek(0)
+        buf.truncate()
+        w.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+
+def _parquet_schema(fields: Sequence[str]):
+    import pyarrow as pa
+    ints = {"ts", "count"}
+    return pa.schema([(f, pa.int64() if f in ints else pa.string()) for f in fields])
+
+def write_parquet(rows: Iterable[Dict[str, Any]], fields: Sequence[str], path: Path,
+                  *, row_group_rows: int = ROW_GROUP_ROWS) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(fields)
+    n = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        for batch in _batched(rows, row_group_rows):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema), row_group_size=row_group_rows)
+            n += len(batch)
+    return n
+
+def write_csv(rows: Iterable[Dict[str, Any]], fields: Sequence[str], path: Path) -> int:
+    n = 0
+
+    def counted() -> Iterator[Dict[str, Any]]:
+        nonlocal n
+        for r in rows:
+            n += 1
+            yield r
+
+    with path.open("wb") as f:
+        for chunk in iter_csv(counted(), fields):
+            f.write(chunk)
+    return n
+
+# ─────────────────────────────────────────────────────────────
+# ファイルへ書き出し
+# ─────────────────────────────────────────────────────────────
+def _purge_old_exports(now: float) -> None:
+    if not EXPORT_DIR.exists():
+        return
+    for p in EXPORT_DIR.iterdir():
+        try:
+            if now - p.stat().st_mtime > EXPORT_TTL_SECONDS:
+                p.unlink()
+        except OSError:
+            continue
+
+def inline_max_bytes() -> int:
+    """ダウンロードボタンで渡す上限（LOGIN_TEST_EXPORT_INLINE_MAX_MB、既定 64MB）。"""
+    try:
+        mb = float(os.environ.get("LOGIN_TEST_EXPORT_INLINE_MAX_MB") or 64)
+    except ValueError:
+        mb = 64
+    return max(0, int(mb * (1 << 20)))
+
+def owner_tag(user: Optional[str]) -> str:
+    return hashlib.sha256((user or "").encode("utf-8")).hexdigest()[:12]
+
+def export_file(kind: str, fmt: str, *, user: Optional[str] = None, month: Optional[str] = None) -> Tuple[Path, int]:
+    """
+    kind（events / aggregate）を fmt（csv / parquet）で書き出し、(パス, 行数) を返す。
+    書きかけのファイルは見えないよう一時名で書いてから rename する。
+    """
+    if kind not in KINDS:
+        raise ValueError(f"未知のエクスポート種別: {kind}")
+    if fmt not in FORMATS:
+        raise ValueError(f"未知の形式: {fmt}")
+    if fmt == "parquet" and not parquet_available():
+        raise RuntimeError("Parquet 出力には pyarrow が必要です")
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    _purge_old_exports(time.time())
+
+    if kind == "events":
+        rows, fields = iter_event_rows(user, month), EVENT_FIELDS
+    else:
+        rows, fields = iter_aggregate_rows(user, month), AGG_FIELDS
+    path = EXPORT_DIR / f"{kind}_{month or 'all'}_{owner_tag(user)}_{uuid.uuid4().hex}.{fmt}"
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        n = write_csv(rows, fields, tmp) if fmt == "csv" else write_parquet(rows, fields, tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    EXPORTS.inc(kind, fmt)
+    EXPORT_ROWS.inc(kind, amount=n)
+    return path, n
+
+def keep_export(path: Path) -> bool:
+    """使われた印に mtime を更新する（表示中のファイルを期限切れで消さない）。無ければ False。"""
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+def ensure_export(path: Path, kind: str, fmt: str, *, user: Optional[str] = None,
+                  month: Optional[str] = None) -> Path:
+    """path がまだあればそのまま、消えていれば（期限切れの掃除など）同じ条件で作り直したパスを返す。"""
+    if keep_export(path):
+        return path
+    return export_file(kind, fmt, user=user, month=month)[0]
+
+def resolve_export(name: str, user: Optional[str]) -> Optional[Path]:
+    """ファイル名から EXPORT_DIR 内のパスを引く。名前の形式・所有者・存在のどれかが合わなければ None。"""
+    m = _NAME_RE.match(name or "")
+    if m is None or m.group(2) != owner_tag(user):
+        return None
+    path = EXPORT_DIR / name
+    return path if keep_export(path) else None
+
+def deferred_download_supported() -> bool:
+    """st.download_button が data に callable（押されたときに読む）を受け付ける版か。"""
+    try:
+        from streamlit.runtime.media_file_manager import MediaFileManager
+    except ImportError:
+        return False
+    return hasattr(MediaFileManager, "add_deferred")
+
+def export_filename(kind: str, fmt: str, user: Optional[str], month: Optional[str]) -> str:
+    """ダウンロード時のファイル名（例: clicks_maeda_2025-01.csv）。"""
+    base = "clicks" if kind == "events" else "clicks_by_month"
+    parts = [base, user or "all", month or "all"]
+    return "_".join(p.replace("/", "_") for p in parts) + f".{fmt}"
@@ -0,0 +1,154 @@
+# login_test_app/lib/file_watch.py
+"""
+settings.toml / users.json / login_users.json の変更を「押し込み」で検知する。
+
+バックグラウンドスレッド 1 本が監視し、いずれかのファイルが変わるとプロセス内の
+版カウンタ（整数）を 1 つ進める。各ページの rerun は整数を比較するだけで、
+変化が無ければ前回の読み込み結果（memoized）をそのまま使う。
+
+- inotify_simple（純 Python / ctypes）があれば inotify（Linux）でミリ秒単位に反映
+- 無ければ 1 本のスレッドで stat ポーリング（既定 0.2 秒間隔。macOS 等）
+
+有効化は環境変数（未設定なら memoized() は毎回 loader を呼ぶ＝従来どおり）:
+    LOGIN_TEST_FILE_WATCH=1                 # auto（inotify → poll）
+    LOGIN_TEST_FILE_WATCH=poll              # ポーリング固定
+    LOGIN_TEST_FILE_WATCH_INTERVAL=0.2      # ポーリング間隔（秒）
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_version = 0
+_paths: Dict[Path, Optional[Tuple[int, int, int]]] = {}   # path -> (mtime_ns, size, ino)
+_memo: Dict[str, Tuple[int, object]] = {}
+_thread: Optional[threading.Thread] = None
+_backend = ""
+_inotify = None
+_watched_dirs: Set[Path] = set()
+
+def enabled() -> bool:
+    return (os.environ.get("LOGIN_TEST_FILE_WATCH") or "").lower() not in ("", "0", "false", "off")
+
+def version() -> int:
+    """監視対象のいずれかが変わるたびに増える整数（ロック不要で読める）。"""
+    return _version
+
+def backend() -> str:
+    """"inotify" / "poll" / ""（未起動）。"""
+    return _backend
+
+def _bump() -> None:
+    global _version
+    with _lock:
+        _version += 1
+
+def _stat_key(p: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        s = p.stat()
+    except OSError:
+        return None
+    return (s.st_mtime_ns, s.st_size, s.st_ino)
+
+# ─────────────────────────────────────────────────────────────
+# 監視スレッド
+# ─────────────────────────────────────────────────────────────
+def _poll_loop(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        with _lock:
+            items = list(_paths.items())
+        changed = False
+        for p, old in items:
+            new = _stat_key(p)
+            if new != old:
+                with _lock:
+                    _paths[p] = new
+                changed = True
+        if changed:
+            _bump()
+
+_INOTIFY_MASK = 0
+
+def _inotify_loop() -> None:
+    while True:
+        try:
+            events = _inotify.read(timeout=1000)
+        except OSError:
+            time.sleep(0.2)
+            continue
+        if not events:
+            continue
+        with _lock:
+            names = {p.name for p in _paths}
+        if any(e.name in names for e in events):
+            _bump()
+
+def _add_inotify_dir(d: Path) -> None:
+    if d in _watched_dirs or not d.is_dir():
+        return
+    try:
+        _inotify.add_watch(str(d), _INOTIFY_MASK)
+        _watched_dirs.add(d)
+    except OSError:
+        pass
+
+def _start() -> None:
+    global _thread, _backend, _inotify, _INOTIFY_MASK
+    mode = (os.environ.get("LOGIN_TEST_FILE_WATCH") or "").lower()
+    if mode != "poll":
+        try:
+            from inotify_simple import INotify, flags  # 任意依存
+            _inotify = INotify()
+            # 置き換え保存（tmp → rename）も直接書き込みも拾う
+            _INOTIFY_MASK = (flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+                             | flags.DELETE | flags.MOVED_FROM | flags.ATTRIB)
+            for p in list(_paths):
+                _add_inotify_dir(p.parent)
+            _thread = threading.Thread(target=_inotify_loop, name="file-watch-inotify", daemon=True)
+            _backend = "inotify"
+        except (ImportError, OSError):
+            _inotify = None
+    if _thread is None:
+        interval = float(os.environ.get("LOGIN_TEST_FILE_WATCH_INTERVAL") or 0.2)
+        _thread = threading.Thread(target=_poll_loop, args=(interval,), name="file-watch-poll", daemon=True)
+        _backend = "poll"
+    _thread.start()
+
+def watch(path: Path) -> None:
+    """監視対象に追加（有効時のみ）。初回呼び出しで監視スレッドを起動する。"""
+    if not enabled():
+        return
+    p = Path(path).resolve()
+    with _lock:
+        if p in _paths:
+            return
+        _paths[p] = _stat_key(p)
+        if _thread is None:
+            _start()
+        elif _inotify is not None:
+            _add_inotify_dir(p.parent)
+
+def memoized(key: str, loader: Callable[[], T], *, cache_if: Optional[Callable[[T], bool]] = None) -> T:
+    """
+    版カウンタが前回から変わっていなければ前回の結果を返す。
+    loader は自分が読むファイルを watch() で登録しておくこと。
+    cache_if が偽を返す結果（ファイル未発見など）は保持しない。
+    戻り値はプロセス内で共有されるので呼び出し側で書き換えないこと。
+    """
+    if not enabled():
+        return loader()
+    v = _version
+    hit = _memo.get(key)
+    if hit is not None and hit[0] == v:
+        return hit[1]  # type: ignore[return-value]
+    value = loader()
+    if cache_if is None or cache_if(value):
+        with _lock:
+            _memo[key] = (v, value)
+    return value
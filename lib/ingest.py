@@ -0,0 +1,313 @@
+# login_test_app/lib/ingest.py
+"""
+クリックイベントの取り込みデーモン（Unix ドメインソケット）とクライアント。
+
+アプリ側（append_click_event）は JSON 1 行をソケットへ非ブロッキングで送るだけで戻り、
+ファイル I/O はデーモン（asyncio）がまとめて行う。
+- デーモンは接続ごとに行を読み、上限つきキューへ積む。満杯なら読み取りを止める（バックプレッシャ）
+  → カーネルのソケットバッファが埋まり、クライアントの send が EAGAIN になる
+- 書き込みタスクは最大 BATCH_MAX 件 / BATCH_WAIT_SECONDS ごとに event_store.append_events で
+  デーモン自身のシャードへ追記（月パーティションのロールアップ・スケッチも同時に更新）
+- クライアントは送れなければ（未起動・切断・バックプレッシャ）False を返し、呼び出し側が直接追記する
+- 追記が OSError で失敗したら BATCH_RETRIES 回まで間を空けてやり直す。それでもだめなら（または
+  OSError 以外の例外なら）バッチを data/events/ingest_failed.<pid>.jsonl に退避して次へ進む
+  （書き込みタスクは止めない。退避分は内容を確かめてから手で戻す）
+
+有効化は環境変数（未設定ならクライアントは None ＝従来どおり直接追記）:
+    LOGIN_TEST_INGEST_SOCKET=/run/login_test/ingest.sock
+
+デーモンの起動: python tools/ingest_daemon.py --socket /run/login_test/ingest.sock
+"""
+from __future__ import annotations
+import asyncio
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from lib.metrics import REGISTRY
+
+RECONNECT_SECONDS = 5.0         # 未接続時に再接続を試みる間隔（それまでは即フォールバック）
+QUEUE_MAX = 10_000
+BATCH_MAX = 1000
+BATCH_WAIT_SECONDS = 0.05
+LINE_LIMIT = 64 * 1024
+BATCH_RETRIES = 3               # 追記が OSError で失敗したときのやり直し回数
+RETRY_SECONDS = 0.5             # やり直しの間隔（回ごとに倍）
+
+INGEST_SENT = REGISTRY.counter("login_test_ingest_client_events_total", "取り込みクライアントの送信結果", ("result",))
+INGEST_RECEIVED = REGISTRY.counter("login_test_ingest_received_events_total", "デーモンが受け取ったイベント数")
+INGEST_REJECTED = REGISTRY.counter("login_test_ingest_rejected_lines_total", "デーモンが捨てた不正な行")
+INGEST_QUEUE = REGISTRY.gauge("login_test_ingest_queue_depth", "デーモンの書き込み待ちイベント数")
+INGEST_BATCH_SECONDS = REGISTRY.histogram("login_test_ingest_batch_seconds", "デーモンの 1 バッチ書き込み時間（秒）")
+INGEST_FAILED = REGISTRY.counter(
+    "login_test_ingest_failed_events_total", "デーモンが追記できなかったイベント（retried / spilled / dropped）", ("result",))
+
+# ─────────────────────────────────────────────────────────────
+# クライアント（アプリ側）
+# ─────────────────────────────────────────────────────────────
+class IngestClient:
+    """
+    プロセスにつき 1 本の非ブロッキング接続。send() はロック 1 回 + send(2) 1 回で戻る。
+    途中までしか送れなかった行は pending に残し、次回の send() で続きを送る
+    （行の途中で切れたまま他の行を送らない）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._pid = 0
+        self._next_connect = 0.0
+        self._pending = b""         # 送りかけの行の残り
+        self._pending_line = b""    # その行全体（切断時に直接追記へ回す）
+
+    def _connect(self) -> bool:
+        if self._sock is not None and self._pid == os.getpid():
+            return True
+        self._sock = None           # fork 後は親の接続を使わない
+        now = time.monotonic()
+        if now < self._next_connect:
+            return False
+        self._next_connect = now + RECONNECT_SECONDS
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.setblocking(False)
+            s.connect(self.path)
+        except OSError:
+            return False
+        self._sock, self._pid = s, os.getpid()
+        return True
+
+    def _drop(self) -> None:
+        """切断。送りかけの行はデーモン側で捨てられるので、呼び出し元で直接追記する。"""
+        line = self._pending_line
+        self._pending = self._pending_line = b""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        if line:
+            _direct_append([line])
+
+    def _flush_pending(self) -> bool:
+        if not self._pending:
+            return True
+        try:
+            n = self._sock.send(self._pending)
+        except BlockingIOError:
+            return False
+        self._pending = self._pending[n:]
+        if not self._pending:
+            self._pending_line = b""
+        return not self._pending
+
+    def send(self, line: bytes) -> bool:
+        """送れた（またはストリームに乗った）なら True。False なら呼び出し側で直接追記すること。"""
+        with self._lock:
+            if not self._connect():
+                INGEST_SENT.inc("unavailable")
+                return False
+            try:
+                if not self._flush_pending():
+                    INGEST_SENT.inc("backpressure")
+                    return False
+                try:
+                    n = self._sock.send(line)
+                except BlockingIOError:
+                    INGEST_SENT.inc("backpressure")
+                    return False
+            except OSError:
+                self._drop()
+                INGEST_SENT.inc("disconnected")
+                return False
+            if n < len(line):
+                self._pending, self._pending_line = line[n:], line
+            INGEST_SENT.inc("sent")
+            return True
+
+    def close(self, timeout: float = 1.0) -> None:
+        """送りかけの行を（短時間だけブロックして）送り切ってから閉じる。"""
+        with self._lock:
+            if self._sock is None or self._pid != os.getpid():
+                return
+            if self._pending:
+                try:
+                    self._sock.settimeout(timeout)
+                    self._sock.sendall(self._pending)
+                    self._pending = self._pending_line = b""
+                except OSError:
+                    pass
+            self._drop()
+
+def _direct_append(lines: List[bytes]) -> None:
+    from lib.event_store import append_events
+
+    events = []
+    for ln in lines:
+        try:
+            events.append(json.loads(ln))
+        except ValueError:
+            continue
+    append_events(events)
+
+_client_lock = threading.Lock()
+_client: Optional[IngestClient] = None
+_client_checked = False
+
+def get_ingest_client() -> Optional[IngestClient]:
+    """LOGIN_TEST_INGEST_SOCKET が設定されていればプロセス共通のクライアントを返す。"""
+    global _client, _client_checked
+    if _client_checked:
+        return _client
+    with _client_lock:
+        if not _client_checked:
+            path = os.environ.get("LOGIN_TEST_INGEST_SOCKET")
+            if path:
+                _client = IngestClient(path)
+                atexit.register(_client.close)
+            _client_checked = True
+    return _client
+
+# ─────────────────────────────────────────────────────────────
+# デーモン（asyncio）
+# ─────────────────────────────────────────────────────────────
+REQUIRED_FIELDS = ("ts", "month", "user", "button")
+
+def _parse(line: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or any(f not in event for f in REQUIRED_FIELDS):
+        return None
+    return event
+
+def _spill(batch: List[Dict[str, Any]]) -> None:
+    """追記できなかったバッチを退避ファイルへ（それも書けなければ捨てて数える）。"""
+    from lib.event_store import LOG_DIR, encode_event
+
+    path = LOG_DIR / f"ingest_failed.{os.getpid()}.jsonl"
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        with path.open("ab") as f:
+            f.write(b"".join(encode_event(e) for e in batch))
+    except (OSError, TypeError, ValueError):
+        INGEST_FAILED.inc("dropped", amount=len(batch))
+        return
+    INGEST_FAILED.inc("spilled", amount=len(batch))
+
+class IngestServer:
+    def __init__(self, socket_path: Path, *, queue_max: int = QUEUE_MAX,
+                 batch_max: int = BATCH_MAX, batch_wait: float = BATCH_WAIT_SECONDS):
+        self.socket_path = Path(socket_path)
+        self.batch_max = batch_max
+        self.batch_wait = batch_wait
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=queue_max)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._conns: "set[asyncio.StreamWriter]" = set()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._conns.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:          # LINE_LIMIT 超過
+                    INGEST_REJECTED.inc()
+                    break
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    break                   # 切断で途中までの行（クライアントが直接追記する）
+                event = _parse(line)
+                if event is None:
+                    INGEST_REJECTED.inc()
+                    continue
+                await self.queue.put(event)     # 満杯ならここで待つ＝読み取りを止める
+                INGEST_RECEIVED.inc()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._conns.discard(writer)
+            writer.close()
+
+    async def _write_loop(self) -> None:
+        from lib.event_store import append_events
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_max:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            INGEST_QUEUE.set(self.queue.qsize())
+            try:
+                # 月ごとにまとめて書く（ロールアップ・スケッチの月パーティション単位で連続させる）
+                batch.sort(key=lambda e: (str(e.get("month")), e.get("ts") or 0))
+                await self._write_batch(loop, append_events, batch)
+            finally:
+                for _ in batch:             # 失敗しても数える（stop() の queue.join() を止めない）
+                    self.queue.task_done()
+
+    async def _write_batch(self, loop: asyncio.AbstractEventLoop, append_events: Any,
+                           batch: List[Dict[str, Any]]) -> None:
+        """
+        1 バッチを追記する。OSError（ディスク満杯など）は間を空けてやり直し、だめなら退避する。
+        それ以外の例外は途中まで書けている（ロールアップ更新中など）かもしれないのでやり直さず退避する。
+        """
+        wait = RETRY_SECONDS
+        for attempt in range(BATCH_RETRIES + 1):
+            try:
+                with INGEST_BATCH_SECONDS.time():
+                    await loop.run_in_executor(None, append_events, batch)
+                return
+            except OSError:
+                if attempt == BATCH_RETRIES:
+                    break
+                INGEST_FAILED.inc("retried", amount=len(batch))
+                await asyncio.sleep(wait)
+                wait *= 2
+            except Exception:
+                break
+        await loop.run_in_executor(None, _spill, batch)
+
+    async def start(self) -> None:
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()       # 前回の残骸
+        self._server = await asyncio.start_unix_server(self._handle, path=str(self.socket_path), limit=LINE_LIMIT)
+        os.chmod(self.socket_path, 0o660)
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def stop(self) -> None:
+        """受付を止め、キューに残ったイベントを書き切ってから終わる。"""
+        from lib.event_store import ROLLUPS, SKETCHES
+
+        if self._server is not None:
+            self._server.close()
+        for w in list(self._conns):
+            w.close()
+        if self._writer_task is not None and not self._writer_task.done():
+            # 書き込みタスクが（想定外の例外で）終わっていたら待たない
+            join = asyncio.ensure_future(self.queue.join())
+            await asyncio.wait({join, self._writer_task}, return_when=asyncio.FIRST_COMPLETED)
+            join.cancel()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        SKETCHES.flush()
+        ROLLUPS.checkpoint()
+        self.socket_path.unlink(missing_ok=True)
@@ -0,0 +1,412 @@
+# login_test_app/lib/json_lookup.py
+"""
+巨大な JSON（ポータルの users.json など）から 1 ユーザー分だけを読む。
+
+- ファイルを mmap し、正規表現（C 実装）で文字列・括弧を飛ばしながら構造だけを辿る。
+  値は読み飛ばし、目的のキーが見つかった時点で打ち切る（全体をパースしない・メモリに載せない）
+- オフセット索引（任意）: users の各キー → 値のバイト範囲 を 1 回の走査で作って保存し、
+  以降はその範囲だけを json.loads する（ファイルサイズに関係なくミリ秒以下）。
+  索引はファイルの版（パス・mtime・サイズ）つき。変わっていれば作り直す
+
+    lookup_member(USERS_FILE, ("users", "maeda"))          # {"pw": ..., "apps": [...]} / None
+    lookup_member(USERS_FILE, ("users", "maeda", "apps"))  # [...] / None
+    UserIndex.for_file(USERS_FILE, ("users",)).keys()      # 全ユーザー名（値は読まない）
+    MemberView(USERS_FILE, ("users",))                     # dict を受け取る API へ渡す読み取り専用ビュー
+
+索引の保存先: <data>/json_index/（LOGIN_TEST_DATA_DIR で data/ を差し替え可）
+"""
+from __future__ import annotations
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+HERE = Path(__file__).resolve()
+project_dir = HERE.parent.parent.parent         # .../login_test_project
+INDEX_DIR = Path(os.environ.get("LOGIN_TEST_DATA_DIR") or project_dir / "data") / "json_index"
+INDEX_MIN_BYTES = 1024 * 1024    # これより小さいファイルは索引を作らずに走査する
+
+_WS = re.compile(rb"[ \t\r\n]*")
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_STRUCT = re.compile(rb'[\[\]{}"]')
+_SCALAR = re.compile(rb'[^,\]}\s]+')
+
+def _nested_value_re(depth: int) -> "re.Pattern[bytes]":
+    """
+    入れ子 depth 段までのオブジェクト/配列 1 つに一致する正規表現（走査を C で済ませる高速経路）。
+    一致しなければ（より深い入れ子）トークン単位の走査に戻る。
+    """
+    string = rb'"[^"\\]*+(?:\\.[^"\\]*+)*+"' if sys.version_info >= (3, 11) else _STRING.pattern
+    plain = rb'[^"{}\[\]]++' if sys.version_info >= (3, 11) else rb'[^"{}\[\]]'
+    inner = rb"(?:" + string + rb"|" + plain + rb")*"
+    for _ in range(depth):
+        inner = rb"(?:" + string + rb"|" + plain + rb"|\{" + inner + rb"\}|\[" + inner + rb"\])*"
+    return re.compile(rb"\{" + inner + rb"\}|\[" + inner + rb"\]", re.DOTALL)
+
+_NESTED_VALUE = _nested_value_re(3)
+# メンバー 1 つ（キー・値）を 1 回の match で読む高速経路
+_MEMBER = re.compile(
+    rb'[ \t\r\n]*(' + _STRING.pattern + rb')[ \t\r\n]*:[ \t\r\n]*('
+    + _NESTED_VALUE.pattern + rb'|' + _STRING.pattern + rb'|[^,\]}\s"{\[]+)',
+    re.DOTALL,
+)
+
+class JsonScanError(ValueError):
+    pass
+
+MISSING = object()
+
+# ─────────────────────────────────────────────────────────────
+# 走査（mmap 上のバイト位置で辿る）
+# ─────────────────────────────────────────────────────────────
+class _Scanner:
+    def __init__(self, buf):
+        self.buf = buf
+        self.size = len(buf)
+
+    def ws(self, pos: int) -> int:
+        return _WS.match(self.buf, pos).end()
+
+    def expect(self, pos: int, ch: bytes) -> int:
+        pos = self.ws(pos)
+        if self.buf[pos:pos + 1] != ch:
+            raise JsonScanError(f"{pos} バイト目に {ch!r} がありません")
+        return pos + 1
+
+    def skip_value(self, pos: int) -> int:
+        """pos（空白の後）から始まる値の終わり（直後の位置）を返す。"""
+        c = self.buf[pos:pos + 1]
+        if c == b'"':
+            m = _STRING.match(self.buf, pos)
+            if not m:
+                raise JsonScanError(f"{pos} バイト目の文字列が閉じていません")
+            return m.end()
+        if c in (b"{", b"["):
+            m = _NESTED_VALUE.match(self.buf, pos)
+            if m:
+                return m.end()
+            depth, p = 0, pos
+            while True:
+                m = _STRUCT.search(self.buf, p)
+                if not m:
+                    raise JsonScanError("括弧が閉じていません")
+                ch = m.group()
+                if ch == b'"':
+                    s = _STRING.match(self.buf, m.start())
+                    if not s:
+                        raise JsonScanError("文字列が閉じていません")
+                    p = s.end()
+                    continue
+                depth += 1 if ch in (b"{", b"[") else -1
+                p = m.end()
+                if depth == 0:
+                    return p
+        m = _SCALAR.match(self.buf, pos)
+        if not m:
+            raise JsonScanError(f"{pos} バイト目に値がありません")
+        return m.end()
+
+    def members(self, pos: int, *, eager: bool = False) -> Iterator[List[Any]]:
+        """
+        pos のオブジェクトのメンバーを [キーの生バイト, 値の開始, 値の終了 or None] で順に返す。
+        eager なら 1 回の match でキーと値の範囲をまとめて取る（全メンバーを読む索引作成向け）。
+        終了が None のものは呼び出し側が埋めなければ次へ進むときに求める（キーだけ見て打ち切れる）。
+        """
+        pos = self.expect(pos, b"{")
+        pos = self.ws(pos)
+        if self.buf[pos:pos + 1] == b"}":
+            return
+        while True:
+            m = _MEMBER.match(self.buf, pos) if eager else None
+            if m:
+                item: List[Any] = [m.group(1), m.start(2), m.end(2)]
+                pos = m.start(2)
+            else:
+                pos = self.ws(pos)
+                m = _STRING.match(self.buf, pos)
+                if not m:
+                    raise JsonScanError(f"{pos} バイト目にキーがありません")
+                pos = self.ws(self.expect(m.end(), b":"))
+                item = [m.group(), pos, None]
+            yield item
+            end = item[2] if item[2] is not None else self.skip_value(pos)
+            pos = self.ws(end)
+            c = self.buf[pos:pos + 1]
+            if c == b",":
+                pos += 1
+            elif c == b"}":
+                return
+            else:
+                raise JsonScanError(f"{pos} バイト目に , か }} がありません")
+
+    def find(self, pos: int, key: str) -> Optional[int]:
+        """pos のオブジェクトで key の値の開始位置を探す（見つかった時点で打ち切り）。"""
+        want = _encode_key(key)
+        for raw_key, start, _ in self.members(pos):
+            if raw_key == want or (b"\\" in raw_key and _decode_key(raw_key) == key):
+                return start
+        return None
+
+    def root(self) -> int:
+        pos = self.ws(0)
+        if self.buf[pos:pos + 3] == b"\xef\xbb\xbf":     # BOM
+            pos = self.ws(pos + 3)
+        return pos
+
+def _decode_key(raw: bytes) -> str:
+    return json.loads(raw)
+
+def _encode_key(key: str) -> bytes:
+    return json.dumps(key, ensure_ascii=False).encode("utf-8")
+
+def _open_map(path: Path):
+    f = path.open("rb")
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return f, b""
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        f.close()
+        raise
+
+def _locate(sc: _Scanner, keys: Sequence[str]) -> Optional[int]:
+    """keys をたどった値の開始位置。途中で見つからなければ None。"""
+    pos = sc.root()
+    for k in keys:
+        if sc.buf[pos:pos + 1] != b"{":
+            return None
+        found = sc.find(pos, k)
+        if found is None:
+            return None
+        pos = found
+    return pos
+
+def _walk(sc: _Scanner, keys: Sequence[str]) -> Optional[Tuple[int, int]]:
+    """keys をたどった値の (開始, 終了)。"""
+    pos = _locate(sc, keys)
+    return None if pos is None else (pos, sc.skip_value(pos))
+
+def scan_member(path: Path, keys: Sequence[str], default: Any = None) -> Any:
+    """索引を使わずに keys の値を読む（見つかった時点で打ち切り）。"""
+    try:
+        f, buf = _open_map(path)
+    except OSError:
+        return default
+    try:
+        if not buf:
+            return default
+        sc = _Scanner(buf)
+        try:
+            span = _walk(sc, keys)
+        except JsonScanError:
+            return default
+        if span is None:
+            return default
+        return json.loads(bytes(buf[span[0]:span[1]]))
+    finally:
+        if not isinstance(buf, bytes):
+            buf.close()
+        f.close()
+
+# ─────────────────────────────────────────────────────────────
+# オフセット索引
+# ─────────────────────────────────────────────────────────────
+def _file_version(path: Path) -> str:
+    try:
+        s = path.stat()
+    except OSError:
+        return ""
+    return f"{path}:{s.st_mtime_ns}:{s.st_size}:{s.st_ino}"
+
+class UserIndex:
+    """
+    prefix（例: ("users",)）のオブジェクトについて キー → (開始, 終了) を持つ。
+    for_file() はプロセス内・索引ファイルの順に再利用し、版が違えば作り直す。
+
+    索引ファイルは 1 行目が版、以降が "<キーの JSON>\t<開始>\t<終了>" をキーのバイト順に並べたもの。
+    読むときは mmap して二分探索する（全体を読み込まない）。
+    """
+
+    _memo: Dict[Tuple[str, Tuple[str, ...]], "UserIndex"] = {}
+    _memo_lock = threading.Lock()
+
+    def __init__(self, path: Path, prefix: Tuple[str, ...], version: str, *,
+                 offsets: Optional[Dict[str, Tuple[int, int]]] = None, index_map=None, body: int = 0):
+        self.path = path
+        self.prefix = prefix
+        self.version = version
+        self._offsets = offsets         # build() 直後はメモリ上の辞書
+        self._map = index_map           # load() なら索引ファイルの mmap
+        self._body = body               # _map 内の 2 行目の位置
+
+    # ---- 作成・保存 ----
+    @classmethod
+    def build(cls, path: Path, prefix: Sequence[str]) -> "UserIndex":
+        """1 回の走査で作る。JSON が壊れていれば JsonScanError。"""
+        version = _file_version(path)
+        offsets: Dict[str, Tuple[int, int]] = {}
+        f, buf = _open_map(path)
+        try:
+            if buf:
+                sc = _Scanner(buf)
+                pos = _locate(sc, prefix)
+                if pos is not None and buf[pos:pos + 1] == b"{":
+                    for item in sc.members(pos, eager=True):
+                        if item[2] is None:
+                            item[2] = sc.skip_value(item[1])
+                        offsets[_decode_key(item[0])] = (item[1], item[2])
+        finally:
+            if not isinstance(buf, bytes):
+                buf.close()
+            f.close()
+        return cls(path, tuple(prefix), version, offsets=offsets)
+
+    @staticmethod
+    def _index_file(path: Path, prefix: Sequence[str]) -> Path:
+        h = hashlib.sha256(f"{path.resolve()}|{'/'.join(prefix)}".encode("utf-8")).hexdigest()[:16]
+        return INDEX_DIR / f"{path.name}.{h}.idx"
+
+    def save(self) -> None:
+        if self._offsets is None:
+            return
+        p = self._index_file(self.path, self.prefix)
+        rows = sorted((_encode_key(k), s, e) for k, (s, e) in self._offsets.items())
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(f".{p.name}.{os.getpid()}.tmp")
+            with tmp.open("wb") as f:
+                f.write(json.dumps({"version": self.version}, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.writelines(b"%s\t%d\t%d\n" % row for row in rows)
+            os.replace(tmp, p)
+        except OSError:
+            pass    # 索引は無くても走査で読める
+
+    @classmethod
+    def load(cls, path: Path, prefix: Sequence[str]) -> Optional["UserIndex"]:
+        try:
+            f, buf = _open_map(cls._index_file(path, prefix))
+        except OSError:
+            return None
+        f.close()       # mmap はファイルを閉じても有効
+        nl = buf.find(b"\n")
+        try:
+            header = json.loads(bytes(buf[:nl])) if nl > 0 else {}
+        except ValueError:
+            header = {}
+        return cls(path, tuple(prefix), str(header.get("version") or ""), index_map=buf, body=nl + 1)
+
+    @classmethod
+    def for_file(cls, path: Path, prefix: Sequence[str] = ("users",)) -> "UserIndex":
+        key = (str(path), tuple(prefix))
+        version = _file_version(path)
+        with cls._memo_lock:
+            idx = cls._memo.get(key)
+        if idx is None or idx.version != version:
+            idx = cls.load(path, prefix)
+            if idx is None or idx.version != version:
+                idx = cls.build(path, prefix)
+                idx.save()
+            with cls._memo_lock:
+                cls._memo[key] = idx
+        return idx
+
+    # ---- 参照 ----
+    def _span(self, key: str) -> Optional[Tuple[int, int]]:
+        if self._offsets is not None:
+            return self._offsets.get(key)
+        buf, want = self._map, _encode_key(key)
+        lo, hi = self._body, len(buf)       # lo・hi は常に行頭
+        while lo < hi:
+            s = max(lo, buf.rfind(b"\n", lo, (lo + hi) // 2) + 1)
+            e = buf.find(b"\n", s)
+            e = hi if e < 0 else e
+            k, _, rest = bytes(buf[s:e]).partition(b"\t")
+            if k == want:
+                a, _, b = rest.partition(b"\t")
+                return int(a), int(b)
+            if k < want:
+                lo = e + 1
+            else:
+                hi = s
+        return None
+
+    def keys(self) -> List[str]:
+        if self._offsets is not None:
+            return list(self._offsets)
+        body = bytes(self._map[self._body:])
+        return [_decode_key(line.partition(b"\t")[0]) for line in body.splitlines() if line]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        span = self._span(key)
+        if span is None:
+            return default
+        try:
+            with self.path.open("rb") as f:
+                f.seek(span[0])
+                return json.loads(f.read(span[1] - span[0]))
+        except (OSError, ValueError):
+            return default
+
+def lookup_member(path: Path, keys: Sequence[str], default: Any = None, *, use_index: Optional[bool] = None) -> Any:
+    """
+    keys（例: ("users", name, "apps")）の値を返す。無ければ default。
+    use_index=None なら INDEX_MIN_BYTES 以上のファイルだけ索引を使う（先頭 2 階層まで）。
+    """
+    keys = tuple(keys)
+    if use_index is None:
+        try:
+            use_index = path.stat().st_size >= INDEX_MIN_BYTES
+        except OSError:
+            return default
+    if use_index and len(keys) >= 2:
+        try:
+            idx = UserIndex.for_file(path, keys[:1])
+        except (OSError, JsonScanError):
+            return scan_member(path, keys, default)     # 書き換え途中などで索引が作れない
+        value = idx.get(keys[1], MISSING)
+        if value is MISSING:
+            return default
+        for k in keys[2:]:
+            if not isinstance(value, dict) or k not in value:
+                return default
+            value = value[k]
+        return value
+    return scan_member(path, keys, default)
+
+class MemberView(Mapping):
+    """
+    prefix のオブジェクトを読み取り専用の dict のように見せる（全体は読まない）。
+    in / get / [] は lookup_member で 1 件だけ読み、列挙・len は索引のキーだけを使う。
+    読み込み済みの dict を受け取る既存の API（users_db=...）へそのまま渡すためのもの。
+    """
+
+    def __init__(self, path: Path, prefix: Sequence[str] = ("users",)):
+        self.path = path
+        self.prefix = tuple(prefix)
+
+    def __getitem__(self, key: str) -> Any:
+        value = lookup_member(self.path, (*self.prefix, key), MISSING) if isinstance(key, str) else MISSING
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and lookup_member(self.path, (*self.prefix, key), MISSING) is not MISSING
+
+    def _keys(self) -> List[str]:
+        try:
+            return UserIndex.for_file(self.path, self.prefix).keys()
+        except (OSError, JsonScanError):
+            return []
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
@@ -0,0 +1,409 @@
+# login_test_app/lib/login_sweeper.py
+"""
+login_users.json の期限切れエントリの掃除（ログアウトされずに残ったユーザー）。
+
+- 各ユーザーの期限 = トークンの exp（あれば）/ 無ければ last_seen・last_login・login_time の最新 + TTL。
+  このプロセスで touch() されたユーザーは「最後に見た時刻 + TTL」まで延長する。
+  見た時刻はエントリの last_seen にも書き戻す（SEEN_FLUSH_SECONDS ごと・FLUSH_BATCH 件ごとにまとめて、
+  削除の書き戻しと同じ _rewrite で）。別のワーカーはそのユーザーを見ていなくても last_seen で延長を知る。
+  他のワーカーに伝わるのは最大 SEEN_FLUSH_SECONDS 遅れなので、TTL はそれより十分長くすること。
+  時刻が読めないエントリは消さない
+- 期限は最小ヒープ（期限, ユーザー）で持ち、先頭から期限切れを取り出す（1 件 O(log n)）。
+  延長・再読込で古くなったヒープ要素は取り出したときに捨てる（遅延削除）
+- 取り出したユーザーは保留にためて、FLUSH_BATCH 件たまるか FLUSH_DELAY 秒経ったら
+  まとめて 1 回だけ書き戻す（読み直して再確認 → tmp に書いて os.replace）。
+  ポータルは書き込みのロック（_write_lock）を取らないので、置き換える直前にファイルの
+  (inode, size, mtime) を読んだときと比べ、変わっていれば（その間にログインが書かれた）読み直してやり直す。
+  比べてから os.replace までのごく短い間の書き込みだけは防げない（ポータル側がロックを取るまでの制限）
+- ファイルが外（ポータルのログイン等）で変わったら読み直してヒープを作り直す（heapify O(n)）
+- 件数・削除数はメトリクスと history()（時系列）に残す
+
+有効化は環境変数（未設定・0 なら何もしない）:
+    LOGIN_TEST_LOGIN_TTL_MINUTES=720
+"""
+from __future__ import annotations
+import contextlib
+import datetime as dt
+import heapq
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lib.metrics import REGISTRY
+
+SWEEP_INTERVAL = 60.0       # 期限が来ていなくても見直す間隔（ファイルの外部変更の取り込み）
+FLUSH_BATCH = 500           # 保留がこれだけたまったらすぐ書き戻す
+FLUSH_DELAY = 5.0           # 保留の最長（秒）
+HISTORY_SIZE = 1440         # history() に残す掃除の回数
+WRITE_RETRIES = 5           # 書き戻しの直前にファイルが変わっていたときのやり直し回数
+SEEN_FLUSH_SECONDS = 60.0   # touch() の時刻を last_seen に書き戻す間隔（秒）
+
+TIME_FIELDS = ("last_seen", "last_login", "login_time")
+
+LOGIN_USERS_ENTRIES = REGISTRY.gauge("login_test_login_users_entries", "login_users.json のエントリ数", ("file",))
+LOGIN_USERS_EVICTED = REGISTRY.counter(
+    "login_test_login_users_evicted_total", "期限切れで login_users.json から削除したユーザー数", ("reason",))
+LOGIN_USERS_WRITES = REGISTRY.counter("login_test_login_users_sweep_writes_total", "掃除による login_users.json の書き戻し回数")
+LOGIN_USERS_CONFLICTS = REGISTRY.counter(
+    "login_test_login_users_write_conflicts_total", "書き戻しの直前に login_users.json が変わっていて読み直した回数")
+LOGIN_USERS_PENDING = REGISTRY.gauge("login_test_login_users_sweep_pending", "書き戻し待ちの削除件数", ("file",))
+
+def ttl_seconds() -> int:
+    try:
+        return max(0, int(os.environ.get("LOGIN_TEST_LOGIN_TTL_MINUTES") or 0)) * 60
+    except ValueError:
+        return 0
+
+def _epoch(v: Any) -> Optional[float]:
+    """epoch 秒（数値）か ISO 8601 文字列を epoch 秒に。読めなければ None。"""
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str) and v:
+        try:
+            d = dt.datetime.fromisoformat(v.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return d.timestamp()
+    return None
+
+def entry_expiry(value: Any, ttl: int) -> Tuple[Optional[float], str]:
+    """エントリの期限（epoch 秒）と理由（"exp" / "idle"）。決められなければ (None, "")。"""
+    if not isinstance(value, dict):
+        return None, ""
+    exp = _epoch(value.get("exp"))
+    if exp is not None:
+        return exp, "exp"
+    seen = [t for t in (_epoch(value.get(k)) for k in TIME_FIELDS) if t is not None]
+    if seen and ttl:
+        return max(seen) + ttl, "idle"
+    return None, ""
+
+def _stamp(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        s = path.stat()
+    except OSError:
+        return None
+    return s.st_ino, s.st_size, s.st_mtime_ns
+
+def _read(path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(path.read_text("utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+@contextlib.contextmanager
+def _write_lock(path: Path) -> Iterator[None]:
+    """このアプリのプロセス同士の書き戻しを直列化する（Windows では何もしない）。"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with path.with_name(f".{path.name}.lock").open("a") as lockf:
+        fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+
+# ─────────────────────────────────────────────────────────────
+# 掃除
+# ─────────────────────────────────────────────────────────────
+class LoginSweeper:
+    def __init__(self, path: Path, ttl: Optional[int] = None):
+        self.path = Path(path)
+        self.ttl = ttl_seconds() if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._expiry: Dict[str, Tuple[float, str]] = {}     # user -> (期限, 理由)。ヒープの正本
+        self._seen: Dict[str, float] = {}                   # touch() された時刻
+        self._seen_dirty: Dict[str, float] = {}             # last_seen に書き戻していない touch() の時刻
+        self._seen_since = 0.0
+        self._pending: Dict[str, str] = {}                  # 書き戻し待ち user -> 理由
+        self._pending_since = 0.0
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._entries = 0
+        self._evicted = 0
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=HISTORY_SIZE)
+        self._label = self.path.name
+
+    # ---- スケジュール ----
+    def _expiry_of(self, user: str, value: Any) -> Tuple[Optional[float], str]:
+        at, reason = entry_expiry(value, self.ttl)
+        seen = self._seen.get(user)
+        if seen is not None and self.ttl and (at is None or seen + self.ttl > at):
+            return seen + self.ttl, "idle"
+        return at, reason
+
+    def _reload(self) -> None:
+        """ファイルが変わっていればヒープを作り直す（_lock 下で呼ぶ）。"""
+        stamp = _stamp(self.path)
+        if stamp == self._stamp:
+            return
+        data = _read(self.path)
+        self._stamp = stamp
+        self._expiry.clear()
+        for user, value in data.items():
+            at, reason = self._expiry_of(user, value)
+            if at is not None and user not in self._pending:
+                self._expiry[user] = (at, reason)
+        self._heap = [(at, user) for user, (at, _) in self._expiry.items()]
+        heapq.heapify(self._heap)
+        self._pending = {u: r for u, r in self._pending.items() if u in data}
+        self._seen = {u: t for u, t in self._seen.items() if u in data}
+        self._seen_dirty = {u: t for u, t in self._seen_dirty.items() if u in data}
+        self._entries = len(data)
+        LOGIN_USERS_ENTRIES.set(self._entries, self._label)
+
+    def _schedule(self, user: str, at: float, reason: str) -> None:
+        self._expiry[user] = (at, reason)
+        heapq.heappush(self._heap, (at, user))
+        if len(self._heap) > 2 * len(self._expiry) + 64:   # 古い要素が増えすぎたら詰め直す
+            self._heap = [(a, u) for u, (a, _) in self._expiry.items()]
+            heapq.heapify(self._heap)
+
+    def touch(self, user: str, now: Optional[float] = None) -> None:
+        """このプロセスでユーザーを見た（期限を 最後に見た時刻 + TTL まで延ばす）。"""
+        if not self.ttl or not user:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._seen[user] = now
+            if not self._seen_dirty:
+                self._seen_since = now
+            self._seen_dirty[user] = now
+            self._pending.pop(user, None)
+            cur = self._expiry.get(user)
+            if cur is None or now + self.ttl > cur[0]:
+                self._schedule(user, now + self.ttl, "idle")
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            while self._heap:
+                at, user = self._heap[0]
+                cur = self._expiry.get(user)
+                if cur is not None and cur[0] == at:
+                    return at
+                heapq.heappop(self._heap)
+        return None
+
+    def sweep(self, now: Optional[float] = None, *, force_flush: bool = False) -> int:
+        """期限切れを取り出して保留に入れ、条件を満たせば書き戻す。書き戻した件数を返す。"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._reload()
+            popped = 0
+            while self._heap and self._heap[0][0] <= now:
+                at, user = heapq.heappop(self._heap)
+                cur = self._expiry.get(user)
+                if cur is None or cur[0] != at:
+                    continue        # 延長・再読込で古くなった要素
+                del self._expiry[user]
+                if not self._pending:
+                    self._pending_since = now
+                self._pending[user] = cur[1]
+                popped += 1
+            due = bool(self._pending) and (
+                force_flush or len(self._pending) >= FLUSH_BATCH or now - self._pending_since >= FLUSH_DELAY)
+            LOGIN_USERS_PENDING.set(len(self._pending), self._label)
+            due = due or bool(self._seen_dirty) and (
+                force_flush or len(self._seen_dirty) >= FLUSH_BATCH or now - self._seen_since >= SEEN_FLUSH_SECONDS)
+        written = self.flush(now) if due else 0
+        with self._lock:
+            self._history.append({"ts": int(now), "entries": self._entries, "expired": popped, "evicted": written})
+        return written
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """
+        保留のユーザーをまとめて削除し（読み直して、まだ期限切れのものだけ）、
+        touch() の時刻を last_seen に書き戻す。1 回の書き戻しで両方やる。削除した件数を返す。
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            seen, self._seen_dirty = self._seen_dirty, {}
+            LOGIN_USERS_PENDING.set(0, self._label)
+        if not pending and not seen:
+            return 0
+        removed: Dict[str, str] = {}
+        extended: Dict[str, Tuple[float, str]] = {}
+        stamped: List[str] = []
+
+        def edit(data: Dict[str, Any]) -> bool:
+            removed.clear()
+            extended.clear()
+            stamped.clear()
+            for user, at in seen.items():      # 書いてある時刻より新しいときだけ（他のワーカーの方が新しいこともある）
+                value = data.get(user)
+                if isinstance(value, dict) and (_epoch(value.get("last_seen")) or 0) < int(at):
+                    value["last_seen"] = dt.datetime.fromtimestamp(int(at)).isoformat(timespec="seconds")
+                    stamped.append(user)
+            with self._lock:
+                for user in pending:
+                    if user not in data:
+                        continue
+                    at, reason = self._expiry_of(user, data[user])
+                    if at is not None and at <= now:
+                        removed[user] = reason
+                    elif at is not None:
+                        extended[user] = (at, reason)       # 外で延長されていた（再ログインなど）
+            for user in removed:
+                del data[user]
+            return bool(removed or stamped)
+
+        with _write_lock(self.path):
+            data = self._rewrite(edit)
+        if data is None:
+            with self._lock:                # 書き戻せなかった。次の掃除でもう一度
+                if pending and not self._pending:
+                    self._pending_since = now
+                for user, reason in pending.items():
+                    self._pending.setdefault(user, reason)
+                if seen and not self._seen_dirty:
+                    self._seen_since = now
+                for user, at in seen.items():
+                    self._seen_dirty[user] = max(at, self._seen_dirty.get(user, at))
+                LOGIN_USERS_PENDING.set(len(self._pending), self._label)
+            return 0
+        with self._lock:
+            for user, (at, reason) in extended.items():
+                self._schedule(user, at, reason)
+            for user in removed:
+                self._seen.pop(user, None)
+                self._seen_dirty.pop(user, None)
+            self._stamp = _stamp(self.path)
+            self._entries = len(data)
+            self._evicted += len(removed)
+        LOGIN_USERS_ENTRIES.set(len(data), self._label)
+        for reason in set(removed.values()):
+            LOGIN_USERS_EVICTED.inc(reason, amount=sum(1 for r in removed.values() if r == reason))
+        if removed or stamped:
+            LOGIN_USERS_WRITES.inc()
+        return len(removed)
+
+    def remove(self, users: Iterable[str]) -> Optional[int]:
+        """
+        明示的な削除（ログアウト）。掃除と同じロック・書き方で 1 回だけ書き戻す。
+        削除した件数を返す。書き戻しが毎回ぶつかって書けなかったら None（呼び出し側で失敗を出す）。
+        """
+        users = set(users)
+        hit: List[str] = []
+
+        def edit(data: Dict[str, Any]) -> bool:
+            hit[:] = [u for u in users if u in data]
+            for u in hit:
+                del data[u]
+            return bool(hit)
+
+        with _write_lock(self.path):
+            data = self._rewrite(edit)
+        if data is None:
+            return None
+        with self._lock:
+            for u in users:
+                self._expiry.pop(u, None)
+                self._seen.pop(u, None)
+                self._seen_dirty.pop(u, None)
+                self._pending.pop(u, None)
+            self._stamp = _stamp(self.path)
+            self._entries = len(data)
+        LOGIN_USERS_ENTRIES.set(len(data), self._label)
+        return len(hit)
+
+    def _rewrite(self, edit: Callable[[Dict[str, Any]], bool]) -> Optional[Dict[str, Any]]:
+        """
+        読んで edit(data) で書き換え、tmp に書いてから os.replace する（_write_lock 下で呼ぶ）。
+        edit が False なら書かない。読んでから置き換えるまでにファイルが変わっていたら
+        （ロックを取らないポータルのログイン等）読み直して edit からやり直す。
+        WRITE_RETRIES 回とも変わっていたら書かずに None。
+        """
+        for _ in range(WRITE_RETRIES):
+            before = _stamp(self.path)
+            data = _read(self.path)
+            if not edit(data):
+                return data
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            if _stamp(self.path) != before:
+                tmp.unlink(missing_ok=True)
+                LOGIN_USERS_CONFLICTS.inc()
+                continue
+            os.replace(tmp, self.path)
+            return data
+        return None
+
+    # ---- 状況 ----
+    def history(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._history)
+
+    def status(self) -> Dict[str, Any]:
+        due = self.next_due()
+        with self._lock:
+            return {
+                "file": str(self.path),
+                "ttl_seconds": self.ttl,
+                "entries": self._entries,
+                "scheduled": len(self._expiry),
+                "pending": len(self._pending),
+                "seen_pending": len(self._seen_dirty),
+                "evicted_total": self._evicted,
+                "next_due": dt.datetime.fromtimestamp(due).isoformat(timespec="seconds") if due else None,
+            }
+
+# ─────────────────────────────────────────────────────────────
+# プロセス内の掃除スレッド（ファイルごとに 1 つ）
+# ─────────────────────────────────────────────────────────────
+_sweepers_lock = threading.Lock()
+_sweepers: Dict[str, LoginSweeper] = {}
+
+def _loop(sweeper: LoginSweeper) -> None:
+    while True:
+        try:
+            sweeper.sweep()
+        except Exception:
+            pass    # 次の周期で再試行
+        now = time.time()
+        wait = SWEEP_INTERVAL
+        due = sweeper.next_due()
+        if due is not None:
+            wait = min(wait, max(0.5, due - now))
+        if sweeper.status()["pending"]:
+            wait = min(wait, FLUSH_DELAY)
+        elif sweeper.status()["seen_pending"]:
+            wait = min(wait, SEEN_FLUSH_SECONDS)
+        time.sleep(wait)
+
+def sweeper_for(path: Path) -> Optional[LoginSweeper]:
+    """path の掃除役（無効なら None）。初回に掃除スレッドを起こす。rerun ごとに呼んでよい。"""
+    if not ttl_seconds():
+        return None
+    key = str(Path(path).resolve())
+    with _sweepers_lock:
+        sweeper = _sweepers.get(key)
+        if sweeper is None:
+            sweeper = _sweepers[key] = LoginSweeper(Path(path))
+            threading.Thread(target=_loop, args=(sweeper,), name="login-users-sweeper", daemon=True).start()
+    return sweeper
+
+def touch(path: Path, user: Optional[str]) -> None:
+    sweeper = sweeper_for(path)
+    if sweeper is not None and user:
+        sweeper.touch(user)
+
+def remove_users(path: Path, users: Iterable[str]) -> Optional[int]:
+    """ログアウト用。掃除が無効でも同じ書き方（ロック + os.replace）で削除する。書けなければ None。"""
+    return (sweeper_for(path) or LoginSweeper(Path(path), ttl=0)).remove(users)
+
+def status() -> List[Dict[str, Any]]:
+    with _sweepers_lock:
+        sweepers = list(_sweepers.values())
+    return [dict(s.status(), history=s.history()) for s in sweepers]
@@ -0,0 +1,356 @@
+# login_test_app/lib/metrics.py
+"""
+Prometheus テキスト形式のメトリクス（認証・イベント系）。
+
+- Counter / Histogram はロックをストライプ化（スレッドごとにシャードを固定）して
+  スクリプトスレッド同士の競合を抑える。更新コストは dict 加算 1 回程度。
+- 出力は次のどちらか（両方可）。いずれも Streamlit のスクリプト再実行を伴わない。
+    LOGIN_TEST_METRICS_TEXTFILE=/var/lib/node_exporter/textfile/login_test.prom
+        → バックグラウンドスレッドが一定間隔でアトミックに書き出す。ファイルはプロセスごと
+          （login_test.<host>.<pid>.prom、各行に pid ラベル）。終了時に消し、起動時に
+          このホストの終了済みプロセスのファイルを消す
+    LOGIN_TEST_METRICS_PORT=9592
+        → サイドポートで GET /metrics を返す
+- start_exporter() は何度呼んでもプロセスにつき 1 回だけ起動する。
+"""
+from __future__ import annotations
+import atexit
+import itertools
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_STRIPES = 16
+_DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_stripe_seq = itertools.count()
+_stripe_local = threading.local()
+
+def _stripe() -> int:
+    """呼び出しスレッドに割り当てたシャード番号（初回のみ採番）。"""
+    idx = getattr(_stripe_local, "idx", None)
+    if idx is None:
+        idx = next(_stripe_seq) % _STRIPES
+        _stripe_local.idx = idx
+    return idx
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+# ─────────────────────────────────────────────────────────────
+# メトリクス型
+# ─────────────────────────────────────────────────────────────
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        self._shards: List[Dict[Tuple[str, ...], float]] = [{} for _ in range(_STRIPES)]
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        i = _stripe()
+        key = tuple(str(v) for v in labelvalues)
+        with self._locks[i]:
+            shard = self._shards[i]
+            shard[key] = shard.get(key, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        out: Dict[Tuple[str, ...], float] = {}
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                for k, v in shard.items():
+                    out[k] = out.get(k, 0) + v
+        return out
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, v in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}")
+        return lines
+
+class Gauge:
+    """現在値（レジストリサイズ・シャード数など）。更新頻度が低い前提で単一ロック。"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[tuple(str(v) for v in labelvalues)] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}"
+                for k, v in sorted(self.collect().items())]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = _DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        # labels -> [bucket_0 .. bucket_n-1, +Inf, sum]
+        self._shards: List[Dict[Tuple[str, ...], List[float]]] = [{} for _ in range(_STRIPES)]
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        i = _stripe()
+        key = tuple(str(v) for v in labelvalues)
+        n = len(self.buckets)
+        pos = n
+        for j, b in enumerate(self.buckets):
+            if value <= b:
+                pos = j
+                break
+        with self._locks[i]:
+            row = self._shards[i].get(key)
+            if row is None:
+                row = self._shards[i][key] = [0.0] * (n + 2)
+            row[pos] += 1
+            row[n + 1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labelvalues)
+
+    def collect(self) -> Dict[Tuple[str, ...], List[float]]:
+        out: Dict[Tuple[str, ...], List[float]] = {}
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                for k, row in shard.items():
+                    acc = out.setdefault(k, [0.0] * len(row))
+                    for j, v in enumerate(row):
+                        acc[j] += v
+        return out
+
+    def render(self) -> List[str]:
+        lines = []
+        n = len(self.buckets)
+        for key, row in sorted(self.collect().items()):
+            cum = 0.0
+            for j, b in enumerate((*self.buckets, float("inf"))):
+                cum += row[j]
+                le = f'le="{_fmt_value(b)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {_fmt_value(cum)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[n + 1])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {_fmt_value(cum)}")
+        return lines
+
+# ─────────────────────────────────────────────────────────────
+# レジストリ
+# ─────────────────────────────────────────────────────────────
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif not isinstance(m, cls):
+                raise ValueError(f"metric {name} は {type(m).__name__} として登録済みです")
+            return m
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = _DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ─────────────────────────────────────────────────────────────
+# 既定メトリクス（認証・イベント）
+# ─────────────────────────────────────────────────────────────
+TOKEN_VERIFICATIONS = REGISTRY.counter(
+    "login_test_token_verifications_total", "JWT 検証の結果別件数", ["outcome"])
+TOKEN_REFRESHES = REGISTRY.counter(
+    "login_test_token_refresh_total", "期限間近のトークン再発行の結果別件数", ["outcome"])
+ACL_DECISIONS = REGISTRY.counter(
+    "login_test_acl_decisions_total", "ACL 判定の理由別件数", ["reason", "allowed"])
+CLICK_EVENTS = REGISTRY.counter(
+    "login_test_click_events_total", "書き込んだクリックイベント数", ["button"])
+EVENT_LOG_BYTES = REGISTRY.counter(
+    "login_test_event_log_bytes_total", "イベントログへ書き込んだバイト数")
+AGGREGATION_SECONDS = REGISTRY.histogram(
+    "login_test_aggregation_seconds", "イベント集計の所要時間（秒）", ["kind"])
+
+# ─────────────────────────────────────────────────────────────
+# エクスポータ（textfile / HTTP）
+# ─────────────────────────────────────────────────────────────
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+_HOST = socket.gethostname().split(".")[0].replace("_", "-") or "host"
+
+def process_textfile(path: Path, pid: Optional[int] = None) -> Path:
+    """設定された textfile のパスから、このプロセス用のパス（<stem>.<host>.<pid><suffix>）を作る。"""
+    return path.with_name(f"{path.stem}.{_HOST}.{os.getpid() if pid is None else pid}{path.suffix}")
+
+def _with_label(text: str, name: str, value: str) -> str:
+    """全サンプル行にラベルを 1 つ足す（プロセスごとのファイルを node-exporter がまとめても重ならないように）。"""
+    label = f'{name}="{_escape(value)}"'
+    out = []
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            metric, _, rest = line.partition(" ")
+            if metric.endswith("}"):
+                metric = f"{metric[:-1]},{label}}}"
+            else:
+                metric = f"{metric}{{{label}}}"
+            line = f"{metric} {rest}"
+        out.append(line)
+    return "\n".join(out) + "\n"
+
+def write_textfile(path: Path, registry: Registry = REGISTRY, *, pid_label: bool = False) -> None:
+    """node-exporter の textfile collector 用に一時ファイル経由で置き換える。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    text = registry.render()
+    if pid_label:
+        text = _with_label(text, "pid", str(os.getpid()))
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _prune_textfiles(path: Path) -> None:
+    """このホストの終了済みプロセスが残したファイルを消す（古い値を出し続けないように）。"""
+    prefix = f"{path.stem}.{_HOST}."
+    for p in path.parent.glob(f"{prefix}*{path.suffix}"):
+        pid = p.name[len(prefix):-len(path.suffix) or None]
+        if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            p.unlink(missing_ok=True)
+
+def _textfile_loop(path: Path, interval: float) -> None:
+    try:
+        _prune_textfiles(path)
+    except OSError:
+        pass
+    own = process_textfile(path)
+    atexit.register(own.unlink, missing_ok=True)
+    while True:
+        try:
+            write_textfile(own, pid_label=True)
+        except Exception:
+            pass  # 出力先の一時的な不調で本体を巻き込まない
+        time.sleep(interval)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002 - 親クラスのシグネチャに合わせる
+        return
+
+def start_exporter(
+    *,
+    textfile: Optional[str] = None,
+    port: Optional[int] = None,
+    interval_seconds: float = 15.0,
+) -> bool:
+    """
+    エクスポータを起動（プロセスにつき 1 回）。引数が無ければ環境変数を見る。
+    textfile はプロセスごとのファイル（process_textfile）に書く。起動済み・出力先未設定なら False。
+    """
+    global _exporter_started
+    textfile = textfile or os.environ.get("LOGIN_TEST_METRICS_TEXTFILE")
+    if port is None and os.environ.get("LOGIN_TEST_METRICS_PORT"):
+        try:
+            port = int(os.environ["LOGIN_TEST_METRICS_PORT"])
+        except ValueError:
+            port = None
+    if port is not None and not 0 < port < 65536:
+        port = None
+    if not textfile and not port:
+        return False
+
+    with _exporter_lock:
+        if _exporter_started:
+            return False
+        _exporter_started = True
+
+    if textfile:
+        threading.Thread(
+            target=_textfile_loop, args=(Path(textfile).expanduser(), interval_seconds),
+            name="metrics-textfile", daemon=True,
+        ).start()
+    if port:
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        except OSError:
+            # 同一ホストの別プロセスが既にポートを使用中
+            return bool(textfile)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return True
@@ -0,0 +1,223 @@
+# login_test_app/lib/prewarm.py
+"""
+プロセス起動時の事前準備（秘密鍵の読み込み・パス解決・settings.toml の探索/パース・ACL の展開・
+イベントログの索引/ロールアップ）をバックグラウンドで 1 回だけ行う。
+
+- 各処理は名前つきの「ステップ」。once(name, fn) で読むと
+    未実行   → その場で実行（以後プロセス内で共有）
+    実行中   → 終わるまで待つ（同じ処理を二重に走らせない）
+    完了     → 結果をそのまま返す（valid が偽なら読み直す：設定ファイルが変わった等）
+  失敗・cache_if が偽の結果は保持しない（次の呼び出しで再実行）
+- start() は登録済みで未実行のステップをバックグラウンドスレッドで順に実行する。
+  何度呼んでもよい（実行中なら何もしない。後から登録されたステップは次の start() で拾う）
+- tools/serve.py で起動するとサーバー起動時に start() する（streamlit run では最初の rerun で）
+- status() で準備状況と所要時間を返す（/healthz・管理ページ・メトリクス）
+
+    LOGIN_TEST_PREWARM=0        # バックグラウンド実行をしない（once() はその場で実行）
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from lib.metrics import REGISTRY
+
+T = TypeVar("T")
+
+WAIT_SECONDS = 30.0     # 実行中のステップを待つ上限（超えたらその場で実行する）
+
+PREWARM_READY = REGISTRY.gauge("login_test_prewarm_ready", "事前準備が全て終わったか（1/0）")
+PREWARM_SECONDS = REGISTRY.gauge("login_test_prewarm_seconds", "事前準備の所要時間（秒、バックグラウンド実行分）")
+PREWARM_STEP_SECONDS = REGISTRY.gauge("login_test_prewarm_step_seconds", "事前準備ステップの所要時間（秒）", ("step", "by"))
+
+class _Step:
+    __slots__ = ("name", "fn", "valid", "cache_if", "state", "value", "error", "seconds", "by", "done")
+
+    def __init__(self, name: str, fn: Callable[[], Any], valid, cache_if):
+        self.name = name
+        self.fn = fn
+        self.valid = valid
+        self.cache_if = cache_if
+        self.state = "pending"      # pending / running / ready / failed
+        self.value: Any = None
+        self.error = ""
+        self.seconds = 0.0
+        self.by = ""                # background / inline
+        self.done = threading.Event()
+
+_lock = threading.Lock()
+_steps: Dict[str, _Step] = {}
+_order: List[str] = []
+_tried: set = set()                 # バックグラウンドで実行を試みたステップ（1 回だけ）
+_thread: Optional[threading.Thread] = None
+_started_at = 0.0
+_background_seconds = 0.0
+
+def enabled() -> bool:
+    return (os.environ.get("LOGIN_TEST_PREWARM") or "1").lower() not in ("0", "false", "off")
+
+def register(name: str, fn: Callable[[], Any], *, valid: Optional[Callable[[Any], bool]] = None,
+             cache_if: Optional[Callable[[Any], bool]] = None) -> None:
+    """ステップを登録する（同じ名前は最初の登録が有効。スクリプトの rerun ごとに呼んでよい）。"""
+    with _lock:
+        if name not in _steps:
+            _steps[name] = _Step(name, fn, valid, cache_if)
+            _order.append(name)
+
+def _claim(step: _Step) -> Optional[threading.Event]:
+    """実行権を取る（_lock 下で呼ぶ）。実行中なら None。"""
+    if step.state == "running":
+        return None
+    step.state = "running"
+    step.done = threading.Event()
+    return step.done
+
+def _run(step: _Step, done: threading.Event, by: str) -> Any:
+    """_claim() した呼び出し元だけが呼ぶ。例外は記録して呼び出し元へ送る。"""
+    t0 = time.perf_counter()
+    try:
+        value = step.fn()
+    except Exception as e:
+        with _lock:
+            step.state, step.value, step.error = "failed", None, f"{type(e).__name__}: {e}"
+        _finish(step, done, by, t0)
+        raise
+    keep = step.cache_if is None or step.cache_if(value)
+    with _lock:
+        step.state = "ready" if keep else "pending"
+        step.value = value if keep else None
+        step.error = ""
+    _finish(step, done, by, t0)
+    return value
+
+def _finish(step: _Step, done: threading.Event, by: str, t0: float) -> None:
+    step.seconds, step.by = time.perf_counter() - t0, by
+    PREWARM_STEP_SECONDS.set(round(step.seconds, 6), step.name, by)
+    done.set()      # 状態を確定してから待っている呼び出し元を起こす
+
+def _still_valid(step: _Step, value: Any) -> bool:
+    if step.valid is None:
+        return True
+    try:
+        return bool(step.valid(value))
+    except Exception:
+        return False
+
+def once(name: str, fn: Optional[Callable[[], T]] = None, *, valid: Optional[Callable[[Any], bool]] = None,
+         cache_if: Optional[Callable[[Any], bool]] = None, timeout: float = WAIT_SECONDS) -> T:
+    """
+    name の結果を返す（プロセス内で 1 回だけ計算）。fn を渡せば未登録時に登録する。
+    バックグラウンドで実行中なら timeout 秒まで待ち、それでも終わらなければその場で計算する。
+    """
+    if fn is not None:
+        register(name, fn, valid=valid, cache_if=cache_if)
+    step = _steps[name]
+    with _lock:
+        state, value, done = step.state, step.value, step.done
+    if state == "running":
+        done.wait(timeout)
+        with _lock:
+            state, value = step.state, step.value
+        if state == "ready":
+            return value
+    elif state == "ready" and _still_valid(step, value):
+        return value
+
+    with _lock:
+        done = _claim(step)
+    if done is None:
+        return step.fn()        # 待ちきれなかった（実行中のものとは別にその場で計算）
+    return _run(step, done, "inline")
+
+def _background() -> None:
+    global _background_seconds
+    t0 = time.perf_counter()
+    while True:
+        with _lock:
+            name = next((n for n in _order if n not in _tried and _steps[n].state == "pending"), None)
+            if name is None:
+                break
+            _tried.add(name)
+            step = _steps[name]
+            done = _claim(step)
+        try:
+            _run(step, done, "background")
+        except Exception:
+            pass    # status() に残す。ページ側は once() でその場で再試行する
+    _background_seconds += time.perf_counter() - t0
+    PREWARM_SECONDS.set(round(_background_seconds, 6))
+    PREWARM_READY.set(1 if ready() else 0)
+
+def start() -> bool:
+    """未実行のステップをバックグラウンドで実行する。スレッドを起こしたら True。"""
+    global _thread, _started_at
+    if not enabled():
+        return False
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        if not any(n not in _tried for n in _order):
+            return False
+        if not _started_at:
+            _started_at = time.time()
+        _thread = threading.Thread(target=_background, name="prewarm", daemon=True)
+        _thread.start()
+    return True
+
+def ready() -> bool:
+    with _lock:
+        return bool(_steps) and all(s.state == "ready" for s in _steps.values())
+
+def wait(timeout: Optional[float] = None) -> bool:
+    """バックグラウンド実行の終了を待つ。全ステップが準備できていれば True。"""
+    t = _thread
+    if t is not None:
+        t.join(timeout)
+    return ready()
+
+def status() -> Dict[str, Any]:
+    with _lock:
+        running = _thread is not None and _thread.is_alive()
+        steps = {
+            n: {"state": s.state, "seconds": round(s.seconds, 4), "by": s.by or None, "error": s.error or None}
+            for n, s in ((n, _steps[n]) for n in _order)
+        }
+    if running:
+        state = "running"
+    elif steps and all(v["state"] == "ready" for v in steps.values()):
+        state = "ready"
+    elif not _started_at:
+        state = "disabled" if not enabled() else "idle"
+    else:
+        state = "partial"
+    return {
+        "state": state,
+        "started_at": _started_at or None,
+        "background_seconds": round(_background_seconds, 4),
+        "steps": steps,
+    }
+
+# ─────────────────────────────────────────────────────────────
+# lib 側の標準ステップ（ページに依存しないもの）
+# ─────────────────────────────────────────────────────────────
+def _warm_sso() -> str:
+    from lib import sso     # st.secrets から秘密鍵を読む
+    sso.refresh_secrets(force=True)
+    return sso._VERIFY_VERSION
+
+def _warm_event_store() -> Dict[str, Any]:
+    from lib import event_store
+    return event_store.prewarm()
+
+def _warm_access_policy() -> Any:
+    from lib import access_settings     # settings.toml の探索・パース・ACL の展開
+    return access_settings.load_access_policy()
+
+def _access_policy_unchanged(result: Any) -> bool:
+    from lib import access_settings
+    return access_settings.settings_unchanged(result)
+
+register("sso_secret", _warm_sso)
+register("access_policy", _warm_access_policy, valid=_access_policy_unchanged, cache_if=lambda r: bool(r[1]))
+register("event_store", _warm_event_store)
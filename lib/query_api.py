@@ -0,0 +1,271 @@
+# login_test_app/lib/query_api.py
+"""
+イベント集計の読み取り専用 JSON API（Streamlit と同じプロセスの別ポート）。
+
+社内ダッシュボードなど機械の利用者向け。ページを開く（＝スクリプト全体の rerun）代わりに、
+同じイベントストアの読み出し・ロールアップをそのまま返す。UI の rerun は発生しない。
+
+    GET /healthz                                      … 認証なし（事前準備の状況つき）
+    GET /api/v1/aggregate?user=&month=                … ユーザー×月×ボタン（archive 込み）
+    GET /api/v1/tail?n=20                             … 直近のイベント（最大 TAIL_MAX 件）
+    GET /api/v1/series?granularity=day&by=button&user=&from=&to=
+                                                      … 時・日・月ごとの件数（ロールアップ）
+    GET /api/v1/range?start_ts=&end_ts=&user=         … 時刻範囲の件数（生イベント、ボタン別）
+    GET /api/v1/export?name=                          … 保護テストページで作成したファイル（自分のもののみ）。
+                                                        lib/export.CHUNK_BYTES ずつ送る（ファイル全体を読み込まない）
+
+認証: 毎リクエスト `Authorization: Bearer <JWT>`（または Cookie prec_sso）を lib/sso.verify_token で検証。
+ページと同じく、有効なトークンなら全ユーザーの集計を読める。
+
+有効化は環境変数（未設定なら起動しない）:
+    LOGIN_TEST_QUERY_API_PORT=9593          # 127.0.0.1 のみで待ち受け
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+from lib import prewarm
+from lib.metrics import REGISTRY
+
+COOKIE_NAME = "prec_sso"
+TAIL_MAX = 1000
+RANGE_MAX_SECONDS = 366 * 86400
+
+API_REQUESTS = REGISTRY.counter("login_test_query_api_requests_total", "クエリ API のリクエスト数", ("endpoint", "status"))
+API_SECONDS = REGISTRY.histogram("login_test_query_api_seconds", "クエリ API の応答時間（秒）", ("endpoint",))
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# ─────────────────────────────────────────────────────────────
+# ストア版ごとのメモ（ページの st.cache_data と同じ考え方）
+# ─────────────────────────────────────────────────────────────
+_memo_lock = threading.Lock()
+_memo: Dict[Tuple[Any, ...], Tuple[Any, Any]] = {}     # key -> (store_version, value)
+_MEMO_MAX = 64
+
+def _memoized(key: Tuple[Any, ...], fn: Callable[[], Any]) -> Any:
+    from lib.event_store import store_version
+
+    version = store_version()
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    value = fn()
+    with _memo_lock:
+        if len(_memo) >= _MEMO_MAX:
+            _memo.clear()
+        _memo[key] = (version, value)
+    return value
+
+# ─────────────────────────────────────────────────────────────
+# エンドポイント
+# ─────────────────────────────────────────────────────────────
+def _arg(q: Dict[str, list], name: str) -> Optional[str]:
+    v = q.get(name)
+    return v[0] if v and v[0] != "" else None
+
+def _int_arg(q: Dict[str, list], name: str, default: Optional[int] = None) -> Optional[int]:
+    v = _arg(q, name)
+    if v is None:
+        return default
+    try:
+        return int(v)
+    except ValueError:
+        raise ApiError(400, f"{name} は整数で指定してください")
+
+def _aggregate(q: Dict[str, list]) -> Any:
+    from lib.export import iter_aggregate_rows
+
+    user, month = _arg(q, "user"), _arg(q, "month")
+    return _memoized(("aggregate", user, month), lambda: list(iter_aggregate_rows(user, month)))
+
+def _tail(q: Dict[str, list]) -> Any:
+    from lib.event_store import tail_events
+
+    n = max(1, min(TAIL_MAX, _int_arg(q, "n", 20) or 20))
+    return _memoized(("tail", n), lambda: tail_events(n))
+
+def _series(q: Dict[str, list]) -> Any:
+    from lib.event_store import ROLLUPS
+    from lib.rollups import GRANULARITIES
+
+    gran = _arg(q, "granularity") or "day"
+    by = _arg(q, "by") or "button"
+    if gran not in GRANULARITIES:
+        raise ApiError(400, f"granularity は {', '.join(GRANULARITIES)} のいずれか")
+    if by not in ("button", "user"):
+        raise ApiError(400, "by は button / user のいずれか")
+    user, lo, hi = _arg(q, "user"), _arg(q, "from"), _arg(q, "to")
+    rows = _memoized(("series", gran, by, user), lambda: ROLLUPS.by_bucket(gran, by=by, user=user))
+    # バケット名（YYYY-MM-DD 等）は文字列順＝時刻順
+    return [r for r in rows if (lo is None or r["bucket"] >= lo) and (hi is None or r["bucket"] <= hi)]
+
+def _range(q: Dict[str, list]) -> Any:
+    from lib.event_store import iter_events_between
+
+    start, end = _int_arg(q, "start_ts"), _int_arg(q, "end_ts")
+    if start is None or end is None or end <= start:
+        raise ApiError(400, "start_ts < end_ts を指定してください")
+    if end - start > RANGE_MAX_SECONDS:
+        raise ApiError(400, "範囲は 366 日以内にしてください（長期は /api/v1/series を使用）")
+    user = _arg(q, "user")
+
+    def count() -> Dict[str, Any]:
+        by_button: Dict[str, int] = {}
+        total = 0
+        for r in iter_events_between(start, end):
+            if user is not None and r.get("user") != user:
+                continue
+            btn = r.get("button") or "-"
+            by_button[btn] = by_button.get(btn, 0) + 1
+            total += 1
+        return {"start_ts": start, "end_ts": end, "user": user, "total": total, "by_button": by_button}
+
+    return _memoized(("range", start, end, user), count)
+
+EXPORT_PATH = "/api/v1/export"      # JSON ではなくファイルを返すので ROUTES とは別に扱う
+
+ROUTES: Dict[str, Callable[[Dict[str, list]], Any]] = {
+    "/api/v1/aggregate": _aggregate,
+    "/api/v1/tail": _tail,
+    "/api/v1/series": _series,
+    "/api/v1/range": _range,
+}
+
+# ─────────────────────────────────────────────────────────────
+# HTTP
+# ─────────────────────────────────────────────────────────────
+def _token_from(headers) -> Optional[str]:
+    auth = headers.get("Authorization") or ""
+    if auth.lower().startswith("bearer "):
+        return auth[7:].strip() or None
+    cookie = SimpleCookie()
+    try:
+        cookie.load(headers.get("Cookie") or "")
+    except Exception:
+        return None
+    morsel = cookie.get(COOKIE_NAME)
+    return morsel.value if morsel else None
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    def _send(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/healthz":
+            warm = prewarm.status()
+            self._send(200, {"ok": True, "ready": warm["state"] == "ready", "prewarm": warm})
+            return
+        if url.path == EXPORT_PATH:
+            self._send_export(url.query)
+            return
+        route = ROUTES.get(url.path)
+        endpoint = url.path if route else "unknown"
+        with API_SECONDS.time(endpoint):
+            status, body = self._handle(route, url.query)
+        API_REQUESTS.inc(endpoint, str(status))
+        self._send(status, body)
+
+    def _send_export(self, query: str) -> None:
+        from lib import export
+        from lib.sso import verify_token
+
+        payload = verify_token(_token_from(self.headers))
+        if not payload:
+            API_REQUESTS.inc(EXPORT_PATH, "401")
+            self._send(401, {"error": "有効な JWT が必要です"})
+            return
+        path = export.resolve_export(_arg(parse_qs(query), "name") or "", payload.get("sub"))
+        try:
+            f = path.open("rb") if path is not None else None
+        except OSError:
+            f = None                # 確認から開くまでの間に消された
+        if f is None:
+            API_REQUESTS.inc(EXPORT_PATH, "404")
+            self._send(404, {"error": "not found"})
+            return
+        API_REQUESTS.inc(EXPORT_PATH, "200")
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8" if path.suffix == ".csv" else "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(path.name)}")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            try:
+                while True:
+                    chunk = f.read(export.CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+            except OSError:
+                pass                # 途中で切断された
+
+    def _handle(self, route, query: str) -> Tuple[int, Any]:
+        if route is None:
+            return 404, {"error": "not found"}
+        from lib.sso import verify_token
+
+        payload = verify_token(_token_from(self.headers))
+        if not payload:
+            return 401, {"error": "有効な JWT が必要です"}
+        try:
+            return 200, {"sub": payload.get("sub"), "data": route(parse_qs(query))}
+        except ApiError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:   # 読み出し失敗でサーバースレッドを落とさない
+            return 500, {"error": type(e).__name__}
+
+    def log_message(self, format, *args):  # noqa: A002 - 親クラスのシグネチャに合わせる
+        return
+
+_server_lock = threading.Lock()
+_server_started = False
+
+def export_url(name: str) -> Optional[str]:
+    """/api/v1/export の URL（LOGIN_TEST_QUERY_API_PORT 未設定・不正なら None）。"""
+    port = os.environ.get("LOGIN_TEST_QUERY_API_PORT") or ""
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        return None
+    return f"http://127.0.0.1:{int(port)}{EXPORT_PATH}?name={quote(name)}"
+
+def start_query_api(port: Optional[int] = None, *, host: str = "127.0.0.1") -> bool:
+    """
+    API サーバーを起動（プロセスにつき 1 回）。引数が無ければ LOGIN_TEST_QUERY_API_PORT を見る。
+    起動済み・未設定・不正な値（数値でない・範囲外）・ポート使用中（同一ホストの別プロセスが起動済み）なら False。
+    """
+    global _server_started
+    if port is None and os.environ.get("LOGIN_TEST_QUERY_API_PORT"):
+        try:
+            port = int(os.environ["LOGIN_TEST_QUERY_API_PORT"])
+        except ValueError:
+            return False        # 設定ミスでページのスクリプトを落とさない
+    if not port or not 0 < port < 65536:
+        return False
+    with _server_lock:
+        if _server_started:
+            return False
+        _server_started = True
+    try:
+        server = ThreadingHTTPServer((host, port), _QueryHandler)
+    except OSError:
+        return False
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="query-api-http", daemon=True).start()
+    return True
@@ -0,0 +1,91 @@
+# login_test_app/lib/rate_limit.py
+"""
+ユーザーごとのトークンバケット（クリック記録の流量制限）。
+
+- 判定は O(1)（辞書 1 回 + 四則演算）。バケットは OrderedDict で最近使った順に並べ、
+  満タンまで回復した（＝新規と同じ）バケットを先頭から捨て、max_keys を超えたら最古を捨てる
+- 抑止した件数はバケットに数えておき、次に許可したときに返す（"N 件抑止" の 1 イベントにまとめる用）
+
+設定は環境変数（LOGIN_TEST_CLICK_RATE=0 で無効）:
+    LOGIN_TEST_CLICK_RATE=5             # 1 秒あたりの補充トークン数
+    LOGIN_TEST_CLICK_BURST=20           # バケット容量（連打の許容量）
+    LOGIN_TEST_CLICK_COALESCE=1         # 抑止分を "_suppressed" イベント 1 件として記録
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from lib.metrics import REGISTRY
+
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 20
+DEFAULT_MAX_KEYS = 10_000
+
+RATE_LIMIT_BUCKETS = REGISTRY.gauge("login_test_rate_limit_buckets", "保持しているトークンバケット数")
+RATE_LIMIT_EVICTIONS = REGISTRY.counter("login_test_rate_limit_evictions_total", "捨てたトークンバケット数", ("reason",))
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, *, max_keys: int = DEFAULT_MAX_KEYS):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate > 0, burst >= 1 を指定してください")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._refill_seconds = self.burst / self.rate     # 空から満タンまで
+        self._lock = threading.Lock()
+        # key -> [tokens, 最終更新時刻, 抑止件数]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> Tuple[bool, int]:
+        """
+        1 トークン消費を試みる。(許可したか, 許可した場合はそれまでに抑止した件数) を返す。
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = [self.burst, now, 0]
+                self._evict(now)
+            else:
+                b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+                self._buckets.move_to_end(key)
+            if b[0] >= 1.0:
+                b[0] -= 1.0
+                suppressed, b[2] = int(b[2]), 0
+                return True, suppressed
+            b[2] += 1
+            return False, 0
+
+    def _evict(self, now: float) -> None:
+        # 先頭（最も長く使われていない）から、満タンまで回復したバケットを捨てる（1 呼び出しで高々数個）
+        for _ in range(2):
+            key, b = next(iter(self._buckets.items()))
+            if now - b[1] < self._refill_seconds or b[2]:
+                break
+            del self._buckets[key]
+            RATE_LIMIT_EVICTIONS.inc("idle")
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            RATE_LIMIT_EVICTIONS.inc("capacity")
+        RATE_LIMIT_BUCKETS.set(len(self._buckets))
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+def limiter_from_env() -> Optional[TokenBucketLimiter]:
+    """環境変数から作る。LOGIN_TEST_CLICK_RATE=0（または不正値）なら None（無制限）。"""
+    try:
+        rate = float(os.environ.get("LOGIN_TEST_CLICK_RATE") or DEFAULT_RATE)
+        burst = float(os.environ.get("LOGIN_TEST_CLICK_BURST") or DEFAULT_BURST)
+    except ValueError:
+        return None
+    if rate <= 0:
+        return None
+    return TokenBucketLimiter(rate, max(1.0, burst))
+
+def coalesce_enabled() -> bool:
+    return (os.environ.get("LOGIN_TEST_CLICK_COALESCE") or "").lower() not in ("", "0", "false", "off")
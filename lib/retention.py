@@ -0,0 +1,205 @@
+# login_test_app/lib/retention.py
+"""
+クリックログの保持期間（生イベント）と、期限切れ分の畳み込み（compaction）。
+
+保持期間を過ぎた生イベントは、月 × ユーザー × ボタン の件数として
+archive_rollups.json に足し込んでから button_clicks.jsonl から削除する。
+ロールアップ / aggregate_by_user_month(include_archive=True) は archive を足し、skip 済みの先頭は読まないので、
+月次の集計は削除後も正確なまま（時・日の粒度と末尾表示からは消える）。
+
+- 対象は統合済みの button_clicks.jsonl だけ（ts 順）。書き込み中のシャードには触れないので
+  追記側は止まらない。休止シャードは統合（event_store.consolidate_idle_shards）後に対象になる
+- 先頭から BATCH_LINES 行ずつ読み、進捗（offset と途中の件数）を retention_state.json に保存する。
+  途中で止まっても次回はそこから再開（ファイルが差し替わっていれば最初から）
+- 確定は「archive に件数と skip（先頭 offset バイトは畳み込み済み）を書く → 残りを新ファイルへ
+  コピーして置き換え → skip を消す」の順。どこで落ちても二重計上・取りこぼしが無い
+
+有効化は環境変数（未設定・0 なら何もしない）:
+    LOGIN_TEST_EVENT_RETENTION_DAYS=90
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from lib.event_store import ARCHIVE_FILE, LOG_DIR, LOG_FILE, maintenance_lock, rebuild_index
+from lib.metrics import REGISTRY
+from lib.rollups import Key, read_archive, write_archive
+
+STATE_FILE = LOG_DIR / "retention_state.json"
+BATCH_LINES = 5000
+BATCH_PAUSE_SECONDS = 0.05      # バッチ間で CPU / IO を譲る
+
+RETENTION_EVENTS = REGISTRY.counter(
+    "login_test_retention_events_compacted_total", "保持期間切れで archive に畳み込んだ生イベント数")
+RETENTION_BYTES = REGISTRY.counter(
+    "login_test_retention_bytes_reclaimed_total", "保持期間切れで削除したログのバイト数")
+RETENTION_OFFSET = REGISTRY.gauge(
+    "login_test_retention_scan_offset_bytes", "畳み込み済み（未確定含む）の位置")
+RETENTION_PENDING = REGISTRY.gauge(
+    "login_test_retention_log_bytes", "統合済みログの現在のサイズ")
+RETENTION_RATE = REGISTRY.gauge(
+    "login_test_retention_events_per_second", "直近の実行の処理速度（行/秒）")
+RETENTION_LAST_SUCCESS = REGISTRY.gauge(
+    "login_test_retention_last_success_timestamp_seconds", "最後に確定まで終わった時刻")
+
+def retention_days() -> int:
+    try:
+        return max(0, int(os.environ.get("LOGIN_TEST_EVENT_RETENTION_DAYS") or 0))
+    except ValueError:
+        return 0
+
+# ─────────────────────────────────────────────────────────────
+# 途中経過
+# ─────────────────────────────────────────────────────────────
+def _load_state() -> Dict[str, Any]:
+    try:
+        data = json.loads(STATE_FILE.read_text("utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _save_state(ino: int, offset: int, counts: Dict[Key, int], events: int, cutoff: int) -> None:
+    data = {
+        "ino": ino,
+        "offset": offset,
+        "events": events,
+        "cutoff": cutoff,
+        "counts": [[m, u, btn, n] for (m, u, btn), n in counts.items()],
+    }
+    tmp = STATE_FILE.with_name(f".{STATE_FILE.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, STATE_FILE)
+
+# ─────────────────────────────────────────────────────────────
+# 確定（先頭を切り落とす）
+# ─────────────────────────────────────────────────────────────
+def _finish_pending_truncate() -> int:
+    """archive の skip が現在の button_clicks.jsonl を指していれば、その先頭を削除する。"""
+    archive = read_archive(ARCHIVE_FILE)
+    skip = archive["skip"].get(LOG_FILE.name)
+    if skip is None:
+        return 0
+    ino, offset = skip
+    reclaimed = 0
+    try:
+        current = LOG_FILE.stat().st_ino
+    except OSError:
+        current = None
+    if current == ino:
+        tmp = LOG_FILE.with_name(f".{LOG_FILE.name}.{os.getpid()}.tmp")
+        with LOG_FILE.open("rb") as src, tmp.open("wb") as dst:
+            src.seek(offset)
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.replace(tmp, LOG_FILE)
+        rebuild_index(LOG_FILE)
+        reclaimed = offset
+        RETENTION_BYTES.inc(amount=offset)
+    # 差し替え済み（または消えた）ので skip は不要。inode の再利用で誤爆しないよう消す
+    write_archive(ARCHIVE_FILE, archive["counts"], {})
+    STATE_FILE.unlink(missing_ok=True)
+    return reclaimed
+
+# ─────────────────────────────────────────────────────────────
+# 実行
+# ─────────────────────────────────────────────────────────────
+def run_retention(
+    days: Optional[int] = None,
+    *,
+    now: Optional[float] = None,
+    batch_lines: int = BATCH_LINES,
+    max_batches: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    ts < now - days 日 のイベントを先頭から畳み込んで削除する。
+    max_batches を渡すとそこで中断し（status="partial"）、次回そこから再開する。
+    """
+    days = retention_days() if days is None else days
+    if days <= 0:
+        return {"status": "disabled"}
+    cutoff = int((now if now is not None else time.time()) - days * 86400)
+    with maintenance_lock() as locked:
+        if not locked:
+            return {"status": "busy"}
+        _finish_pending_truncate()          # 前回の確定が途中で止まっていれば続き
+        try:
+            st = LOG_FILE.stat()
+        except OSError:
+            return {"status": "empty"}
+        RETENTION_PENDING.set(st.st_size)
+
+        state = _load_state()
+        counts: Dict[Key, int] = defaultdict(int)
+        if state.get("ino") == st.st_ino and 0 < int(state.get("offset") or 0) <= st.st_size:
+            offset = int(state["offset"])
+            events = int(state.get("events") or 0)
+            for m, u, btn, n in state.get("counts") or []:
+                counts[(m, u, btn)] += int(n)
+        else:
+            offset, events = 0, 0
+        start_offset, start_events, t0 = offset, events, time.monotonic()
+
+        done = False
+        batches = 0
+        with LOG_FILE.open("rb") as f:
+            f.seek(offset)
+            while not done:
+                for _ in range(batch_lines):
+                    raw = f.readline()
+                    if not raw or not raw.endswith(b"\n"):
+                        done = True             # 末尾（書きかけの行は残す）
+                        break
+                    try:
+                        row = json.loads(raw) if raw.strip() else None
+                    except ValueError:
+                        row = None              # 壊れた行は畳み込まずに捨てる
+                    if row is not None:
+                        if int(row.get("ts") or 0) >= cutoff:
+                            done = True         # ここから先は保持期間内
+                            break
+                        key = (row.get("month") or "unknown", row.get("user") or "unknown", row.get("button") or "-")
+                        counts[key] += 1
+                        events += 1
+                    offset += len(raw)
+                _save_state(st.st_ino, offset, counts, events, cutoff)
+                RETENTION_OFFSET.set(offset)
+                batches += 1
+                if not done and max_batches is not None and batches >= max_batches:
+                    break
+                if not done:
+                    time.sleep(BATCH_PAUSE_SECONDS)
+
+        elapsed = time.monotonic() - t0
+        RETENTION_RATE.set((events - start_events) / elapsed if elapsed > 0 else 0.0)
+        result: Dict[str, Any] = {
+            "cutoff": cutoff,
+            "scanned_bytes": offset - start_offset,
+            "offset": offset,
+            "size": st.st_size,
+            "events": events,
+            "elapsed_s": round(elapsed, 3),
+        }
+        if not done:
+            return {"status": "partial", **result}
+        if offset == 0:
+            STATE_FILE.unlink(missing_ok=True)
+            RETENTION_LAST_SUCCESS.set(time.time())
+            return {"status": "nothing_to_do", **result}
+
+        archive = read_archive(ARCHIVE_FILE)
+        merged = defaultdict(int, archive["counts"])
+        for key, n in counts.items():
+            merged[key] += n
+        write_archive(ARCHIVE_FILE, merged, {LOG_FILE.name: (st.st_ino, offset)})
+        reclaimed = _finish_pending_truncate()
+        RETENTION_EVENTS.inc(amount=events)
+        RETENTION_OFFSET.set(0)
+        RETENTION_PENDING.set(st.st_size - reclaimed)
+        RETENTION_LAST_SUCCESS.set(time.time())
+        return {"status": "compacted", "reclaimed_bytes": reclaimed, **result}
@@ -0,0 +1,310 @@
+# login_test_app/lib/rollups.py
+"""
+書き込み時ロールアップ（時・日・月 × ユーザー × ボタン の件数）。
+
+- append_click_event が書いたイベントをその場でメモリ上のカウンタへ加算する
+- カウンタは「各シャードの先頭から covered バイト目まで」を反映した状態として管理し、
+  他プロセスの追記で covered とずれたら refresh() が差分だけ読み足す（常に正確）
+- 一定間隔でチェックポイント（JSON）へ保存し、再起動時はそこから差分だけ追いつく
+- シャードが統合されたら、統合の記録（統合後のファイルの inode・サイズと統合元の inode・サイズ）を見て、
+  統合元を全部反映済みならその位置を統合後のファイルへ引き継ぐ（読み直さない）
+- チェックポイントが無い・引き継げない統合や差し替え・縮小があった場合は生イベントから作り直す
+- 保持期間を過ぎて削除された生イベントの件数は archive（月 × ユーザー × ボタン）から補う
+  （lib/retention.py が生イベントを畳み込んで書く）
+
+ダッシュボードは by_bucket() / user_month_table() を読むだけで、イベント量に依存しない。
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+GRANULARITIES = ("hour", "day", "month")
+CHECKPOINT_SECONDS = 30.0
+
+Key = Tuple[str, str, str]     # (bucket, user, button)
+
+# ─────────────────────────────────────────────────────────────
+# アーカイブ（削除済み生イベントの月次件数）
+# ─────────────────────────────────────────────────────────────
+def read_archive(path: Optional[Path]) -> dict:
+    """
+    {"counts": {(month, user, button): n}, "skip": {シャード名: (inode, offset)}}
+    skip は「そのシャード（inode 一致時）の先頭 offset バイトは counts に畳み込み済み」の意味。
+    """
+    out: dict = {"counts": {}, "skip": {}}
+    if path is None:
+        return out
+    try:
+        data = json.loads(path.read_text("utf-8"))
+    except (OSError, ValueError):
+        return out
+    for m, u, btn, n in data.get("counts") or []:
+        out["counts"][(m, u, btn)] = int(n)
+    out["skip"] = {name: (int(v[0]), int(v[1])) for name, v in (data.get("skip") or {}).items()}
+    return out
+
+def write_archive(path: Path, counts: Dict[Key, int], skip: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+    data = {
+        "counts": [[m, u, btn, n] for (m, u, btn), n in sorted(counts.items())],
+        "skip": {name: [ino, off] for name, (ino, off) in (skip or {}).items()},
+        "saved_at": int(time.time()),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+# ─────────────────────────────────────────────────────────────
+# 統合の記録（直近 1 回分）
+# ─────────────────────────────────────────────────────────────
+def read_consolidation(path: Optional[Path]) -> Optional[dict]:
+    """
+    {"log": (名前, inode, サイズ), "sources": {シャード名: (inode, サイズ)}} か None。
+    「inode の log のサイズまでは、sources（各サイズまで）を合わせたものと同じ内容」の意味。
+    """
+    if path is None:
+        return None
+    try:
+        data = json.loads(path.read_text("utf-8"))
+        name, ino, size = data["log"]
+        sources = {n: (int(v[0]), int(v[1])) for n, v in data["sources"].items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return {"log": (str(name), int(ino), int(size)), "sources": sources}
+
+def write_consolidation(path: Path, log: Tuple[str, int, int], sources: Dict[str, Tuple[int, int]]) -> None:
+    """統合後のファイルを置き換える前に書く（置き換える前に落ちたら inode が一致しないので使われない）。"""
+    data = {
+        "log": list(log),
+        "sources": {name: [ino, size] for name, (ino, size) in sources.items()},
+        "saved_at": int(time.time()),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def buckets_of(row: dict) -> Dict[str, str]:
+    """イベント 1 行の各粒度のバケット（append_click_event と同じローカル時刻）。"""
+    iso = str(row.get("iso") or "")
+    return {
+        "hour": iso[:13] if len(iso) >= 13 else "unknown",    # YYYY-MM-DDTHH
+        "day": iso[:10] if len(iso) >= 10 else "unknown",     # YYYY-MM-DD
+        "month": row.get("month") or "unknown",               # aggregate_by_user_month と同じ扱い
+    }
+
+class Rollups:
+    def __init__(self, shards: Callable[[], List[Path]], checkpoint_file: Path,
+                 archive_file: Optional[Path] = None, consolidation_file: Optional[Path] = None):
+        self.shards = shards                  # 現在のシャード一覧を返す関数
+        self.checkpoint_file = checkpoint_file
+        self.archive_file = archive_file
+        self.consolidation_file = consolidation_file
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[Key, int]] = {g: defaultdict(int) for g in GRANULARITIES}
+        self._covered: Dict[str, Tuple[int, int]] = {}   # シャード名 -> (inode, 反映済みバイト数)
+        self._merged: Dict[str, int] = {}                # 統合済み（消える前の）シャード名 -> inode。読まない
+        self._loaded = False
+        self._last_checkpoint = time.monotonic()
+
+    # ---- 更新 ----
+    def _fold(self, row: dict) -> None:
+        user = row.get("user") or "unknown"
+        btn = row.get("button") or "-"
+        for g, b in buckets_of(row).items():
+            self._counts[g][(b, user, btn)] += 1
+
+    def on_append(self, event: dict, shard: Path, offset: int, nbytes: int) -> None:
+        """追記直後に呼ぶ。直前まで反映済みなら O(1) で加算、ずれていれば refresh に任せる。"""
+        with self._lock:
+            self._ensure_loaded()
+            cur = self._covered.get(shard.name)
+            if cur is None and offset == 0:
+                try:
+                    cur = self._covered[shard.name] = (shard.stat().st_ino, 0)
+                except OSError:
+                    cur = None
+            if cur is not None and cur[1] == offset:
+                self._fold(event)
+                self._covered[shard.name] = (cur[0], offset + nbytes)
+            self._maybe_checkpoint()
+
+    def refresh(self) -> None:
+        """各シャード末尾の未反映分（他プロセスの追記など）だけ読み足す。"""
+        with self._lock:
+            self._ensure_loaded()
+            self._catch_up()
+            self._maybe_checkpoint()
+
+    def rebuild(self) -> None:
+        """生イベントから作り直し、チェックポイントも書き直す。"""
+        with self._lock:
+            self._loaded = True
+            self._reset()
+            self._catch_up()
+            self._write_checkpoint()
+
+    def _reset(self) -> None:
+        """アーカイブ分だけを反映した状態に戻す（時・日の粒度には残らない）。"""
+        self._counts = {g: defaultdict(int) for g in GRANULARITIES}
+        self._covered = {}
+        self._merged = {}
+        archive = read_archive(self.archive_file)
+        for key, n in archive["counts"].items():
+            self._counts["month"][key] += n
+        for p in self.shards():
+            skip = archive["skip"].get(p.name)
+            if skip is None:
+                continue
+            try:
+                if p.stat().st_ino == skip[0]:
+                    self._covered[p.name] = skip
+            except OSError:
+                pass
+
+    def _catch_up(self) -> None:
+        current: Dict[str, Tuple[Path, int, int]] = {}
+        for p in self.shards():
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            current[p.name] = (p, st.st_ino, st.st_size)
+        # シャードの消滅（統合・削除）や差し替え・縮小があれば、統合で説明できれば引き継ぎ、できなければ作り直す
+        changed = []
+        for name, (ino, off) in self._covered.items():
+            cur = current.get(name)
+            if cur is None or cur[1] != ino or cur[2] < off:
+                changed.append(name)
+        fresh = any(name not in self._covered and self._merged.get(name) != ino
+                    for name, (_, ino, _) in current.items())
+        if (changed or fresh) and not self._carry_over(current, changed) and changed:
+            self._reset()
+        self._merged = {n: ino for n, ino in self._merged.items() if n in current and current[n][1] == ino}
+        for name, (p, ino, size) in current.items():
+            if self._merged.get(name) == ino:
+                continue                        # 統合後のファイルに入っている（消される前のシャード）
+            off = self._covered.get(name, (ino, 0))[1]
+            if size > off:
+                off = self._read_from(p, off)
+            self._covered[name] = (ino, off)
+
+    def _carry_over(self, current: Dict[str, Tuple[Path, int, int]], changed: List[str]) -> bool:
+        """
+        changed（消えた・差し替わったシャード）が直近の統合だけで説明でき、統合元を全部
+        （統合時のサイズまで）反映済みなら、統合後のファイルをそのサイズまで反映済みとして引き継ぐ。
+        統合元がまだ消されていなくても（置き換えの直後）引き継ぎ、残っている統合元は読まないようにする。
+        引き継げなければ False（changed があれば呼び出し側で作り直す）。
+        """
+        rec = read_consolidation(self.consolidation_file)
+        if rec is None:
+            return False
+        target, ino, size = rec["log"]
+        sources = rec["sources"]
+        cur = current.get(target)
+        if cur is None or cur[1] != ino or cur[2] < size:
+            return False
+        if self._covered.get(target, (None, 0))[0] == ino:
+            return not changed          # 引き継ぎ済み
+        if any(name != target and name not in sources for name in changed):
+            return False
+        if any(self._covered.get(name) != src for name, src in sources.items()):
+            return False                # 読み切っていない統合元がある（その残りはもう読めない）
+        for name, (src_ino, _) in sources.items():
+            self._covered.pop(name, None)
+            if name != target:
+                self._merged[name] = src_ino
+        self._covered[target] = (ino, size)
+        return True
+
+    def _read_from(self, path: Path, offset: int) -> int:
+        with path.open("rb") as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break                       # 書きかけの行は次回に回す
+                offset += len(raw)
+                if raw.strip():
+                    try:
+                        self._fold(json.loads(raw))
+                    except ValueError:
+                        pass
+        return offset
+
+    # ---- チェックポイント ----
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            data = json.loads(self.checkpoint_file.read_text("utf-8"))
+        except (OSError, ValueError):
+            data = None
+        if not (isinstance(data, dict) and isinstance(data.get("shards"), dict)):
+            self._reset()
+        else:
+            for g in GRANULARITIES:
+                for b, u, btn, n in data.get("counts", {}).get(g, []):
+                    self._counts[g][(b, u, btn)] = n
+            self._covered = {name: (int(v[0]), int(v[1])) for name, v in data["shards"].items()}
+            self._merged = {name: int(ino) for name, ino in (data.get("merged") or {}).items()}
+        self._catch_up()
+
+    def _maybe_checkpoint(self) -> None:
+        if time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS:
+            self._write_checkpoint()
+
+    def _write_checkpoint(self) -> None:
+        self._last_checkpoint = time.monotonic()
+        data = {
+            "shards": {name: [ino, off] for name, (ino, off) in self._covered.items()},
+            "merged": dict(self._merged),
+            "saved_at": int(time.time()),
+            "counts": {g: [[b, u, btn, n] for (b, u, btn), n in c.items()] for g, c in self._counts.items()},
+        }
+        try:
+            self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.checkpoint_file.with_name(f".{self.checkpoint_file.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.checkpoint_file)
+        except OSError:
+            pass
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self._write_checkpoint()
+
+    # ---- 読み出し ----
+    def by_bucket(self, granularity: str, *, by: str = "button", user: Optional[str] = None) -> List[dict]:
+        """
+        粒度 granularity（hour/day/month）ごとの件数。
+        by="button" → {bucket, button, count} / by="user" → {bucket, user, count}
+        user を渡すとそのユーザー分だけ。
+        """
+        self.refresh()
+        out: Dict[Tuple[str, str], int] = defaultdict(int)
+        with self._lock:
+            for (b, u, btn), n in self._counts[granularity].items():
+                if user is not None and u != user:
+                    continue
+                out[(b, btn if by == "button" else u)] += n
+        return [{"bucket": b, by: k, "count": n} for (b, k), n in sorted(out.items())]
+
+    def user_month_table(self) -> List[dict]:
+        """aggregate_by_user_month と同じ形（月→ユーザー→ボタン順）。"""
+        self.refresh()
+        with self._lock:
+            items = list(self._counts["month"].items())
+        items.sort(key=lambda x: (x[0][0], x[0][1], x[0][2]))
+        return [{"user": u, "month": m, "button": btn, "count": n} for (m, u, btn), n in items]
+
+    def total(self) -> int:
+        self.refresh()
+        with self._lock:
+            return sum(self._counts["month"].values())
@@ -0,0 +1,282 @@
+# login_test_app/lib/session_auth.py
+"""
+セッションごとの認証状態（session_state に置く唯一の認証オブジェクト）。
+
+- 検証済み JWT の payload(dict) は保持しない。必要な項目だけを __slots__ の小さな記録にする
+  （user・exp・apps・判定フラグ・理由・トークンのダイジェスト）
+- apps はプロセス内で共有するタプルに intern する（同じ権限のセッションは同じタプルを指す）。
+  user / reason も sys.intern
+- 同じ Cookie（ダイジェスト一致）・同じ検証関数で期限内なら再検証しない（ページ遷移・fragment 再実行で毎回 decode しない）。
+  ページによって検証関数（鍵・iss/aud の扱い）が違うので、記録には検証した関数の名前も持ち、
+  別の検証関数で作られた記録は使い回さない
+- 記録はセッション ID → 弱参照 で登録し、管理ページで件数・概算メモリを出す（セッション終了で自然に消える）
+
+    auth = authenticate(raw_token, verify_jwt)     # SessionAuth / None（無効・期限切れ）
+    auth.user, auth.apps, auth.allowed
+"""
+from __future__ import annotations
+import hashlib
+import sys
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import streamlit as st
+
+from lib.metrics import REGISTRY
+
+SESSION_KEY = "auth"                # st.session_state[SESSION_KEY] -> SessionAuth
+
+SESSION_AUTH_RECORDS = REGISTRY.gauge("login_test_session_auth_records", "認証記録を持つセッション数（このプロセス）")
+SESSION_AUTH_RESULTS = REGISTRY.counter("login_test_session_auth_total", "セッション認証の結果", ("result",))
+
+# 判定フラグ
+VERIFIED = 1
+ACL_CHECKED = 2
+ALLOWED = 4
+ADMIN = 8
+
+# ─────────────────────────────────────────────────────────────
+# apps の intern
+# ─────────────────────────────────────────────────────────────
+_apps_lock = threading.Lock()
+_apps_pool: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+APPS_POOL_MAX = 4096        # 権限の組み合わせがこれを超えたら intern しない（上限つき）
+
+def intern_apps(apps: Optional[Iterable[Any]]) -> Tuple[str, ...]:
+    """apps を重複なし・ソート済みのタプルにして、同じ内容ならプロセス内で同じオブジェクトを返す。"""
+    if not apps or isinstance(apps, (str, bytes)):
+        return ()
+    key = tuple(sorted({sys.intern(str(a)) for a in apps}))
+    with _apps_lock:
+        hit = _apps_pool.get(key)
+        if hit is not None:
+            return hit
+        if len(_apps_pool) < APPS_POOL_MAX:
+            _apps_pool[key] = key
+    return key
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()[:16]
+
+# ─────────────────────────────────────────────────────────────
+# 記録
+# ─────────────────────────────────────────────────────────────
+class SessionAuth:
+    __slots__ = ("user", "exp", "apps", "flags", "reason", "digest", "verifier", "__weakref__")
+
+    def __init__(self, user: str, exp: int, apps: Tuple[str, ...] = (), *,
+                 flags: int = VERIFIED, reason: str = "", digest: bytes = b"", verifier: str = ""):
+        self.user = sys.intern(user)
+        self.exp = int(exp)
+        self.apps = apps
+        self.flags = flags
+        self.reason = sys.intern(reason)
+        self.digest = digest
+        self.verifier = sys.intern(verifier)
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any], token: str, *, verifier: str = "") -> "SessionAuth":
+        exp = payload.get("exp")
+        return cls(
+            str(payload.get("sub") or "unknown"),
+            int(exp) if isinstance(exp, (int, float)) else 0,
+            intern_apps(payload.get("apps")),
+            digest=token_digest(token),
+            verifier=verifier,
+        )
+
+    # ---- 状態 ----
+    @property
+    def verified(self) -> bool:
+        return bool(self.flags & VERIFIED)
+
+    @property
+    def allowed(self) -> Optional[bool]:
+        """ACL 判定済みなら True/False、未判定なら None。"""
+        return bool(self.flags & ALLOWED) if self.flags & ACL_CHECKED else None
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self.flags & ADMIN)
+
+    def expired(self, now: Optional[float] = None, leeway: int = 0) -> bool:
+        return bool(self.exp) and (time.time() if now is None else now) > self.exp + leeway
+
+    def rebind(self, token: str, exp: int) -> None:
+        """Cookie のトークンを再発行した（同じ sub・apps）。次の rerun で再検証しないよう付け替える。"""
+        self.digest = token_digest(token)
+        self.exp = int(exp)
+
+    def set_decision(self, allowed: bool, reason: str, *, admin: bool = False) -> None:
+        flags = (self.flags & VERIFIED) | ACL_CHECKED
+        if allowed:
+            flags |= ALLOWED
+        if admin:
+            flags |= ADMIN
+        self.flags = flags
+        self.reason = sys.intern(reason)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """表示用（payload の代わりに st.write する）。"""
+        return {
+            "sub": self.user,
+            "exp": self.exp,
+            "apps": list(self.apps),
+            "verified": self.verified,
+            "allowed": self.allowed,
+            "admin": self.is_admin,
+            "reason": self.reason or None,
+            "verifier": self.verifier or None,
+        }
+
+    def __repr__(self) -> str:
+        return (f"SessionAuth(user={self.user!r}, exp={self.exp}, apps={self.apps!r}, flags={self.flags}, "
+                f"verifier={self.verifier!r})")
+
+# ─────────────────────────────────────────────────────────────
+# セッションとの対応
+# ─────────────────────────────────────────────────────────────
+_registry_lock = threading.Lock()
+_registry: "weakref.WeakValueDictionary[str, SessionAuth]" = weakref.WeakValueDictionary()
+
+def _session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+    except Exception:
+        return ""
+    return getattr(ctx, "session_id", "") or ""
+
+def _register(auth: SessionAuth) -> None:
+    sid = _session_id()
+    if not sid:
+        return
+    with _registry_lock:
+        _registry[sid] = auth
+        SESSION_AUTH_RECORDS.set(len(_registry))
+
+def current_session_auth() -> Optional[SessionAuth]:
+    auth = st.session_state.get(SESSION_KEY)
+    return auth if isinstance(auth, SessionAuth) else None
+
+def clear_session_auth() -> None:
+    st.session_state.pop(SESSION_KEY, None)
+
+def verifier_id(verify: Callable[..., Any]) -> str:
+    """検証関数の識別子（モジュール名.修飾名）。記録を使い回してよいかの判定に使う。"""
+    name = getattr(verify, "verifier_id", None)     # ラッパー（キャッシュ等）は元の関数の識別子を引き継げる
+    if isinstance(name, str) and name:
+        return name
+    return f"{getattr(verify, '__module__', '?')}.{getattr(verify, '__qualname__', repr(verify))}"
+
+def authenticate(token: Optional[str], verify: Callable[[str], Optional[Dict[str, Any]]],
+                 *, leeway: int = 30) -> Optional[SessionAuth]:
+    """
+    Cookie のトークンからこのセッションの記録を返す。無効・期限切れなら記録を消して None。
+    同じトークン・同じ verify で作った期限内の記録があれば verify を呼ばずに再利用する
+    （別の verify の記録は、鍵や iss/aud の扱いが違うので必ず検証し直す）。
+    """
+    if not token:
+        clear_session_auth()
+        SESSION_AUTH_RESULTS.inc("missing")
+        return None
+    digest = token_digest(token)
+    vid = verifier_id(verify)
+    auth = current_session_auth()
+    if (auth is not None and auth.digest == digest and auth.verifier == vid
+            and not auth.expired(leeway=leeway)):
+        SESSION_AUTH_RESULTS.inc("reused")
+        return auth
+    payload = verify(token)
+    if not payload:
+        clear_session_auth()
+        SESSION_AUTH_RESULTS.inc("rejected")
+        return None
+    auth = SessionAuth.from_payload(payload, token, verifier=vid)
+    st.session_state[SESSION_KEY] = auth
+    _register(auth)
+    SESSION_AUTH_RESULTS.inc("verified")
+    return auth
+
+# ─────────────────────────────────────────────────────────────
+# メモリの概算
+# ─────────────────────────────────────────────────────────────
+def approx_size(obj: Any, seen: Optional[set] = None) -> int:
+    """sys.getsizeof を辿った概算（コンテナ・__slots__・__dict__ を再帰、共有オブジェクトは 1 回）。"""
+    seen = set() if seen is None else seen
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, (str, bytes, int, float, bool)) or o is None:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            for name in getattr(type(o), "__slots__", ()):
+                if name != "__weakref__" and hasattr(o, name):
+                    stack.append(getattr(o, name))
+            d = getattr(o, "__dict__", None)
+            if isinstance(d, dict):
+                stack.append(d)
+    return total
+
+def _streamlit_session_count() -> Optional[int]:
+    """Streamlit ランタイムの接続中セッション数（取れなければ None）。"""
+    try:
+        from streamlit.runtime import Runtime
+        if not Runtime.exists():
+            return None
+        mgr = getattr(Runtime.instance(), "_session_mgr", None)
+        return int(mgr.num_active_sessions()) if mgr is not None else None
+    except Exception:
+        return None
+
+def session_state_sizes() -> List[Tuple[str, int]]:
+    """このセッションの session_state をキーごとの概算バイト数で（大きい順）。"""
+    sizes = []
+    for k in list(st.session_state.keys()):
+        try:
+            v = st.session_state[k]
+        except Exception:
+            continue
+        sizes.append((str(k), approx_size(v)))
+    sizes.sort(key=lambda kv: -kv[1])
+    return sizes
+
+def memory_report() -> Dict[str, Any]:
+    """
+    プロセス内の認証記録の件数と概算メモリ。
+    apps のタプルは共有なので、記録ごとの値は共有分を除いた「1 セッションあたりの増分」。
+    """
+    with _registry_lock:
+        records = list(_registry.values())
+        SESSION_AUTH_RECORDS.set(len(records))
+    with _apps_lock:
+        pool = list(_apps_pool.values())
+    shared_seen: set = set()
+    shared = approx_size(pool, shared_seen)
+    per = [approx_size(r, set(shared_seen)) for r in records]
+    total = sum(per)
+    return {
+        "auth_records": len(records),
+        "streamlit_sessions": _streamlit_session_count(),
+        "per_session_bytes_avg": round(total / len(per)) if per else 0,
+        "per_session_bytes_max": max(per) if per else 0,
+        "auth_records_bytes_total": total,
+        "apps_tuples_interned": len(pool),
+        "apps_tuples_bytes": shared,
+        "users": sorted({r.user for r in records}),
+    }
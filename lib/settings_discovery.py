@@ -0,0 +1,121 @@
+# login_test_app/lib/settings_discovery.py
+"""
+settings.toml の自動探索（app.py の 2.3）。
+
+- os.scandir で 1 ディレクトリ 1 回の読み出し。DirEntry の種別情報を使うので子ごとの stat が不要
+- .git / .venv / node_modules / data などは降りない（PRUNE、環境変数で差し替え可）
+- 各ディレクトリで子に auth_portal_app があるときだけ settings.toml を確認し、最初の 1 件で打ち切る
+- 複数の探索ルートを小さなスレッドプールで同時に走らせる。結果はルートの優先順
+  （先のルートで見つかれば後のルートは打ち切り、後のルートで先に見つかっても先のルートを待つ）
+
+探索順はルート内で幅優先（従来の _iter_dirs_bounded と同じ）。同じ深さは名前順で決定的。
+
+    LOGIN_TEST_DISCOVERY_PRUNE=".*,node_modules,data"    # 降りない名前（fnmatch 可、カンマ区切り）
+"""
+from __future__ import annotations
+import fnmatch
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+TARGET = ("auth_portal_app", ".streamlit", "settings.toml")
+DEFAULT_PRUNE = (
+    ".*", "__pycache__", "node_modules", "venv", "env", "site-packages",
+    "data", "dist", "build", "logs", "tmp",
+)
+MAX_WORKERS = 4
+
+class Pruner:
+    """名前による枝刈り。ワイルドカードを含まない名前は集合で O(1) 判定。"""
+
+    def __init__(self, patterns: Sequence[str]):
+        names = [p for p in patterns if p]
+        self.exact: FrozenSet[str] = frozenset(p for p in names if not any(c in p for c in "*?["))
+        self.globs: Tuple[str, ...] = tuple(p for p in names if p not in self.exact)
+        self.hidden = ".*" in self.globs    # よくあるので先に判定
+        self.globs = tuple(g for g in self.globs if g != ".*")
+
+    def __call__(self, name: str) -> bool:
+        if name in self.exact or (self.hidden and name.startswith(".")):
+            return True
+        return any(fnmatch.fnmatchcase(name, g) for g in self.globs)
+
+def pruner_from_env() -> Pruner:
+    raw = os.environ.get("LOGIN_TEST_DISCOVERY_PRUNE")
+    patterns = [p.strip() for p in raw.split(",")] if raw is not None else list(DEFAULT_PRUNE)
+    return Pruner(patterns)
+
+def iter_dirs(root: Path, *, max_depth: int, prune: Pruner,
+              stop: Optional[threading.Event] = None) -> Iterator[Tuple[str, List[str]]]:
+    """
+    幅優先で (ディレクトリ, 子ディレクトリ名の一覧) を返す。子は名前順。
+    枝刈り対象の子は一覧に含めない。
+    """
+    dq = deque([(str(root), 0)])
+    while dq:
+        if stop is not None and stop.is_set():
+            return
+        base, d = dq.popleft()
+        try:
+            with os.scandir(base) as it:
+                children = sorted(e.name for e in it if e.is_dir())
+        except OSError:
+            continue
+        yield base, children
+        if d < max_depth:
+            for name in children:
+                if not prune(name):
+                    dq.append((os.path.join(base, name), d + 1))
+
+def find_in_root(root: Path, *, max_depth: int = 4, prune: Optional[Pruner] = None,
+                 stop: Optional[threading.Event] = None) -> Optional[Path]:
+    prune = prune or pruner_from_env()
+    for base, children in iter_dirs(root, max_depth=max_depth, prune=prune, stop=stop):
+        if TARGET[0] in children:
+            candidate = os.path.join(base, *TARGET)
+            if os.path.isfile(candidate):
+                return Path(candidate)
+    return None
+
+def find_settings(roots: Sequence[Path], *, max_depth: int = 4, prune: Optional[Pruner] = None,
+                  workers: int = MAX_WORKERS) -> Optional[Path]:
+    """
+    roots を優先順に探索し、最初に見つかったルートの結果を返す（重複・存在しないルートは除く）。
+    """
+    prune = prune or pruner_from_env()
+    uniq: List[Path] = []
+    for r in roots:
+        r = r.resolve()
+        if r.is_dir() and r not in uniq:
+            uniq.append(r)
+    if not uniq:
+        return None
+    if len(uniq) == 1 or workers <= 1:
+        for r in uniq:
+            found = find_in_root(r, max_depth=max_depth, prune=prune)
+            if found is not None:
+                return found
+        return None
+
+    # stops[i] は「i より前のルートで見つかった」合図。i 以降を打ち切る
+    stops = [threading.Event() for _ in uniq]
+
+    def run(i: int) -> Optional[Path]:
+        found = find_in_root(uniq[i], max_depth=max_depth, prune=prune, stop=stops[i])
+        if found is not None:
+            for ev in stops[i + 1:]:
+                ev.set()
+        return found
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(uniq)), thread_name_prefix="settings-discovery") as pool:
+        futures = [pool.submit(run, i) for i in range(len(uniq))]
+        for fut in futures:             # 優先順に結果を確定
+            found = fut.result()
+            if found is not None:
+                for ev in stops:
+                    ev.set()
+                return found
+    return None
@@ -0,0 +1,120 @@
+# login_test_app/lib/shared_cache.py
+"""
+同一ホスト上の複数 Streamlit プロセスで共有するキャッシュ（SQLite ファイル）。
+
+nginx 配下で /login_test を複数プロセス起動している場合に、
+  - 検証済みトークン（lib/sso.py。verify_jwt も cached_verifier 経由で）
+  - settings.toml の探索結果とパース済みスナップショット（app.py）
+を共有し、再起動直後・新規レプリカでもすぐ温まるようにする。
+
+各エントリは version（設定ファイルの mtime/size や秘密鍵のハッシュ等）と期限を持ち、
+読み出し側の version と一致しなければミス扱い。
+
+有効化は環境変数（未設定なら get_shared_cache() は None を返し、従来どおり動く）:
+    LOGIN_TEST_SHARED_CACHE=/dev/shm/login_test_cache.sqlite
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns      TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    version TEXT NOT NULL,
+    value   TEXT NOT NULL,
+    expires REAL,
+    PRIMARY KEY (ns, key)
+)
+"""
+
+class SharedCache:
+    """SQLite(WAL) によるプロセス間キャッシュ。接続はスレッドごとに持つ。"""
+
+    def __init__(self, path: Path, *, busy_timeout_ms: int = 200):
+        self.path = Path(path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, ns: str, key: str, version: str) -> Optional[Any]:
+        """version が一致し期限内ならデコード済みの値、それ以外は None。"""
+        try:
+            row = self._conn().execute(
+                "SELECT version, value, expires FROM entries WHERE ns=? AND key=?", (ns, key)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row or row[0] != version:
+            return None
+        if row[2] is not None and row[2] < time.time():
+            return None
+        try:
+            return json.loads(row[1])
+        except ValueError:
+            return None
+
+    def put(self, ns: str, key: str, value: Any, version: str, *, expires: Optional[float] = None) -> None:
+        """書き込み失敗（ロック競合など）はキャッシュなので黙って諦める。"""
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (ns, key, version, value, expires) VALUES (?, ?, ?, ?, ?)",
+                (ns, key, version, json.dumps(value, ensure_ascii=False), expires),
+            )
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+    def purge_expired(self) -> int:
+        try:
+            cur = self._conn().execute(
+                "DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),)
+            )
+            return cur.rowcount
+        except sqlite3.Error:
+            return 0
+
+def file_version(path: Path) -> str:
+    """ファイルの版（パス・mtime・サイズ）。存在しなければ空文字。"""
+    try:
+        s = path.stat()
+    except OSError:
+        return ""
+    return f"{path}:{s.st_mtime_ns}:{s.st_size}"
+
+_cache_lock = threading.Lock()
+_cache: Optional[SharedCache] = None
+_cache_disabled = False
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """LOGIN_TEST_SHARED_CACHE が設定されていればプロセス共通のインスタンスを返す。"""
+    global _cache, _cache_disabled
+    if _cache is not None or _cache_disabled:
+        return _cache
+    with _cache_lock:
+        if _cache is None and not _cache_disabled:
+            path = os.environ.get("LOGIN_TEST_SHARED_CACHE")
+            if not path:
+                _cache_disabled = True
+                return None
+            try:
+                _cache = SharedCache(Path(path).expanduser())
+            except (OSError, sqlite3.Error):
+                _cache_disabled = True
+    return _cache
@@ -0,0 +1,399 @@
+# login_test_app/lib/sketches.py
+"""
+ストリーミング近似集計（定数メモリ・誤差上限つき）。
+
+- HyperLogLog: 月×アプリごとのユニークユーザー数（p=12 で標準誤差 約 1.6%）
+- SpaceSaving: 上位 K 件（ユーザー / ボタン）。真の件数との差は error 以下
+- MonthlySketches: 月パーティションごとに上記を保持し、JSON に保存・マージ可能
+
+クリック書き込み（append_click_event）から add() される。
+
+保存先（sketch_dir）:
+    <YYYY-MM>.<host>.<pid>.json   … 書き込みプロセスごと（そのプロセスが自シャードへ書いた分）
+    <YYYY-MM>.json                … ベース（終了済みプロセス分の統合・rebuild の結果）
+"""
+from __future__ import annotations
+import atexit
+import contextlib
+import hashlib
+import json
+import math
+import os
+import socket
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────
+# HyperLogLog
+# ─────────────────────────────────────────────────────────────
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HyperLogLog:
+    def __init__(self, p: int = 12, registers: Optional[bytearray] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str) -> None:
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        rest = (x << self.p) & ((1 << 64) - 1)
+        rank = (64 - self.p + 1) if rest == 0 else (65 - rest.bit_length())
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        est = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)        # 小さい値は linear counting
+        return int(round(est))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.p != self.p:
+            raise ValueError("HyperLogLog の精度 p が一致しません")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def to_json(self) -> dict:
+        return {"p": self.p, "registers": self.registers.hex()}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "HyperLogLog":
+        return cls(int(data["p"]), bytearray.fromhex(data["registers"]))
+
+# ─────────────────────────────────────────────────────────────
+# Space-Saving（Top-K）
+# ─────────────────────────────────────────────────────────────
+class SpaceSaving:
+    """
+    最大 capacity 個のカウンタで頻出要素を追跡する。
+    各要素の推定値は真値以上で、過大分は error 以下。
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, item: str, n: int = 1) -> None:
+        if item in self.counts:
+            self.counts[item] += n
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = n
+            self.errors[item] = 0
+            return
+        victim = min(self.counts, key=self.counts.__getitem__)
+        floor = self.counts.pop(victim)
+        self.errors.pop(victim, None)
+        self.counts[item] = floor + n
+        self.errors[item] = floor
+
+    def top(self, k: int = 10) -> List[dict]:
+        items = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+        return [{"item": it, "count": c, "error": self.errors.get(it, 0)} for it, c in items]
+
+    def _floor(self) -> int:
+        """満杯なら最小カウント（追跡していない要素の真値の上限）、空きがあれば 0。"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """
+        マージ可能な Space-Saving（Agarwal et al.）。
+        片方にしか無い要素には、無い側の最小カウントを推定値・誤差の両方に足す
+        （満杯の側で追跡されていない要素は、真値がその最小カウント以下）。
+        そのうえで大きい順に capacity 個だけ残す。残した要素の誤差はそのまま引き継ぐ。
+        """
+        floor_a, floor_b = self._floor(), other._floor()
+        counts: Dict[str, int] = {}
+        errors: Dict[str, int] = {}
+        for it in self.counts.keys() | other.counts.keys():
+            if it in self.counts:
+                ca, ea = self.counts[it], self.errors.get(it, 0)
+            else:
+                ca, ea = floor_a, floor_a
+            if it in other.counts:
+                cb, eb = other.counts[it], other.errors.get(it, 0)
+            else:
+                cb, eb = floor_b, floor_b
+            counts[it] = ca + cb
+            errors[it] = ea + eb
+        if len(counts) > self.capacity:
+            keep = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[: self.capacity]
+            counts = dict(keep)
+            errors = {it: errors[it] for it in counts}
+        self.counts, self.errors = counts, errors
+
+    def to_json(self) -> dict:
+        return {"capacity": self.capacity, "counts": self.counts, "errors": self.errors}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SpaceSaving":
+        s = cls(int(data.get("capacity", 64)))
+        s.counts = {str(k): int(v) for k, v in (data.get("counts") or {}).items()}
+        s.errors = {str(k): int(v) for k, v in (data.get("errors") or {}).items()}
+        return s
+
+# ─────────────────────────────────────────────────────────────
+# 月パーティション
+# ─────────────────────────────────────────────────────────────
+class MonthSketch:
+    def __init__(self, capacity: int = 64):
+        self.users: Dict[str, HyperLogLog] = {}     # app -> HLL
+        self.top_users = SpaceSaving(capacity)
+        self.top_buttons = SpaceSaving(capacity)
+        self.events = 0
+
+    def add(self, event: dict) -> None:
+        app = str(event.get("app") or "-")
+        user = str(event.get("user") or "unknown")
+        hll = self.users.get(app)
+        if hll is None:
+            hll = self.users[app] = HyperLogLog()
+        hll.add(user)
+        self.top_users.add(user)
+        self.top_buttons.add(str(event.get("button") or "-"))
+        self.events += 1
+
+    def merge(self, other: "MonthSketch") -> None:
+        for app, hll in other.users.items():
+            if app in self.users:
+                self.users[app].merge(hll)
+            else:
+                self.users[app] = HyperLogLog.from_json(hll.to_json())
+        self.top_users.merge(other.top_users)
+        self.top_buttons.merge(other.top_buttons)
+        self.events += other.events
+
+    def to_json(self) -> dict:
+        return {
+            "users": {app: h.to_json() for app, h in self.users.items()},
+            "top_users": self.top_users.to_json(),
+            "top_buttons": self.top_buttons.to_json(),
+            "events": self.events,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "MonthSketch":
+        s = cls()
+        s.users = {app: HyperLogLog.from_json(h) for app, h in (data.get("users") or {}).items()}
+        s.top_users = SpaceSaving.from_json(data.get("top_users") or {})
+        s.top_buttons = SpaceSaving.from_json(data.get("top_buttons") or {})
+        s.events = int(data.get("events") or 0)
+        return s
+
+# ─────────────────────────────────────────────────────────────
+# 保存先
+# ─────────────────────────────────────────────────────────────
+_HOST = socket.gethostname().split(".")[0].replace("_", "-") or "host"
+LOCK_NAME = ".sketches.lock"
+
+def _owner(path: Path) -> Optional[Tuple[str, int]]:
+    """
+    <月>.<host>.<pid>.json → (host, pid)。ベース <月>.json は None。
+    旧形式 <月>.<pid>.json はこのホストのものとして扱う。
+    """
+    parts = path.name.split(".")
+    try:
+        if len(parts) == 4:
+            return parts[1], int(parts[2])
+        if len(parts) == 3:
+            return _HOST, int(parts[1])
+    except ValueError:
+        return None
+    return None
+
+@contextlib.contextmanager
+def _dir_lock(sketch_dir: Path, *, blocking: bool) -> Iterator[bool]:
+    """ベースを書き換える処理（統合・rebuild）どうしの排他。取れなければ False。"""
+    try:
+        import fcntl
+    except ImportError:     # Windows ではベースを書き換えない
+        yield False
+        return
+    sketch_dir.mkdir(parents=True, exist_ok=True)
+    with (sketch_dir / LOCK_NAME).open("a") as lockf:
+        try:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            yield False
+            return
+        yield True
+
+class MonthlySketches:
+    """
+    月ごとのスケッチを sketch_dir/<YYYY-MM>.<host>.<pid>.json に保存する。
+    プロセスごとにファイルを分け、読み出し時にベース＋同月のファイルをマージする。
+
+    このホストの終了済みプロセスのファイルは compact() でベースへまとめて消す（再起動のたびに増えない）。
+    ベースには取り込んだファイルの名前と mtime も残し、消す前に止まっても二重には数えない。
+    生きているプロセスのファイル・他ホストのファイルには触れない（書き手が上書きし続けるため）。
+    """
+
+    def __init__(self, sketch_dir: Path, *, flush_every: int = 200):
+        self.sketch_dir = sketch_dir
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._months: Dict[str, MonthSketch] = {}
+        self._dirty: Dict[str, int] = {}
+        atexit.register(self.flush)     # 未保存分（flush_every 未満）を終了時に書き出す
+
+    def _own_file(self, month: str) -> Path:
+        return self.sketch_dir / f"{month}.{_HOST}.{os.getpid()}.json"
+
+    def _base_file(self, month: str) -> Path:
+        return self.sketch_dir / f"{month}.json"
+
+    def add(self, event: dict) -> None:
+        month = str(event.get("month") or "unknown")
+        with self._lock:
+            sk = self._months.get(month)
+            if sk is None:
+                sk = self._months[month] = self._load_own(month)
+            sk.add(event)
+            self._dirty[month] = self._dirty.get(month, 0) + 1
+            if self._dirty[month] >= self.flush_every:
+                self._flush(month)
+
+    def _load_own(self, month: str) -> MonthSketch:
+        try:
+            return MonthSketch.from_json(json.loads(self._own_file(month).read_text("utf-8")))
+        except (OSError, ValueError):
+            return MonthSketch()
+
+    def _flush(self, month: str) -> None:
+        self.sketch_dir.mkdir(parents=True, exist_ok=True)
+        path = self._own_file(month)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(json.dumps(self._months[month].to_json()), encoding="utf-8")
+        os.replace(tmp, path)
+        self._dirty[month] = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            for month, n in list(self._dirty.items()):
+                if n:
+                    self._flush(month)
+
+    def months(self) -> List[str]:
+        names = {p.name.split(".", 1)[0] for p in self.sketch_dir.glob("*.json")} if self.sketch_dir.exists() else set()
+        with self._lock:
+            names.update(self._months)
+        return sorted(names)
+
+    # ---- ベース ----
+    def _read_base(self, month: str) -> Tuple[MonthSketch, Dict[str, int]]:
+        """ベースのスケッチと、取り込み済みファイル {名前: mtime_ns}。"""
+        try:
+            data = json.loads(self._base_file(month).read_text("utf-8"))
+        except (OSError, ValueError):
+            return MonthSketch(), {}
+        return MonthSketch.from_json(data), {str(k): int(v) for k, v in (data.get("merged") or {}).items()}
+
+    def _write_base(self, month: str, sk: MonthSketch, merged: Dict[str, int]) -> None:
+        self.sketch_dir.mkdir(parents=True, exist_ok=True)
+        path = self._base_file(month)
+        data = sk.to_json()
+        # 取り込み済みの記録は、まだ残っているファイルの分だけ
+        data["merged"] = {k: v for k, v in merged.items() if (self.sketch_dir / k).exists()}
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _stale_files(self, pid_alive: Callable[[int], bool]) -> Dict[str, List[Path]]:
+        """このホストの終了済みプロセスのファイル（月ごと）。"""
+        out: Dict[str, List[Path]] = defaultdict(list)
+        if not self.sketch_dir.exists():
+            return out
+        me = os.getpid()
+        for p in self.sketch_dir.glob("*.json"):
+            owner = _owner(p)
+            if owner is None or owner[0] != _HOST or owner[1] == me or pid_alive(owner[1]):
+                continue
+            out[p.name.split(".", 1)[0]].append(p)
+        return out
+
+    def compact(self, pid_alive: Callable[[int], bool]) -> int:
+        """このホストの終了済みプロセスのファイルを月ごとのベースへまとめて消す。消したファイル数を返す。"""
+        with _dir_lock(self.sketch_dir, blocking=False) as locked:
+            if not locked:
+                return 0
+            n = 0
+            for month, files in self._stale_files(pid_alive).items():
+                base, merged = self._read_base(month)
+                for p in files:
+                    try:
+                        mtime = p.stat().st_mtime_ns
+                        if merged.get(p.name) == mtime:
+                            continue        # 取り込み済み（前回は消す前に止まった）
+                        base.merge(MonthSketch.from_json(json.loads(p.read_text("utf-8"))))
+                    except (OSError, ValueError):
+                        continue
+                    merged[p.name] = mtime
+                self._write_base(month, base, merged)
+                for p in files:
+                    p.unlink(missing_ok=True)
+                n += len(files)
+            return n
+
+    def replace_base(self, months: Dict[str, MonthSketch], pid_alive: Callable[[int], bool]) -> None:
+        """
+        ベースを months で置き換え、このホストの終了済みプロセスのファイルを消す（rebuild 用）。
+        months には終了済みプロセスの分を含めて作り直したものを渡すこと。
+        生きているプロセスのファイルはそのプロセスの分として残る。
+        """
+        with _dir_lock(self.sketch_dir, blocking=True):
+            stale = self._stale_files(pid_alive)
+            for month in set(months) | set(stale):
+                merged = {}
+                for p in stale.get(month, []):
+                    try:
+                        merged[p.name] = p.stat().st_mtime_ns
+                    except OSError:
+                        continue
+                self._write_base(month, months.get(month) or MonthSketch(), merged)
+            if self.sketch_dir.exists():
+                for p in self.sketch_dir.glob("*.json"):
+                    if _owner(p) is None and p.name.split(".", 1)[0] not in months:
+                        p.unlink(missing_ok=True)       # 作り直しで無くなった月のベース
+            for files in stale.values():
+                for p in files:
+                    p.unlink(missing_ok=True)
+
+    def merged(self, month: str) -> MonthSketch:
+        """ベース＋同月の全プロセス分（保存済み）＋自プロセスの未保存分をマージして返す。"""
+        out, done = self._read_base(month)
+        own = self._own_file(month)
+        if self.sketch_dir.exists():
+            for p in self.sketch_dir.glob(f"{month}.*.json"):
+                if p == own:
+                    continue
+                try:
+                    if done.get(p.name) == p.stat().st_mtime_ns:
+                        continue    # ベースに取り込み済み
+                    out.merge(MonthSketch.from_json(json.loads(p.read_text("utf-8"))))
+                except (OSError, ValueError):
+                    continue
+        with self._lock:
+            mine = self._months.get(month)
+            out.merge(mine if mine is not None else self._load_own(month))
+        return out
+
+    def report(self, month: str, k: int = 10) -> Dict[str, object]:
+        sk = self.merged(month)
+        return {
+            "month": month,
+            "events": sk.events,
+            "active_users": {app: h.count() for app, h in sorted(sk.users.items())},
+            "active_users_rel_error": HyperLogLog().relative_error(),
+            "top_users": sk.top_users.top(k),
+            "top_buttons": sk.top_buttons.top(k),
+        }
@@ -1,16 +1,90 @@
 # login_test_app/lib/sso.py
 from __future__ import annotations
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List, Tuple
+import datetime as dt
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
 
 import jwt
 import streamlit as st
 
+from lib.metrics import TOKEN_REFRESHES, TOKEN_VERIFICATIONS
+from lib.rate_limit import TokenBucketLimiter
+from lib.session_auth import verifier_id
+from lib.shared_cache import file_version, get_shared_cache
+
 # 🔐 ポータル側と必ず一致させること
 AUTH_SECRET = st.secrets.get("AUTH_SECRET", "CHANGE_ME")
 AUTH_ALGO   = "HS256"
 AUTH_ISS    = "prec-auth"       # ポータルの発行者(iss)
 AUTH_AUD    = "prec-internal"   # 受信者(aud)
 
+# 共有キャッシュの版：秘密鍵や iss/aud が変われば過去の検証結果は無効
+def _verify_version() -> str:
+    return hashlib.sha256(f"{AUTH_SECRET}|{AUTH_ALGO}|{AUTH_ISS}|{AUTH_AUD}".encode()).hexdigest()[:16]
+
+_VERIFY_VERSION = _verify_version()
+
+# ─────────────────────────────────────────────────────────────
+# secrets の読み直し（鍵のローテーション）
+# ─────────────────────────────────────────────────────────────
+# secrets.toml が差し替えられたら、どのレプリカも SECRETS_CHECK_SECONDS 以内に AUTH_SECRET と版を
+# 読み直す（旧い鍵で検証・共有キャッシュに書かれた結果は版が合わなくなり使われない）。
+# 版には secrets の中身に加えて secrets ファイルの版（パス・mtime・サイズ）も入れる
+# （Streamlit のファイル監視が中身を読み直す前でも、ファイルが変われば版は変わる）。
+SECRETS_CHECK_SECONDS = 2.0
+
+_secrets_lock = threading.Lock()
+_secrets_checked_at = 0.0
+_secrets_stamp = ""
+
+def _secrets_files() -> List[Path]:
+    try:
+        from streamlit import config
+        return [Path(p) for p in config.get_option("secrets.files") or ()]
+    except Exception:
+        return []
+
+def _read_secrets_stamp() -> str:
+    try:
+        secrets = json.dumps(st.secrets.to_dict(), sort_keys=True, default=str)
+    except Exception:
+        secrets = ""
+    files = "|".join(file_version(p) for p in _secrets_files())
+    return hashlib.sha256(f"{files}|{secrets}".encode("utf-8")).hexdigest()[:16]
+
+def refresh_secrets(*, force: bool = False) -> str:
+    """
+    secrets を読み直し（最大 SECRETS_CHECK_SECONDS に 1 回）、変わっていれば AUTH_SECRET と
+    _VERIFY_VERSION を更新する。secrets の版を返す。
+    """
+    global AUTH_SECRET, _VERIFY_VERSION, _secrets_checked_at, _secrets_stamp
+    now = time.monotonic()
+    if not force and _secrets_stamp and now - _secrets_checked_at < SECRETS_CHECK_SECONDS:
+        return _secrets_stamp
+    with _secrets_lock:
+        if force or not _secrets_stamp or now - _secrets_checked_at >= SECRETS_CHECK_SECONDS:
+            stamp = _read_secrets_stamp()
+            if stamp != _secrets_stamp:
+                try:
+                    AUTH_SECRET = st.secrets.get("AUTH_SECRET", "CHANGE_ME")
+                except Exception:
+                    pass        # 読めなければ直前の鍵のまま
+                _VERIFY_VERSION = _verify_version()
+                _secrets_stamp = stamp
+            _secrets_checked_at = now
+        return _secrets_stamp
+
+def _token_cache_key(token: str, check_iss: bool, check_aud: bool, leeway_seconds: int) -> str:
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    return f"{digest}:{int(check_iss)}{int(check_aud)}:{leeway_seconds}"
+
 def verify_token(
     token: Optional[str],
     *,
@@ -22,10 +96,92 @@ def verify_token(
     JWT を検証し、有効なら payload(dict) を返す。無効・期限切れは None。
     - 必須: exp, sub
     - 既定で iss/aud も照合（ポータルと値を合わせる）
+    - LOGIN_TEST_SHARED_CACHE があれば、同一ホストの他プロセスの検証結果を再利用
     """
     if not token:
+        TOKEN_VERIFICATIONS.inc("missing")
         return None
 
+    refresh_secrets()
+    cache = get_shared_cache()
+    cache_key = _token_cache_key(token, check_iss, check_aud, leeway_seconds) if cache else ""
+    if cache:
+        hit = cache.get("token", cache_key, _VERIFY_VERSION)
+        if isinstance(hit, dict):
+            TOKEN_VERIFICATIONS.inc("ok")
+            return hit
+
+    payload, outcome, _ = _decode(token, check_iss=check_iss, check_aud=check_aud, leeway_seconds=leeway_seconds)
+    TOKEN_VERIFICATIONS.inc(outcome)
+    if payload is not None and cache and isinstance(payload.get("exp"), (int, float)):
+        # 期限（leeway 込み）を過ぎたエントリは get() 側でミスになる
+        cache.put("token", cache_key, payload, _VERIFY_VERSION, expires=payload["exp"] + leeway_seconds)
+    return payload
+
+# ─────────────────────────────────────────────────────────────
+# 他の検証関数（common_lib の verify_jwt 等）の共有キャッシュ
+# ─────────────────────────────────────────────────────────────
+Verifier = Callable[[str], Optional[Dict[str, Any]]]
+
+_cached_verifiers: Dict[str, Verifier] = {}
+_cached_verifiers_lock = threading.Lock()
+
+def _verifier_version(verify: Verifier) -> str:
+    """検証関数の実装（モジュールのファイル）と secrets（中身・ファイルの版）が変われば変わる版。"""
+    module = sys.modules.get(getattr(verify, "__module__", "") or "")
+    source = getattr(module, "__file__", None)
+    raw = f"{verifier_id(verify)}|{file_version(Path(source)) if source else ''}|{refresh_secrets()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def cached_verifier(verify: Verifier) -> Verifier:
+    """
+    verify（token -> payload / None）の成功結果を共有キャッシュに載せたものを返す。
+    verify_token と同じく同一ホストの他プロセスの検証結果を再利用する（期限は payload の exp まで）。
+    版は検証関数の実装ファイルと secrets から作り、鍵や実装が変われば過去の結果は使わない
+    （版は SECRETS_CHECK_SECONDS ごとに作り直すので、他のレプリカでの差し替えもその間隔で反映される）。
+    共有キャッシュが無効なら verify をそのまま返す。
+    """
+    if get_shared_cache() is None:
+        return verify
+    vid = verifier_id(verify)
+    with _cached_verifiers_lock:
+        hit = _cached_verifiers.get(vid)
+        if hit is not None:
+            return hit
+        state = [time.monotonic(), _verifier_version(verify)]    # [作った時刻, 版]
+
+        def verify_cached(token: str) -> Optional[Dict[str, Any]]:
+            cache = get_shared_cache()
+            if not token or cache is None:
+                return verify(token)
+            if time.monotonic() - state[0] >= SECRETS_CHECK_SECONDS:
+                state[:] = [time.monotonic(), _verifier_version(verify)]
+            version = state[1]
+            key = f"{hashlib.sha256(token.encode('utf-8')).hexdigest()}:{vid}"
+            cached = cache.get("token", key, version)
+            if isinstance(cached, dict):
+                return cached
+            payload = verify(token)
+            if payload and isinstance(payload.get("exp"), (int, float)):
+                cache.put("token", key, payload, version, expires=payload["exp"])
+            return payload
+
+        verify_cached.verifier_id = vid     # type: ignore[attr-defined]  # セッションの記録は元の関数と共用
+        _cached_verifiers[vid] = verify_cached
+        return verify_cached
+
+def _decode(
+    token: str,
+    *,
+    check_iss: bool,
+    check_aud: bool,
+    leeway_seconds: int,
+    secret: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], str, str]:
+    """
+    verify_token / verify_many 共通の検証。(payload または None, outcome, 理由) を返す。
+    outcome は "ok" / "expired"（署名は正しい）/ "invalid"。理由は PyJWT の例外名。
+    """
     try:
         options = {"require": ["exp", "sub"]}
         kwargs: Dict[str, Any] = {"algorithms": [AUTH_ALGO], "options": options, "leeway": leeway_seconds}
@@ -34,16 +190,187 @@ def verify_token(
         if check_aud:
             kwargs["audience"] = AUTH_AUD
 
-        payload = jwt.decode(token, AUTH_SECRET, **kwargs)
+        payload = jwt.decode(token, AUTH_SECRET if secret is None else secret, **kwargs)
         # ここで必要なら追加チェック（例: apps が list か）
         apps = payload.get("apps", [])
         if apps is not None and not isinstance(apps, list):
             payload["apps"] = []
-        return payload
+        return payload, "ok", ""
 
-    except jwt.ExpiredSignatureError:
+    except jwt.ExpiredSignatureError as e:
         # 期限切れ
+        return None, "expired", type(e).__name__
+    except jwt.InvalidTokenError as e:
+        # 署名不一致/クレーム不正 等
+        return None, "invalid", type(e).__name__
+
+# ─────────────────────────────────────────────────────────────
+# 期限間近のトークンの再発行（スライディング更新・既定は無効）
+# ─────────────────────────────────────────────────────────────
+# 検証済みトークンの残りが REFRESH_WINDOW 秒を切ったら、同じクレーム（sub/iss/aud/apps…）で
+# iat/exp だけ新しくしたトークンを AUTH_SECRET で署名し直し、Cookie（path="/"）を上書きする。
+# ポータルへの再ログイン往復を減らすため。最初のログイン（orig_iat）から MAX_AGE を過ぎたら更新しない。
+#
+#     LOGIN_TEST_TOKEN_REFRESH_WINDOW=600       # 残り何秒で更新するか（0/未設定で無効）
+#     LOGIN_TEST_TOKEN_REFRESH_TTL=3600         # 新しいトークンの有効期間（既定: 元の exp - iat）
+#     LOGIN_TEST_TOKEN_REFRESH_MAX_AGE=604800   # 最初のログインからの上限（秒）
+#     LOGIN_TEST_TOKEN_REFRESH_INTERVAL=300     # 同じユーザーの更新の最短間隔（秒）
+DEFAULT_REFRESH_TTL = 3600
+DEFAULT_REFRESH_MAX_AGE = 7 * 24 * 3600
+DEFAULT_REFRESH_INTERVAL = 300
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name) or default))
+    except ValueError:
+        return default
+
+def refresh_window() -> int:
+    return _env_int("LOGIN_TEST_TOKEN_REFRESH_WINDOW", 0)
+
+_refresh_lock = threading.Lock()
+_refresh_limiter: Optional[TokenBucketLimiter] = None
+
+def _limiter() -> TokenBucketLimiter:
+    """ユーザーごとに INTERVAL 秒あたり 1 回（複数タブが同時に期限間近になっても 1 回）。"""
+    global _refresh_limiter
+    with _refresh_lock:
+        if _refresh_limiter is None:
+            interval = max(1, _env_int("LOGIN_TEST_TOKEN_REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL))
+            _refresh_limiter = TokenBucketLimiter(1.0 / interval, 1)
+        return _refresh_limiter
+
+def reissue_token(payload: Dict[str, Any], *, now: Optional[int] = None) -> Tuple[str, int]:
+    """payload のクレームをそのままに iat/exp を更新して署名する。(token, exp) を返す。"""
+    now = int(time.time()) if now is None else now
+    refresh_secrets()
+    iat, exp = payload.get("iat"), payload.get("exp")
+    ttl = _env_int("LOGIN_TEST_TOKEN_REFRESH_TTL", 0)
+    if not ttl:
+        ttl = int(exp - iat) if isinstance(iat, (int, float)) and isinstance(exp, (int, float)) and exp > iat \
+            else DEFAULT_REFRESH_TTL
+    claims = dict(payload)
+    claims["orig_iat"] = int(payload.get("orig_iat") or iat or now)
+    claims["iat"] = now
+    claims["exp"] = now + ttl
+    return jwt.encode(claims, AUTH_SECRET, algorithm=AUTH_ALGO), claims["exp"]
+
+def refresh_token_if_due(
+    token: Optional[str],
+    exp: int,
+    *,
+    user: str,
+    cookie_manager: Any,
+    cookie_name: str = "prec_sso",
+    leeway_seconds: int = 30,
+    now: Optional[int] = None,
+) -> Optional[Tuple[str, int]]:
+    """
+    exp（検証済みトークンの期限）が REFRESH_WINDOW 秒以内なら再発行して Cookie に書く。
+    書いたら (新しいトークン, 新しい exp)、しなければ None。
+    署名はこのモジュールの AUTH_SECRET で検証し直してから行う（検証できないトークンは更新しない）。
+    """
+    window = refresh_window()
+    now = int(time.time()) if now is None else now
+    if not window or not token or not exp or exp - now > window:
         return None
+    refresh_secrets()
+    try:
+        payload = jwt.decode(token, AUTH_SECRET, algorithms=[AUTH_ALGO], leeway=leeway_seconds,
+                             options={"require": ["exp", "sub"], "verify_aud": False})
     except jwt.InvalidTokenError:
-        # 署名不一致/クレーム不正 等
+        TOKEN_REFRESHES.inc("invalid")
+        return None
+    if payload.get("sub") != user:
+        TOKEN_REFRESHES.inc("invalid")
+        return None
+    orig_iat = payload.get("orig_iat") or payload.get("iat")
+    max_age = _env_int("LOGIN_TEST_TOKEN_REFRESH_MAX_AGE", DEFAULT_REFRESH_MAX_AGE)
+    if isinstance(orig_iat, (int, float)) and max_age and now - orig_iat >= max_age:
+        TOKEN_REFRESHES.inc("max_age")
         return None
+    # 検証を通ったトークンだけが枠を使う（不正なトークンで本人の更新枠を減らさせない）
+    if not _limiter().acquire(user)[0]:
+        TOKEN_REFRESHES.inc("rate_limited")
+        return None
+    new_token, new_exp = reissue_token(payload, now=now)
+    try:
+        cookie_manager.set(cookie_name, new_token, path="/",
+                           expires_at=dt.datetime.fromtimestamp(new_exp), key=f"{cookie_name}_refresh")
+    except Exception:
+        TOKEN_REFRESHES.inc("error")
+        return None
+    TOKEN_REFRESHES.inc("refreshed")
+    return new_token, new_exp
+
+# ─────────────────────────────────────────────────────────────
+# 一括検証（監査ログなどのオフライン用）
+# ─────────────────────────────────────────────────────────────
+# verify_token と同じ _decode（iss/aud/leeway の扱いも同じ）で、同じトークンは 1 回だけ検証する。
+# 入力は BATCH 件ずつ読み、未検証のものだけをプロセスプールに配り、結果は入力順に返す（メモリは一定）。
+# 共有キャッシュ・メトリクスには触れない。
+VERIFY_BATCH = 20_000
+VERIFY_CHUNK = 2_000            # 1 タスクあたりのトークン数
+DEDUP_MAX = 1_000_000           # 覚えておく検証結果の上限（超えたら古いものから忘れる）
+
+# (sub, exp, outcome, reason)。sub/exp は署名が正しい（ok / expired）ときだけ
+VerifyResult = Tuple[Optional[str], Optional[int], str, str]
+
+def _verify_one(token: str, check_iss: bool, check_aud: bool, leeway_seconds: int, secret: str) -> VerifyResult:
+    payload, outcome, reason = _decode(
+        token, check_iss=check_iss, check_aud=check_aud, leeway_seconds=leeway_seconds, secret=secret)
+    if payload is None and outcome == "expired":
+        # 期限切れは署名検証の後に判定されるので、クレームは信頼できる
+        payload = jwt.decode(token, options={"verify_signature": False})
+    if payload is None:
+        return None, None, outcome, reason
+    exp = payload.get("exp")
+    return (str(payload.get("sub")) if payload.get("sub") is not None else None,
+            int(exp) if isinstance(exp, (int, float)) else None, outcome, reason)
+
+def _verify_chunk(tokens: List[str], check_iss: bool, check_aud: bool, leeway_seconds: int,
+                  secret: str) -> List[VerifyResult]:
+    return [_verify_one(t, check_iss, check_aud, leeway_seconds, secret) for t in tokens]
+
+def verify_many(
+    tokens: Iterable[Optional[str]],
+    *,
+    workers: int = 1,
+    check_iss: bool = True,
+    check_aud: bool = True,
+    leeway_seconds: int = 30,
+    batch_size: int = VERIFY_BATCH,
+    chunk_size: int = VERIFY_CHUNK,
+) -> Iterator[Tuple[Optional[str], VerifyResult]]:
+    """
+    tokens を順に検証して (token, (sub, exp, outcome, reason)) を入力と同じ順で返す（ジェネレータ）。
+    空のトークンは outcome="missing"。workers > 1 ならプロセスプールで並列に検証する。
+    """
+    seen: Dict[str, VerifyResult] = {}
+    refresh_secrets()
+    args = (check_iss, check_aud, leeway_seconds, AUTH_SECRET)
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        it = iter(tokens)
+        while True:
+            batch = list(itertools.islice(it, batch_size))
+            if not batch:
+                break
+            todo = list(dict.fromkeys(t for t in batch if t and t not in seen))
+            chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+            if pool is not None and len(chunks) > 1:
+                results = pool.map(_verify_chunk, chunks, *([a] * len(chunks) for a in args))
+            else:
+                results = (_verify_chunk(c, *args) for c in chunks)
+            for chunk, res in zip(chunks, results):
+                seen.update(zip(chunk, res))
+            for t in batch:
+                yield t, (seen[t] if t else (None, None, "missing", ""))
+            while len(seen) > DEDUP_MAX:
+                del seen[next(iter(seen))]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -1,8 +1,9 @@
 # login_test_app/pages/01_保護テスト.py
 from __future__ import annotations
 from pathlib import Path
+import os
 import sys
-import json, time
+import time
 import datetime as dt
 import streamlit as st
 import extra_streamlit_components as stx
@@ -17,23 +18,34 @@ if str(PROJECTS_ROOT) not in sys.path:
 from common_lib.ui.ui_basics import thick_divider
 from common_lib.auth.jwt_utils import verify_jwt  # 有効: dict / 無効: None
 
+from lib import event_store
+from lib import export as event_export
+from lib.event_store import ROLLUPS, append_click_event, store_version, summary_snapshot
+from lib.metrics import TOKEN_VERIFICATIONS, start_exporter
+from lib import prewarm
+from lib.query_api import export_url, start_query_api
+from lib.session_auth import authenticate
+from lib.sso import cached_verifier, refresh_token_if_due
+
+start_exporter()  # 環境変数が無ければ何もしない（プロセスにつき1回）
+start_query_api()  # 同上（LOGIN_TEST_QUERY_API_PORT）
+prewarm.start()    # 秘密鍵・イベントログの索引/ロールアップをバックグラウンドで（プロセスにつき1回）
+
 # ===== 設定 =====
 LOGIN_URL = "/auth_portal"        # ポータル
 APP_BASE  = "/login_test"         # このアプリの公開パス
 APP_NAME_FOR_ACL = (APP_BASE.strip("/").split("/")[-1] or "login_test")
 REQUIRE_ACL = False               # ← 必要なら True（JWT payload['apps'] に APP_NAME_FOR_ACL が必要）
+# 簡易集計の定期再確認（秒）。既定は無効（自分の押下で更新する）。他のユーザー・プロセスの記録も
+# 出したいときだけ長めの間隔で有効にする（LOGIN_TEST_AGG_REFRESH_SECONDS=60 など）
+try:
+    AGG_REFRESH_SECONDS = max(0, int(os.environ.get("LOGIN_TEST_AGG_REFRESH_SECONDS") or 0))
+except ValueError:
+    AGG_REFRESH_SECONDS = 0
 
 st.set_page_config(page_title="保護テスト", page_icon="🔒")
 st.title("🔒 保護テスト（JWT Cookie 方式｜その場で診断・非リダイレクト）")
 
-# ===== 共有データ保存先（相対で安定）=====
-HERE = Path(__file__).resolve()
-app_dir = HERE.parent if HERE.parent.name != "pages" else HERE.parent.parent   # .../login_test_app
-project_dir = app_dir.parent                                                    # .../login_test_project
-DATA_DIR = project_dir / "data"                                                # プロジェクト直下 data/
-LOG_DIR  = DATA_DIR / "events"
-LOG_FILE = LOG_DIR / "button_clicks.jsonl"     # 1行1イベント(JSON)
-
 # ===== ユーティリティ =====
 def portal_button(label: str = "🔐 ポータルを開く"):
     next_url = APP_BASE.rstrip("/") + "/"  # /login_test/
@@ -60,57 +72,13 @@ def human_time(epoch: int | float | None) -> str:
     except Exception:
         return str(epoch)
 
-# ---- クリック記録ヘルパ
-def append_click_event(user: str, button_id: str, meta: dict | None = None) -> None:
-    """
-    JSONL に追記: 1行 = 1イベント
-    {ts, iso, month, app, page, user, button, meta}
-    """
-    LOG_DIR.mkdir(parents=True, exist_ok=True)
-    now = int(time.time())
-    d = dt.datetime.fromtimestamp(now)
-    event = {
-        "ts": now,
-        "iso": d.isoformat(timespec="seconds"),
-        "month": d.strftime("%Y-%m"),
-        "app": APP_NAME_FOR_ACL,
-        "page": "01_保護テスト",
-        "user": user,
-        "button": button_id,
-        "meta": meta or {},
-    }
-    with LOG_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(event, ensure_ascii=False) + "\n")
-
-def load_events(max_lines: int | None = None) -> list[dict]:
-    if not LOG_FILE.exists():
-        return []
-    with LOG_FILE.open("r", encoding="utf-8") as f:
-        rows = [json.loads(line) for line in f if line.strip()]
-    if max_lines and max_lines > 0:
-        rows = rows[-max_lines:]
-    return rows
-
-def aggregate_by_user_month(rows: list[dict]) -> list[dict]:
-    """ユーザー×月×ボタンの件数を集計"""
-    from collections import defaultdict
-    agg = defaultdict(int)
-    for r in rows:
-        user = r.get("user") or "unknown"
-        month = r.get("month") or "unknown"
-        btn = r.get("button") or "-"
-        agg[(user, month, btn)] += 1
-    out = []
-    for (user, month, btn), cnt in sorted(agg.items(), key=lambda x: (x[0][1], x[0][0], x[0][2])):
-        out.append({"user": user, "month": month, "button": btn, "count": cnt})
-    return out
-
 # ===== 認証（CookieのJWTのみ使用）=====
 cm = stx.CookieManager()
 raw_token = cm.get("prec_sso")
-payload   = verify_jwt(raw_token) if raw_token else None
+auth      = authenticate(raw_token, cached_verifier(verify_jwt))   # セッションには SessionAuth だけを置く
 
 if not raw_token:
+    TOKEN_VERIFICATIONS.inc("missing")
     st.warning("Cookie（prec_sso）がありません。未ログインの可能性があります。")
     with st.expander("🔎 デバッグ：Cookie状態", expanded=True):
         st.write({"cookie_present": False})
@@ -118,13 +86,16 @@ if not raw_token:
     portal_button()
     st.stop()
 
-if not payload:
+if auth is None:
     weak = decode_without_verify(raw_token)
     now  = int(time.time())
     exp  = weak.get("exp")
     reason = "トークンが無効です（署名不一致、壊れている、または発行者/受信者の不一致）。"
+    outcome = "invalid"
     if isinstance(exp, int) and exp < now:
         reason = "トークンの有効期限が切れています。"
+        outcome = "expired"
+    TOKEN_VERIFICATIONS.inc(outcome)
     st.error(f"{reason}（自動遷移しません）")
     with st.expander("🔎 デバッグ：JWT推定内容（署名未検証）", expanded=True):
         st.write({
@@ -137,8 +108,9 @@ if not payload:
     st.stop()
 
 # ここまで来れば有効なJWT
-current_user = payload.get("sub", "") or "unknown"
-apps = payload.get("apps", []) or []
+TOKEN_VERIFICATIONS.inc("ok")
+current_user = auth.user
+apps = auth.apps
 
 st.success(f"✅ ログインOK: **{current_user}**")
 st.caption(f"権限（apps）: {sorted(apps)}")
@@ -148,35 +120,104 @@ if REQUIRE_ACL:
     if APP_NAME_FOR_ACL not in apps:
         st.error(f"このアプリ **{APP_NAME_FOR_ACL}** を利用する権限がありません。")
         with st.expander("🔎 デバッグ：ACL", expanded=True):
-            st.write({"APP_NAME_FOR_ACL": APP_NAME_FOR_ACL, "jwt.apps": apps})
+            st.write({"APP_NAME_FOR_ACL": APP_NAME_FOR_ACL, "jwt.apps": list(apps)})
         portal_button("🔐 ポータル（管理者に権限付与を依頼）")
         st.stop()
 
+# 期限間近なら同じクレームで再発行して Cookie を差し替える（LOGIN_TEST_TOKEN_REFRESH_WINDOW 有効時）。
+# ACL で止まるユーザーの Cookie（path="/"）は延ばさない
+refreshed = refresh_token_if_due(raw_token, auth.exp, user=auth.user, cookie_manager=cm, cookie_name="prec_sso")
+if refreshed:
+    auth.rebind(*refreshed)
+
 # ===== 本文 =====
 st.info("ここは『ログイン必須』ページです。JWT Cookie（prec_sso）で認証しています。")
 
-with st.expander("🔎 JWT payload（検証済み）", expanded=False):
-    st.write(payload)
+with st.expander("🔎 認証情報（検証済み JWT から必要な項目のみ）", expanded=False):
+    st.write(auth.as_dict())
 
 thick_divider()
 st.subheader("操作（押下記録つき）")
 
+# ===== 簡易集計ビュー（押下ボタンの fragment の中で描く）=====
+@st.cache_data(max_entries=4, show_spinner=False)
+def _summary_for_version(version: tuple) -> dict:
+    # イベントストアの版が同じ間は全セッションでこの結果を共有
+    return summary_snapshot(version)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _series_for_version(version: tuple, granularity: str) -> list[dict]:
+    # ロールアップから読むだけなのでイベント量に依存しない
+    return ROLLUPS.by_bucket(granularity, by="button")
+
+# 押下（外側の fragment の再実行）のたびに版（シャードの stat）を見て、変わったときだけ読み直す。
+# 定期の再実行は AGG_REFRESH_SECONDS を設定したときだけ（放置中のセッションが stat し続けないように）
+@st.fragment(run_every=AGG_REFRESH_SECONDS or None)
+def aggregation_panel() -> None:
+    snap = _summary_for_version(store_version())
+    if not snap["count"]:
+        st.caption("まだ記録がありません。上のボタンを押してみてください。")
+        return
+    with st.expander("🧾 直近の記録（末尾20件）", expanded=False):
+        st.json(snap["tail"])
+    st.table(snap["agg"])
+    sh = snap["shards"]
+    st.caption(f"ログ: {sh['shards']} シャード / {sh['bytes']:,} bytes（書き込み中: {sh['own_shard']}）")
+
+    with st.expander("⏱ 時系列（ボタン別件数）", expanded=False):
+        gran = st.radio("粒度", ["day", "hour", "month"], horizontal=True, key="agg_granularity",
+                        format_func={"hour": "時間", "day": "日", "month": "月"}.get)
+        series = _series_for_version(snap["version"], gran)
+        st.bar_chart(series, x="bucket", y="count", color="button")
+
+    with st.expander("👥 月間アクティブユーザー / 上位ボタン（近似・定数メモリ）", expanded=False):
+        months = event_store.SKETCHES.months()
+        if not months:
+            st.caption("スケッチはまだありません。")
+            return
+        month = st.selectbox("月", months[::-1], key="sketch_month")
+        rep = event_store.SKETCHES.report(month, k=10)
+        st.write({
+            "month": rep["month"],
+            "events": rep["events"],
+            "active_users（HyperLogLog）": rep["active_users"],
+            "相対誤差（標準）": f"±{rep['active_users_rel_error']:.1%}",
+        })
+        c1, c2 = st.columns(2)
+        with c1:
+            st.caption("上位ユーザー（count は真値以上、差は error 以下）")
+            st.table(rep["top_users"])
+        with c2:
+            st.caption("上位ボタン")
+            st.table(rep["top_buttons"])
+
 # --- 記録対象ボタン（例として3種類）
-bcols = st.columns(3)
-with bcols[0]:
-    if st.button("👍 いいね", key="btn_like", use_container_width=True):
-        append_click_event(current_user, "like")
-        st.success("記録しました（いいね）")
-with bcols[1]:
-    if st.button("✅ 完了", key="btn_done", use_container_width=True):
-        append_click_event(current_user, "done")
-        st.success("記録しました（完了）")
-with bcols[2]:
-    if st.button("⭐ ブックマーク", key="btn_star", use_container_width=True):
-        append_click_event(current_user, "star")
-        st.success("記録しました（ブックマーク）")
-
-st.caption("※ クリックは data/events/button_clicks.jsonl に追記されます。")
+#     fragment 内なので押下時はこのブロックと簡易集計だけ再実行（Cookie/JWT はやり直さない）
+def _report(event: dict | None, label: str) -> None:
+    if event is None:
+        st.warning(f"押下が多すぎるため記録しませんでした（{label}）。少し待ってから押してください。")
+    else:
+        st.success(f"記録しました（{label}）")
+
+@st.fragment
+def click_buttons(user: str) -> None:
+    bcols = st.columns(3)
+    with bcols[0]:
+        if st.button("👍 いいね", key="btn_like", use_container_width=True):
+            _report(append_click_event(user, "like", app=APP_NAME_FOR_ACL), "いいね")
+    with bcols[1]:
+        if st.button("✅ 完了", key="btn_done", use_container_width=True):
+            _report(append_click_event(user, "done", app=APP_NAME_FOR_ACL), "完了")
+    with bcols[2]:
+        if st.button("⭐ ブックマーク", key="btn_star", use_container_width=True):
+            _report(append_click_event(user, "star", app=APP_NAME_FOR_ACL), "ブックマーク")
+    st.caption("※ クリックは data/events/button_clicks.<host>.<pid>.jsonl（プロセスごと）に追記されます。")
+
+    thick_divider()
+    st.subheader("📈 簡易集計（ユーザー×月×ボタン）")
+    aggregation_panel()     # 押した直後の記録まで出る
+
+click_buttons(current_user)
 
 thick_divider()
 st.subheader("ユースケース別操作")
@@ -197,16 +238,67 @@ with col2:
         st.info("必要なら下のボタンからポータルへ。")
         portal_button("🔐 ポータルへ")
 
-# ===== 簡易集計ビュー =====
+# ===== ダウンロード（CSV / Parquet）=====
 thick_divider()
-st.subheader("📈 簡易集計（ユーザー×月×ボタン）")
-rows = load_events()
-if not rows:
-    st.caption("まだ記録がありません。上のボタンを押してみてください。")
-else:
-    with st.expander("🧾 直近の記録（末尾20件）", expanded=False):
-        tail = rows[-20:] if len(rows) > 20 else rows
-        st.json(tail)
+st.subheader("⬇️ ダウンロード（自分のクリック履歴）")
+
+def _ensure_export(ready: dict) -> Path:
+    """作成したファイルのパス。期限切れで消えていれば同じ条件で作り直し、記録も付け替える。"""
+    path = event_export.ensure_export(Path(ready["path"]), ready["kind"], ready["fmt"],
+                                      user=ready["user"], month=ready["month"])
+    ready["path"] = str(path)
+    return path
+
+def _read_export(ready: dict) -> bytes:
+    # ボタンの遅延読み込み用（inline_max_bytes() 以下のファイルだけ。Streamlit が丸ごと保持する）
+    return _ensure_export(ready).read_bytes()
+
+@st.fragment
+def export_panel(user: str) -> None:
+    # 書き出しはイベントストアを逐次読みしてファイルへ（メモリ一定）。このブロックだけ再実行
+    months = sorted({r["bucket"] for r in ROLLUPS.by_bucket("month", by="user", user=user)}, reverse=True)
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        kind = st.selectbox("内容", event_export.KINDS, key="export_kind",
+                            format_func={"events": "クリック履歴", "aggregate": "月×ボタン集計"}.get)
+    with c2:
+        month = st.selectbox("月", ["（全期間）"] + months, key="export_month")
+    with c3:
+        fmt = st.selectbox("形式", event_export.available_formats(), key="export_format")
+    month_arg = None if month == "（全期間）" else month
+
+    if st.button("📦 ファイルを作成", key="export_build"):
+        with st.spinner("書き出し中..."):
+            path, n = event_export.export_file(kind, fmt, user=user, month=month_arg)
+        st.session_state["export_ready"] = {
+            "path": str(path), "rows": n, "bytes": path.stat().st_size,
+            "kind": kind, "fmt": fmt, "user": user, "month": month_arg,
+            "name": event_export.export_filename(kind, fmt, user, month_arg),
+        }
+    ready = st.session_state.get("export_ready")
+    if not ready:
+        return
+    event_export.keep_export(Path(ready["path"]))     # 表示中は期限切れで消さない（消えていても押されたときに作り直す）
+    label = f"💾 {ready['name']}（{ready['rows']:,} 行）"
+    mime = "text/csv" if ready["name"].endswith(".csv") else "application/octet-stream"
+    if ready["bytes"] > event_export.inline_max_bytes():
+        # ボタンは押された時点でファイル全体をメモリに載せるので、大きいものはクエリ API から逐次送る
+        url = export_url(Path(ready["path"]).name)
+        if url:
+            st.info(f"{ready['name']} は {ready['bytes'] / (1 << 20):,.0f} MB あるため、サーバー上で次のように取得してください。")
+            st.code(f"curl -H 'Authorization: Bearer <JWT>' -o '{ready['name']}' '{url}'", language="bash")
+        else:
+            st.warning(f"{ready['name']} は {ready['bytes'] / (1 << 20):,.0f} MB あるためボタンでは渡せません。"
+                       "月で絞るか、LOGIN_TEST_QUERY_API_PORT を設定してください。")
+        return
+    if event_export.deferred_download_supported():
+        # 押されたときにだけ読む（再実行のたびにファイル全体をメモリへ載せない）
+        st.download_button(label, lambda: _read_export(ready), file_name=ready["name"],
+                           mime=mime, key="export_download")
+    else:
+        # 古い Streamlit は描画のたびに中身を送るので、作成した実行でだけ出す
+        st.session_state.pop("export_ready", None)
+        with open(_ensure_export(ready), "rb") as f:
+            st.download_button(label, f, file_name=ready["name"], mime=mime, key="export_download")
 
-    agg = aggregate_by_user_month(rows)
-    st.table(agg)
+export_panel(current_user)
@@ -2,6 +2,7 @@
 from __future__ import annotations
 import streamlit as st
 import extra_streamlit_components as stx
+from lib.session_auth import authenticate
 from lib.sso import verify_token  # 有効なら dict、無効/期限切れは None
 
 st.set_page_config(page_title="公開ページ", page_icon="🌐")
@@ -9,13 +10,12 @@ st.title("🌐 公開（ログイン不要）")
 
 cm = stx.CookieManager()
 token = cm.get("prec_sso")
-payload = verify_token(token) if token else None
+auth = authenticate(token, verify_token)   # SessionAuth / None
 
-if payload:
-    user = payload.get("sub", "unknown")
-    st.success(f"（任意）ログイン中のユーザー: **{user}**")
-    with st.expander("🔎 JWT payload（検証済み）", expanded=False):
-        st.write(payload)
+if auth is not None:
+    st.success(f"（任意）ログイン中のユーザー: **{auth.user}**")
+    with st.expander("🔎 認証情報（検証済み JWT から必要な項目のみ）", expanded=False):
+        st.write(auth.as_dict())
 else:
     st.info("未ログインでも閲覧できます。ログインしていればユーザー名を表示します。")
 
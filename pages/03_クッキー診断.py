@@ -3,12 +3,14 @@ from __future__ import annotations
 import time
 import json
 import streamlit as st
-import extra_streamlit_components as stx
+
+from lib.cookies import cookie_jar
 
 st.set_page_config(page_title="Cookie 診断", page_icon="🍪", layout="centered")
 st.title("🍪 Cookie 診断ページ（extra-streamlit-components）")
 
-cm = stx.CookieManager()
+# 全 Cookie はここで 1 回だけ読む（以後の get はスナップショットから）。set/delete は最後にまとめて反映
+jar = cookie_jar("init")
 
 # --- 初回ウォームアップ（CookieManagerは初回レンダで空になることがある） ---
 if "cookie_warmup_done" not in st.session_state:
@@ -27,16 +29,7 @@ st.divider()
 
 # === 現在のCookie一覧 ===
 st.subheader("現在のCookie一覧")
-cookies_dict = {}
-try:
-    # 0.1.8x 系には get_all() がある想定。無い場合は既知キーだけ拾う（下の except）
-    cookies_dict = cm.get_all()  # type: ignore
-except Exception:
-    # フォールバック：代表的なキーだけ確認
-    for k in ["prec_sso", "pw_input", "user_input", "do_login", "flash_login_ok", "test_cookie"]:
-        v = cm.get(k)
-        if v is not None:
-            cookies_dict[k] = v
+cookies_dict = jar.get_all()
 
 if cookies_dict:
     st.json(cookies_dict)
@@ -56,33 +49,20 @@ c_path = st.text_input("Path（空なら未指定）", value="/", help='通常
 col1, col2, col3 = st.columns(3)
 with col1:
     if st.button("Set（発行）", key="btn_set_cookie"):
-        kwargs = {}
-        if c_path.strip():
-            kwargs["path"] = c_path.strip()
-        # key は重複禁止：都度ユニーク
-        cm.set(c_name, c_val, max_age=int(c_max), same_site="Lax", key=f"set_{c_name}_{time.time()}", **kwargs)
-        st.success(f"Set OK: {c_name}={c_val}（path={kwargs.get('path','<未指定>')}）")
-        st.info("※ 直後は一覧に反映されないことがあります。もう一度実行/リロードしてください。")
+        path = c_path.strip() or None
+        jar.set(c_name, c_val, max_age=int(c_max), same_site="Lax", path=path)
+        st.success(f"Set OK: {c_name}={c_val}（path={path or '<未指定>'}）")
+        st.info("※ ページの最後でまとめて反映します。一覧には次の実行から出ます。")
 
 with col2:
     if st.button("Get（取得）", key="btn_get_cookie"):
-        v = cm.get(c_name)
+        v = jar.get(c_name)
         st.write(f"Get: {c_name} -> {repr(v)}")
 
 with col3:
     if st.button("Delete（削除）", key="btn_del_cookie"):
-        # バージョン差異対策：delete(path=) が無い版もあるので try/except
-        try:
-            if c_path.strip():
-                cm.delete(c_name, path=c_path.strip())
-            else:
-                cm.delete(c_name)
-        except TypeError:
-            # 失効で上書き（確実）
-            if c_path.strip():
-                cm.set(c_name, "", max_age=0, path=c_path.strip(), key=f"expire_{c_name}_{time.time()}")
-            else:
-                cm.set(c_name, "", max_age=0, key=f"expire_{c_name}_{time.time()}")
+        # 失効（max-age=0）で上書き。path 未指定は現在パス
+        jar.delete(c_name, path=c_path.strip() or None)
         st.success(f"Delete（失効）OK: {c_name}")
 
 st.divider()
@@ -93,19 +73,18 @@ st.subheader("代表ケースのショートカット")
 cc1, cc2, cc3 = st.columns(3)
 with cc1:
     if st.button("prec_sso を / で発行（8h）", key="sso_issue"):
-        cm.set("prec_sso", f"dummy_{int(time.time())}", max_age=8*3600, path="/", same_site="Lax",
-               key=f"set_prec_sso_{time.time()}")
+        jar.set("prec_sso", f"dummy_{int(time.time())}", max_age=8*3600, path="/", same_site="Lax")
         st.success("発行しました（path=/, 8時間）")
 
 with cc2:
     if st.button("prec_sso を / で削除", key="sso_del_root"):
         # 失効で確実に削除
-        cm.set("prec_sso", "", max_age=0, path="/", key=f"expire_prec_sso_root_{time.time()}")
+        jar.delete("prec_sso", path="/")
         st.success("削除しました（path=/）")
 
 with cc3:
     if st.button("prec_sso を 現在パス で削除", key="sso_del_default"):
-        cm.set("prec_sso", "", max_age=0, key=f"expire_prec_sso_default_{time.time()}")
+        jar.delete("prec_sso", path=None)
         st.success("削除しました（path=未指定=現在パス）")
 
 st.divider()
@@ -125,10 +104,10 @@ st.divider()
 # === デバッグパネル ===
 with st.expander("デバッグ（内部状態）"):
     st.write("cookie_warmup_done:", st.session_state.get("cookie_warmup_done"))
-    try:
-        st.write("cm.get_all():", cm.get_all())
-    except Exception as e:
-        st.write("get_all() 例外:", e)
-    st.write("個別 get 調査:", {k: cm.get(k) for k in ["prec_sso", "test_cookie", "pw_input", "user_input", "do_login", "flash_login_ok"]})
+    st.write("スナップショット:", jar.get_all())
+    st.write("個別 get 調査:", {k: jar.get(k) for k in ["prec_sso", "test_cookie", "pw_input", "user_input", "do_login", "flash_login_ok"]})
+    st.write("この実行で反映する操作:", jar.pending())
 
-st.caption("Tip: 発行直後は CookieManager が値を返すまで 1 リレンダー必要なことがあります。上のボタンを再度押すか、ページを更新してください。")
+jar.flush()  # set/delete をここで 1 回にまとめて反映
+st.caption(f"この実行の Cookie コンポーネント呼び出し: {jar.round_trips} 回")
+st.caption("Tip: 発行・削除は次の実行で一覧に反映されます。反映されないときはページを更新してください。")
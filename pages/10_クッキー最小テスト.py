@@ -2,7 +2,8 @@
 from __future__ import annotations
 import time
 import streamlit as st
-import extra_streamlit_components as stx
+
+from lib.cookies import cookie_jar
 
 st.set_page_config(page_title="Cookie 最小テスト（安定版）", page_icon="🍪", layout="centered")
 st.title("🍪 Cookie 最小テスト（rerun安定版）")
@@ -11,16 +12,12 @@ st.title("🍪 Cookie 最小テスト（rerun安定版）")
 st.session_state["run_count"] = st.session_state.get("run_count", 0) + 1
 st.caption(f"run #{st.session_state['run_count']} at {time.strftime('%H:%M:%S')}")
 
-# CookieManager は key を固定して重複エラーを防止
-cm = stx.CookieManager(key="cm_minimal")
+# CookieManager は key を固定して重複エラーを防止。全 Cookie はここで 1 回だけ読む
+jar = cookie_jar("cm_minimal")
 
 # ===== 現在の Cookie 一覧 =====
 st.subheader("現在の Cookie 一覧")
-cookies = {}
-try:
-    cookies = cm.get_all()  # 対応バージョンなら全取得
-except Exception:
-    pass
+cookies = jar.get_all()
 if cookies:
     st.json(cookies)
 else:
@@ -50,29 +47,21 @@ err = ""
 
 try:
     if do_set:
-        # key は毎回ユニークにしないと Duplicate エラーになる
-        kwargs = {}
-        if c_path.strip():
-            kwargs["path"] = c_path.strip()
-        cm.set(
-            c_name, c_val,
-            max_age=int(c_max),
-            same_site="Lax",
-            key=f"min_set_{time.time()}",
-            **kwargs
-        )
-        msg = f"✅ Set OK: {c_name}={c_val}（path={kwargs.get('path','<未指定>')}）"
+        # 実行の最後（jar.flush()）でまとめて反映する
+        path = c_path.strip() or None
+        jar.set(c_name, c_val, max_age=int(c_max), same_site="Lax", path=path)
+        msg = f"✅ Set OK: {c_name}={c_val}（path={path or '<未指定>'}）"
         st.session_state["last_action"] = ("set", msg)
 
     elif do_get:
-        v = cm.get(c_name)
+        v = jar.get(c_name)
         msg = f"ℹ️ Get: {c_name} -> {repr(v)}"
         st.session_state["last_action"] = ("get", msg)
 
     elif do_del:
         # 失効で確実に削除（path 指定を維持）
         path_for_del = c_path.strip() or "/"
-        cm.set(c_name, "", max_age=0, path=path_for_del, key=f"min_expire_{time.time()}")
+        jar.delete(c_name, path=path_for_del)
         msg = f"🗑️ Delete（失効）OK: {c_name}（path={path_for_del}）"
         st.session_state["last_action"] = ("del", msg)
 
@@ -92,11 +81,14 @@ if "last_action" in st.session_state:
     elif kind == "del":
         st.success(text)
 
+jar.flush()  # set/delete をここで 1 回にまとめて反映
+st.caption(f"この実行の Cookie コンポーネント呼び出し: {jar.round_trips} 回")
+
 st.divider()
 st.markdown("""
 ### メモ
 - **フォーム送信**にしたことで、入力中のたびに rerun されるのを防ぎ、結果が確実に残るようにしています。  
-- `cm.set(..., key="min_set_タイムスタンプ")` のように **毎回ユニーク key** を付けて重複エラーを回避しています。  
+- Cookie は実行の先頭で 1 回だけ読み、set / delete は最後に 1 回のコンポーネント描画でまとめて反映します（`lib/cookies.py`）。  
 - 反映が1リレンダー遅れる場合があります。上の「現在の Cookie 一覧」が更新されないときは、上部の🔁で再実行してください。  
 - 必ず **Nginx 経由の URL（例: http://<ホスト>/login_test/）** で開いてください。直ポートアクセスは別サイト扱いになり、SSO検証の動きがズレます。
 """)
@@ -5,6 +5,10 @@ from pathlib import Path
 import datetime as dt
 import streamlit as st
 
+from lib import auth_audit, file_watch, login_sweeper
+from lib.json_lookup import UserIndex, lookup_member
+from lib.session_auth import current_session_auth
+
 # ========= パス解決（pages配下から実行しても壊れない相対解決）=========
 HERE = Path(__file__).resolve()
 app_dir = HERE.parent if HERE.parent.name != "pages" else HERE.parent.parent      # .../login_test_app
@@ -14,6 +18,7 @@ projects_dir = project_dir.parent
 DATA_DIR = projects_dir / "auth_portal_project" / "auth_portal_app" / "data"
 USERS_FILE = DATA_DIR / "users.json"
 LOGIN_USERS_FILE = DATA_DIR / "login_users.json"
+LARGE_JSON_BYTES = 2 * 1024 * 1024      # これ以上の users.json は全体を表示・パースしない
 
 st.set_page_config(page_title="デバッグビュー", page_icon="🔎", layout="wide")
 st.title("🔎 デバッグビュー（login_users.json / users.json / URLクエリ）")
@@ -25,6 +30,13 @@ def load_json(p: Path, default):
     except Exception:
         return default
 
+def load_json_watched(p: Path, default):
+    """LOGIN_TEST_FILE_WATCH 有効時は、ファイルが変わるまで前回の内容を再利用する。"""
+    def _load():
+        file_watch.watch(p)
+        return load_json(p, default)
+    return file_watch.memoized(f"json:{p}", _load)
+
 def stat_info(p: Path):
     if not p.exists():
         return {"exists": False}
@@ -63,6 +75,7 @@ with st.expander("🧭 URLクエリ", expanded=True):
 with st.expander("🧠 Session State", expanded=True):
     st.write({
         "session_current_user": st.session_state.get("current_user"),
+        "session_auth": (current_session_auth().as_dict() if current_session_auth() else None),
         "all_session_keys": list(st.session_state.keys()),
     })
 
@@ -75,20 +88,39 @@ with cols[0]:
 with cols[1]:
     st.caption("login_users.json（現在ログイン中ユーザー）")
     st.json(stat_info(LOGIN_USERS_FILE))
+    _sweeper = login_sweeper.sweeper_for(LOGIN_USERS_FILE)
+    if _sweeper is not None:
+        st.caption("期限切れの掃除")
+        st.json(_sweeper.status())
 
 # ========= 中身を表示 =========
 st.subheader("📘 users.json の中身")
-users_root = load_json(USERS_FILE, {"users": {}})
-st.json(users_root)
+try:
+    users_large = USERS_FILE.stat().st_size >= LARGE_JSON_BYTES
+except OSError:
+    users_large = False
+if users_large:
+    # 巨大ファイルは全体を読まない（ユーザー名は索引から、権限はフォーカスユーザー分だけ読む）
+    st.info(f"users.json が大きいため全体の表示を省略しています（{LARGE_JSON_BYTES // (1024 * 1024)} MB 以上）。")
+    users_root = None
+else:
+    users_root = load_json_watched(USERS_FILE, {"users": {}})
+    st.json(users_root)
 
 st.subheader("👥 login_users.json の中身")
-login_users = load_json(LOGIN_USERS_FILE, {})
+login_users = load_json_watched(LOGIN_USERS_FILE, {})
 st.json(login_users)
 
 # ========= 派生ビュー（見やすさ用）=========
 st.subheader("🧩 まとめビュー")
-users_db = users_root.get("users", {}) if isinstance(users_root, dict) else {}
-usernames_users_json = sorted(list(users_db.keys()))
+if users_large:
+    try:
+        usernames_users_json = sorted(UserIndex.for_file(USERS_FILE, ("users",)).keys())
+    except Exception:
+        usernames_users_json = []
+else:
+    users_db = users_root.get("users", {}) if isinstance(users_root, dict) else {}
+    usernames_users_json = sorted(list(users_db.keys()))
 usernames_login_users = sorted(list(login_users.keys()))
 
 st.write({
@@ -97,17 +129,31 @@ st.write({
 })
 
 # 指定ユーザーの権限などを軽く確認（q_user または session の current_user）
-focus_user = q_user or st.session_state.get("current_user")
-st.caption("フォーカスするユーザー（q_user → session の順で採用）")
+_auth = current_session_auth()
+focus_user = q_user or st.session_state.get("current_user") or (_auth.user if _auth else None)
+st.caption("フォーカスするユーザー（q_user → session → 認証情報 の順で採用）")
 st.code(focus_user or "(なし)")
 
 if focus_user:
-    u_apps = (users_db.get(focus_user, {}) or {}).get("apps", [])
+    u_apps = lookup_member(USERS_FILE, ("users", focus_user, "apps"), [])
     l_apps = (login_users.get(focus_user, {}) or {}).get("apps", [])
     st.write({
         "users.json 側 apps": u_apps,
         "login_users.json 側 apps": l_apps,
     })
 
+# ========= 認証判定の履歴（lib/auth_audit.py）=========
+st.subheader("🧾 認証・権限判定の履歴")
+audit_user = st.text_input("ユーザー（空欄で全員）", value=focus_user or "", key="audit_user")
+audit_rows = auth_audit.recent(audit_user.strip() or None, limit=100)
+for row in audit_rows:
+    row["ts"] = dt.datetime.fromtimestamp(row["ts"]).isoformat(timespec="milliseconds")
+    row["exp"] = dt.datetime.fromtimestamp(row["exp"]).isoformat(timespec="seconds") if row["exp"] else None
+if audit_rows:
+    st.dataframe(audit_rows, use_container_width=True, hide_index=True)
+else:
+    st.caption("該当する判定はありません。")
+st.caption(f"新しい順に最大 100 件（このプロセスのリングと全プロセスの {auth_audit.AUDIT_DIR} のログ）")
+
 st.divider()
 st.caption(f"DATA_DIR: {DATA_DIR}")
@@ -0,0 +1,81 @@
+# login_test_app/pages/91_セッションメモリ.py
+from __future__ import annotations
+from pathlib import Path
+import sys
+import streamlit as st
+
+# ========= projects/ を import ルートに追加（pages配下なので parents[3]）=========
+PROJECTS_ROOT = Path(__file__).resolve().parents[3]
+if str(PROJECTS_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECTS_ROOT))
+
+from common_lib.auth.config import COOKIE_NAME
+from common_lib.auth.jwt_utils import verify_jwt
+
+from lib import file_watch, login_sweeper, prewarm
+from lib.cookies import cookie_jar
+from lib.session_auth import authenticate, memory_report, session_state_sizes
+from lib.sso import cached_verifier
+
+st.set_page_config(page_title="セッションメモリ", page_icon="🧮", layout="wide")
+st.title("🧮 セッションメモリ（管理者向け・容量見積もり用）")
+
+# ========= 管理者のみ =========
+# セッションの記録だけを信じない: 今の Cookie で認証し直し（トップページと同じ検証関数なので同じ Cookie なら再利用）、
+# 期限内で、トップページの ACL 判定で管理者とされ、今の settings.toml の admin_users にもいること
+def _current_admins() -> frozenset:
+    try:
+        policy = file_watch.memoized(
+            "access_settings", lambda: prewarm.once("access_policy"), cache_if=lambda r: bool(r[1])
+        )[2]
+    except KeyError:
+        return frozenset()      # このプロセスでまだトップページが読まれていない（判定もされていない）
+    return policy.get("admin_users", frozenset())
+
+jar = cookie_jar("cm_session_memory")
+auth = authenticate(jar.get(COOKIE_NAME), cached_verifier(verify_jwt))
+jar.flush()
+if auth is None or auth.expired() or not auth.is_admin or auth.user not in _current_admins():
+    st.error("このページは管理者のみ閲覧できます。トップページでログイン・権限判定を済ませてから開いてください。")
+    st.stop()
+
+# ========= プロセス全体 =========
+report = memory_report()
+cols = st.columns(4)
+cols[0].metric("認証記録のあるセッション", report["auth_records"])
+cols[1].metric("Streamlit セッション（接続中）",
+               report["streamlit_sessions"] if report["streamlit_sessions"] is not None else "-")
+cols[2].metric("1 セッションあたり（平均）", f'{report["per_session_bytes_avg"]:,} B')
+cols[3].metric("認証記録の合計", f'{report["auth_records_bytes_total"]:,} B')
+
+st.caption(
+    f'apps の共有タプル: {report["apps_tuples_interned"]} 種類 / {report["apps_tuples_bytes"]:,} B'
+    f'（セッション数によらず 1 回分）。1 セッションの最大: {report["per_session_bytes_max"]:,} B'
+)
+with st.expander("認証記録のあるユーザー", expanded=False):
+    st.write(report["users"])
+
+# ========= 起動時の事前準備 =========
+st.subheader("起動時の事前準備（prewarm）")
+warm = prewarm.status()
+st.caption(f'状態: {warm["state"]} / バックグラウンド所要 {warm["background_seconds"]:.3f} 秒')
+st.dataframe([{"step": k, **v} for k, v in warm["steps"].items()], use_container_width=True, hide_index=True)
+
+# ========= login_users.json の掃除 =========
+sweeps = login_sweeper.status()
+if sweeps:
+    st.subheader("login_users.json の期限切れ掃除")
+    for sw in sweeps:
+        history = sw.pop("history")
+        st.caption(f'{sw["file"]}: {sw["entries"]} 件 / 予定 {sw["scheduled"]} 件 / 削除累計 {sw["evicted_total"]} 件'
+                   f' / 次の期限 {sw["next_due"] or "-"}')
+        if history:
+            st.line_chart(history, x="ts", y=["entries", "evicted"])
+
+# ========= このセッションの内訳 =========
+st.subheader("このセッションの session_state（概算・大きい順）")
+sizes = session_state_sizes()
+st.caption(f"合計 約 {sum(n for _, n in sizes):,} B / {len(sizes)} キー（CookieManager などのコンポーネント状態を含む）")
+st.dataframe([{"key": k, "bytes": n} for k, n in sizes], use_container_width=True, hide_index=True)
+
+st.caption("概算は sys.getsizeof を辿った値（共有オブジェクトは 1 回）。RSS そのものではありません。")
@@ -0,0 +1,47 @@
+# login_test_app/tests/conftest.py
+"""
+テスト共通の準備。
+
+lib/ のモジュールはデータ先（LOGIN_TEST_DATA_DIR）を import 時に決めるので、
+どのテストより先にここで一時ディレクトリへ向けてから import させる。
+流量制限・取り込みデーモン・保持期間は環境に左右されないよう無効にしておく。
+
+    python -m pytest -q          # login_test_app/ で実行
+"""
+from __future__ import annotations
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="login_test_tests_"))
+os.environ["LOGIN_TEST_DATA_DIR"] = str(DATA_DIR)
+os.environ["LOGIN_TEST_CLICK_RATE"] = "0"
+for name in ("LOGIN_TEST_INGEST_SOCKET", "LOGIN_TEST_EVENT_RETENTION_DAYS", "LOGIN_TEST_SHARED_CACHE"):
+    os.environ.pop(name, None)
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+@pytest.fixture
+def store():
+    """空のイベントストア（events/ を消し、書き込みハンドル・インデックス状態・ロールアップも初期化）。"""
+    from lib import event_store
+
+    with event_store._writer_lock:
+        fh = event_store._writer.get("fh")
+        if fh is not None:
+            fh.close()
+        event_store._writer.clear()
+    event_store._index_state.clear()
+    shutil.rmtree(event_store.LOG_DIR, ignore_errors=True)
+    event_store.LOG_DIR.mkdir(parents=True)
+    event_store.ROLLUPS.rebuild()
+    return event_store
@@ -0,0 +1,170 @@
+# login_test_app/tests/test_event_store.py
+"""
+イベントストアの保守ジョブ（休止シャードの統合・保持期間の畳み込み）で
+イベントが失われたり二重に数えられたりしないことの確認。
+"""
+from __future__ import annotations
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from lib import retention
+from lib.rollups import Rollups, read_archive
+
+DAY = 86400
+NOW = 1_760_000_000          # 2025-10 頃（月の境目を跨がないよう固定）
+
+def _dead_pid(i: int = 0) -> int:
+    """どのプロセスにも使われない pid（pid_max より大きい）。"""
+    try:
+        pid_max = int(Path("/proc/sys/kernel/pid_max").read_text())
+    except (OSError, ValueError):
+        pid_max = 2 ** 22
+    return pid_max + 1 + i
+
+def _write_shard(store, pid: int, events: List[dict], *, partial_last: bool = False) -> Path:
+    path = store.LOG_DIR / store.shard_name(pid)
+    data = b"".join(store.encode_event(e) for e in events)
+    if partial_last:
+        data = data[:-1]        # 書き手が改行の前で落ちた
+    path.write_bytes(data)
+    return path
+
+def _events(user: str, start_ts: int, n: int, *, step: int = 7, seq0: int = 0) -> List[dict]:
+    from lib.event_store import make_click_event
+
+    return [make_click_event(user, f"btn_{i % 3}", {"seq": seq0 + i}, now=start_ts + i * step) for i in range(n)]
+
+def _identity(rows) -> Counter:
+    return Counter((r["ts"], r["user"], r["button"], json.dumps(r.get("meta"), sort_keys=True)) for r in rows)
+
+def _user_month(rows) -> Dict[tuple, int]:
+    out: Dict[tuple, int] = Counter()
+    for r in rows:
+        out[(r["user"], r["month"], r["button"])] += 1
+    return dict(out)
+
+def _aggregate(store) -> Dict[tuple, int]:
+    return {(r["user"], r["month"], r["button"]): r["count"]
+            for r in store.aggregate_by_user_month(include_archive=True)}
+
+def _fresh_rollups(store) -> Rollups:
+    """チェックポイントを持たないロールアップ（ファイルだけから数え直した値）。"""
+    return Rollups(store.list_shards, store.LOG_DIR / "test_rollups.json", store.ARCHIVE_FILE,
+                   store.CONSOLIDATION_FILE)
+
+# ─────────────────────────────────────────────────────────────
+# 休止シャードの統合
+# ─────────────────────────────────────────────────────────────
+def test_consolidation_keeps_every_event_once(store):
+    written = []
+    # 統合済みログが既にある状態から始める
+    written += _events("maeda", NOW - 3000, 40, seq0=0)
+    _write_shard(store, _dead_pid(0), written)
+    assert store.consolidate_idle_shards(time.time() + 3600) == 1
+    # ts が互いに入り組む 3 つの休止シャード（最後の 1 つは改行の前で途切れている）
+    for i, user in enumerate(("sato", "suzuki", "tanaka")):
+        evs = _events(user, NOW - 2000 + i, 50, step=5, seq0=100 * (i + 1))
+        _write_shard(store, _dead_pid(1 + i), evs, partial_last=(i == 2))
+        written += evs
+    # 生きている書き手（このプロセス）のシャードは統合しない
+    live = store.append_click_event("kato", "btn_live")
+    written.append(live)
+    store.ROLLUPS.refresh()
+    assert store.ROLLUPS.total() == len(written) - 1           # 改行の無い末尾行はまだ数えない
+
+    assert store.consolidate_idle_shards(time.time() + 3600) == 3
+
+    shards = store.list_shards()
+    assert [p.name for p in shards] == [store.LOG_FILE.name, store.own_shard().name]
+    assert _identity(store.iter_events()) == _identity(written)
+    merged_ts = [json.loads(line)["ts"] for line in store.LOG_FILE.read_bytes().splitlines()]
+    assert merged_ts == sorted(merged_ts)
+    assert _aggregate(store) == _user_month(written)
+    # 引き継いだロールアップも、ファイルから数え直した値も同じ（統合元を二重に数えない）
+    store.ROLLUPS.refresh()
+    assert store.ROLLUPS.total() == len(written)
+    assert _fresh_rollups(store).total() == len(written)
+
+    # 2 回目は何もしない
+    assert store.consolidate_idle_shards(time.time() + 3600) == 0
+    assert _identity(store.iter_events()) == _identity(written)
+
+def test_consolidation_skips_recent_and_foreign_shards(store):
+    recent = _write_shard(store, _dead_pid(0), _events("maeda", NOW, 5))
+    foreign = store.LOG_DIR / f"{store.LOG_PREFIX}.otherhost.{_dead_pid(1)}.jsonl"
+    foreign.write_bytes(b"".join(store.encode_event(e) for e in _events("sato", NOW, 5)))
+
+    assert store.consolidate_idle_shards(time.time()) == 0      # 更新から SHARD_IDLE_SECONDS 経っていない
+    assert store.consolidate_idle_shards(time.time() + 3600) == 1
+    assert not recent.exists()
+    assert foreign.exists()                                     # 他ホストの書き手の生死は分からない
+    assert sum(1 for _ in store.iter_events()) == 10
+
+# ─────────────────────────────────────────────────────────────
+# 保持期間の畳み込み
+# ─────────────────────────────────────────────────────────────
+def _consolidated_log(store, old: int = 120, new: int = 30) -> List[dict]:
+    """保持期間外（200 日前）と期間内（1 日前）のイベントを統合済みログにする。"""
+    events = _events("maeda", NOW - 200 * DAY, old, step=60) + _events("sato", NOW - DAY, new, step=60, seq0=1000)
+    _write_shard(store, _dead_pid(0), events)
+    assert store.consolidate_idle_shards(time.time() + 3600) == 1
+    return events
+
+def test_retention_compacts_old_events_and_keeps_monthly_totals(store):
+    events = _consolidated_log(store)
+    expected = _user_month(events)
+
+    result = retention.run_retention(90, now=NOW, batch_lines=25)
+
+    assert result["status"] == "compacted"
+    assert result["events"] == 120
+    remaining = list(store.iter_events())
+    assert len(remaining) == 30 and all(r["ts"] >= NOW - 90 * DAY for r in remaining)
+    assert _aggregate(store) == expected
+    assert _fresh_rollups(store).total() == len(events)
+    assert read_archive(store.ARCHIVE_FILE)["skip"] == {}
+    assert retention.run_retention(90, now=NOW)["status"] == "nothing_to_do"
+    assert _aggregate(store) == expected
+
+def test_retention_resumes_from_saved_offset(store):
+    events = _consolidated_log(store)
+
+    partial = retention.run_retention(90, now=NOW, batch_lines=25, max_batches=2)
+    assert partial["status"] == "partial"
+    assert partial["events"] == 50
+    assert _aggregate(store) == _user_month(events)            # 確定前は何も変わらない
+
+    result = retention.run_retention(90, now=NOW, batch_lines=25)
+    assert result["status"] == "compacted"
+    assert result["scanned_bytes"] < result["offset"]          # 前回の続きから読んだ
+    assert result["events"] == 120
+    assert _aggregate(store) == _user_month(events)
+
+def test_retention_crash_after_archive_before_truncate(store, monkeypatch):
+    events = _consolidated_log(store)
+    expected = _user_month(events)
+
+    # archive に件数と skip を書いた直後に落ちた（ログの先頭はまだ残っている）
+    monkeypatch.setattr(retention, "_finish_pending_truncate", lambda: 0)
+    assert retention.run_retention(90, now=NOW)["status"] == "compacted"
+    monkeypatch.undo()
+    assert read_archive(store.ARCHIVE_FILE)["skip"]
+    assert sum(1 for _ in store.iter_events()) == len(events)
+    # skip の先から読むので、archive 分と残っている先頭を二重に数えない
+    assert _aggregate(store) == expected
+    assert _fresh_rollups(store).total() == len(events)
+
+    # 次回の実行が切り落としを済ませる（件数は足し直さない）
+    assert retention.run_retention(90, now=NOW)["status"] == "nothing_to_do"
+    assert read_archive(store.ARCHIVE_FILE)["skip"] == {}
+    assert sum(1 for _ in store.iter_events()) == 30
+    assert _aggregate(store) == expected
+
+def test_aggregate_rejects_rows_with_archive(store):
+    with pytest.raises(ValueError):
+        store.aggregate_by_user_month([], include_archive=True)
@@ -0,0 +1,45 @@
+# login_test_app/tests/test_json_lookup.py
+"""巨大な JSON から 1 ユーザー分だけ読む（lib/json_lookup）。走査・索引のどちらでも json.load と同じ結果になること。"""
+from __future__ import annotations
+import json
+
+import pytest
+
+from lib.json_lookup import MemberView, UserIndex, lookup_member
+
+USERS = {
+    "maeda": {"pw": "x", "apps": ["login_test", "portal"]},
+    "sa\"to": {"pw": "y}{,", "apps": []},
+    "鈴木": {"pw": "z", "apps": ["login_test"], "note": "[\\\"]"},
+}
+
+@pytest.fixture
+def users_file(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"meta": {"users": "decoy"}, "users": USERS}, ensure_ascii=False, indent=2),
+                    encoding="utf-8")
+    return path
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_lookup_matches_json_load(users_file, use_index):
+    for name, value in USERS.items():
+        assert lookup_member(users_file, ("users", name), use_index=use_index) == value
+        assert lookup_member(users_file, ("users", name, "apps"), use_index=use_index) == value["apps"]
+    assert lookup_member(users_file, ("users", "nobody"), "-", use_index=use_index) == "-"
+    assert lookup_member(users_file, ("users", "maeda", "missing"), "-", use_index=use_index) == "-"
+
+def test_index_rebuilt_when_file_changes(users_file):
+    assert lookup_member(users_file, ("users", "maeda", "apps"), use_index=True) == ["login_test", "portal"]
+    changed = {**USERS, "maeda": {"pw": "x", "apps": ["other"]}}
+    users_file.write_text(json.dumps({"users": changed}, ensure_ascii=False) + "\n" * 8, encoding="utf-8")
+    assert lookup_member(users_file, ("users", "maeda", "apps"), use_index=True) == ["other"]
+    assert sorted(UserIndex.for_file(users_file).keys()) == sorted(changed)
+
+def test_member_view_behaves_like_dict(users_file):
+    view = MemberView(users_file)
+    assert "maeda" in view and "nobody" not in view and 1 not in view
+    assert view["鈴木"] == USERS["鈴木"]
+    assert view.get("nobody") is None
+    assert sorted(view) == sorted(USERS) and len(view) == len(USERS)
+    with pytest.raises(KeyError):
+        view["nobody"]
@@ -0,0 +1,36 @@
+# login_test_app/tests/test_rate_limit.py
+"""ユーザーごとのトークンバケット（lib/rate_limit）。"""
+from __future__ import annotations
+
+import pytest
+
+from lib.rate_limit import TokenBucketLimiter
+
+def test_burst_then_refill_returns_suppressed_count():
+    lim = TokenBucketLimiter(rate=2.0, burst=3)
+    assert [lim.acquire("maeda", now=0.0)[0] for _ in range(5)] == [True, True, True, False, False]
+    # 0.5 秒で 1 トークン回復。許可したときにそれまで抑止した件数を返す
+    assert lim.acquire("maeda", now=0.5) == (True, 2)
+    assert lim.acquire("maeda", now=0.5) == (False, 0)
+
+def test_keys_are_independent():
+    lim = TokenBucketLimiter(rate=1.0, burst=1)
+    assert lim.acquire("maeda", now=0.0) == (True, 0)
+    assert lim.acquire("maeda", now=0.0) == (False, 0)
+    assert lim.acquire("sato", now=0.0) == (True, 0)
+
+def test_buckets_are_bounded():
+    lim = TokenBucketLimiter(rate=1.0, burst=5, max_keys=10)
+    for i in range(100):
+        lim.acquire(f"user{i}", now=0.0)
+    assert len(lim) == 10
+    # 満タンまで回復したバケットは新しいキーが来たときに捨てる
+    lim = TokenBucketLimiter(rate=1.0, burst=1)
+    lim.acquire("old", now=0.0)
+    lim.acquire("new", now=10.0)
+    assert len(lim) == 1
+
+@pytest.mark.parametrize("rate, burst", [(0, 1), (-1, 1), (1, 0)])
+def test_invalid_parameters(rate, burst):
+    with pytest.raises(ValueError):
+        TokenBucketLimiter(rate, burst)
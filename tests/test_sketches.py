@@ -0,0 +1,64 @@
+# login_test_app/tests/test_sketches.py
+"""月別スケッチ（lib/sketches）のマージ。シャードごとに作ったものを足しても全体の近似になること。"""
+from __future__ import annotations
+import random
+from collections import Counter
+
+import pytest
+
+from lib.sketches import HyperLogLog, MonthSketch, SpaceSaving
+
+def _stream(seed: int, n: int):
+    rng = random.Random(seed)
+    # 少数の頻出要素 + 多数のまれな要素
+    return [f"hot{rng.randrange(5)}" if rng.random() < 0.5 else f"cold{rng.randrange(2000)}" for _ in range(n)]
+
+def test_space_saving_merge_bounds_true_counts():
+    a_items, b_items = _stream(1, 5000), _stream(2, 5000)
+    a, b = SpaceSaving(32), SpaceSaving(32)
+    for it in a_items:
+        a.add(it)
+    for it in b_items:
+        b.add(it)
+    a.merge(b)
+    truth = Counter(a_items) + Counter(b_items)
+
+    assert len(a.counts) <= 32
+    for row in a.top(32):
+        # 推定値は真値以上、過大分は error 以下
+        assert truth[row["item"]] <= row["count"] <= truth[row["item"]] + row["error"]
+    assert {r["item"] for r in a.top(5)} == {f"hot{i}" for i in range(5)}
+
+def test_space_saving_merge_exact_when_not_full():
+    a, b = SpaceSaving(10), SpaceSaving(10)
+    for it, n in (("x", 3), ("y", 1)):
+        a.add(it, n)
+    for it, n in (("x", 2), ("z", 4)):
+        b.add(it, n)
+    a.merge(b)
+    assert a.counts == {"x": 5, "y": 1, "z": 4}
+    assert set(a.errors.values()) == {0}
+
+def test_hll_merge_equals_union():
+    a, b, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        a.add(f"u{i}")
+        both.add(f"u{i}")
+    for i in range(2000, 6000):
+        b.add(f"u{i}")
+        both.add(f"u{i}")
+    a.merge(b)
+    assert a.registers == both.registers
+    assert abs(a.count() - 6000) <= 6000 * 4 * a.relative_error()
+    with pytest.raises(ValueError):
+        a.merge(HyperLogLog(p=10))
+
+def test_month_sketch_merge_round_trips_json():
+    x, y = MonthSketch(), MonthSketch()
+    for i in range(100):
+        x.add({"app": "login_test", "user": f"u{i % 10}", "button": "btn_a"})
+        y.add({"app": "login_test", "user": f"u{i % 20}", "button": "btn_b"})
+    x.merge(MonthSketch.from_json(y.to_json()))
+    assert x.events == 200
+    assert x.users["login_test"].count() == 20
+    assert {r["item"]: r["count"] for r in x.top_buttons.top()} == {"btn_a": 100, "btn_b": 100}
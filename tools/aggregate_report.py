@@ -0,0 +1,76 @@
+# login_test_app/tools/aggregate_report.py
+"""
+クリックログ全履歴のユーザー×月×ボタン集計（年次レポート用）。
+
+data/events の全シャードを行境界に揃えたバイト範囲に分け、プロセスプールで並列に数える。
+結果は単一スレッドの aggregate_by_user_month() と同一。
+
+使い方（login_test_app/ で実行）:
+    python tools/aggregate_report.py --workers 16 --csv > report.csv
+    python tools/aggregate_report.py --month-prefix 2025 --json
+    python tools/aggregate_report.py --workers 16 --compare     # 単一スレッド版と一致・速度比較
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib.event_store import (  # noqa: E402
+    PARALLEL_CHUNK_BYTES,
+    aggregate_by_user_month,
+    aggregate_by_user_month_parallel,
+)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="クリックログ全履歴の並列集計")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    ap.add_argument("--chunk-mb", type=int, default=PARALLEL_CHUNK_BYTES // 2**20, help="1 タスクあたりの最大バイト数（MB）")
+    ap.add_argument("--include-archive", action="store_true", help="保持期間切れで削除済みの件数も含める")
+    ap.add_argument("--month-prefix", default="", help="この文字列で始まる月だけ出力（例: 2025）")
+    ap.add_argument("--compare", action="store_true", help="単一スレッド版も実行して一致と速度を確認")
+    fmt = ap.add_mutually_exclusive_group()
+    fmt.add_argument("--json", action="store_true", help="JSON で出力")
+    fmt.add_argument("--csv", action="store_true", help="CSV で出力")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    rows = aggregate_by_user_month_parallel(
+        workers=args.workers, chunk_bytes=args.chunk_mb * 2**20, include_archive=args.include_archive,
+    )
+    elapsed = time.perf_counter() - t0
+
+    if args.compare:
+        t1 = time.perf_counter()
+        single = aggregate_by_user_month(include_archive=args.include_archive)
+        single_elapsed = time.perf_counter() - t1
+        same = single == rows
+        print(f"parallel: {elapsed:.3f}s（workers={args.workers}） / single: {single_elapsed:.3f}s "
+              f"/ x{single_elapsed / elapsed if elapsed else 0:.2f} / 一致: {same}", file=sys.stderr)
+        if not same:
+            return 1
+
+    if args.month_prefix:
+        rows = [r for r in rows if r["month"].startswith(args.month_prefix)]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False))
+    elif args.csv:
+        w = csv.DictWriter(sys.stdout, fieldnames=["month", "user", "button", "count"])
+        w.writeheader()
+        w.writerows(rows)
+    else:
+        for r in rows:
+            print(f"{r['month']}\t{r['user']}\t{r['button']}\t{r['count']}")
+        print(f"{len(rows)} 行 / {sum(r['count'] for r in rows)} 件 / {elapsed:.3f}s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# login_test_app/tools/bench_discovery.py
+"""
+settings.toml 自動探索のベンチマーク（従来の Path.iterdir 版 vs lib/settings_discovery）。
+
+一時ディレクトリに約 --dirs 個のディレクトリを持つ疑似 projects ツリーを作り、
+各プロジェクトに .git / .venv / node_modules / data を置いたうえで、
+auth_portal_app/.streamlit/settings.toml を（名前順で）最後のプロジェクトの探索上限の深さに置く
+（＝探索範囲をほぼ全部見ないと見つからない最悪に近いケース）。
+
+使い方（login_test_app/ で実行）:
+    python tools/bench_discovery.py --dirs 100000
+    python tools/bench_discovery.py --dirs 100000 --repeat 5 --keep /tmp/discovery_tree
+"""
+from __future__ import annotations
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, List, Optional
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib.settings_discovery import find_settings  # noqa: E402
+
+# ─────────────────────────────────────────────────────────────
+# 疑似ツリー
+# ─────────────────────────────────────────────────────────────
+def build_tree(root: Path, total_dirs: int, projects: int = 40) -> Path:
+    """projects/<pNN>/{.git,.venv,node_modules,data,src}/... を作り、settings.toml の場所を返す。"""
+    per_project = max(10, total_dirs // projects)
+    heavy = {".git": 0.25, ".venv": 0.25, "node_modules": 0.3, "data": 0.1}
+    for i in range(projects):
+        proj = root / f"p{i:03d}"
+        for name, share in heavy.items():
+            _fan(proj / name, int(per_project * share))
+        _fan(proj / "src", per_project - sum(int(per_project * s) for s in heavy.values()))
+    # root(0)/pNN(1)/src(2)/dXX(3)/dYY(4)/auth_portal_app … 深さ 4 のディレクトリの子
+    deep = root / f"p{projects - 1:03d}" / "src" / "d19" / "d19"
+    target = deep / "auth_portal_app" / ".streamlit" / "settings.toml"
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text("[access]\n", encoding="utf-8")
+    return target
+
+def _fan(base: Path, n: int, width: int = 20) -> int:
+    """base 以下に n 個のディレクトリを 幅 width の木で作る（深さは高々 3〜4）。"""
+    made = 0
+    dq = deque([base])
+    base.mkdir(parents=True, exist_ok=True)
+    while dq and made < n:
+        cur = dq.popleft()
+        for j in range(width):
+            if made >= n:
+                break
+            child = cur / f"d{j:02d}"
+            child.mkdir()
+            dq.append(child)
+            made += 1
+    return made
+
+# ─────────────────────────────────────────────────────────────
+# 従来実装（app.py の旧 _iter_dirs_bounded + ルート逐次）
+# ─────────────────────────────────────────────────────────────
+def legacy_find(roots: List[Path], max_depth: int = 4) -> Optional[Path]:
+    visited = set()
+    for root in roots:
+        root = root.resolve()
+        if not root.exists() or root in visited:
+            continue
+        visited.add(root)
+        dq = deque([(root, 0)])
+        while dq:
+            base, d = dq.popleft()
+            if d > max_depth:
+                continue
+            candidate = base / "auth_portal_app" / ".streamlit" / "settings.toml"
+            if candidate.is_file():
+                return candidate
+            try:
+                for child in base.iterdir():
+                    if child.is_dir():
+                        dq.append((child, d + 1))
+            except Exception:
+                continue
+    return None
+
+def _time(fn: Callable[[], Optional[Path]], repeat: int) -> tuple:
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="settings.toml 探索のベンチマーク")
+    ap.add_argument("--dirs", type=int, default=100_000, help="作るディレクトリ数（概数）")
+    ap.add_argument("--projects", type=int, default=40)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--keep", default="", help="ツリーを作る（再利用する）ディレクトリ。未指定なら一時ディレクトリ")
+    args = ap.parse_args(argv)
+
+    root = Path(args.keep) if args.keep else Path(tempfile.mkdtemp(prefix="discovery_bench_"))
+    try:
+        t0 = time.perf_counter()
+        if not root.exists() or not any(root.iterdir()):
+            target = build_tree(root, args.dirs, args.projects)
+        else:
+            target = next(root.glob("*/src/d19/d19/auth_portal_app/.streamlit/settings.toml"))
+        n_dirs = sum(len(d) for _, d, _ in os.walk(root))
+        print(f"tree: {root}（{n_dirs:,} dirs / 作成 {time.perf_counter() - t0:.1f}s）", file=sys.stderr)
+
+        # app.py と同じく、projects ルート + その下層を複数ルートとして渡す
+        roots = [root, root / f"p{args.projects - 1:03d}", root / "p000"]
+        legacy_t, legacy_r = _time(lambda: legacy_find(roots), args.repeat)
+        seq_t, seq_r = _time(lambda: find_settings(roots, workers=1), args.repeat)
+        par_t, par_r = _time(lambda: find_settings(roots, workers=args.workers), args.repeat)
+        for label, t, r in (("legacy iterdir", legacy_t, legacy_r), ("scandir", seq_t, seq_r),
+                            (f"scandir x{args.workers}", par_t, par_r)):
+            ok = r is not None and r.resolve() == target.resolve()
+            print(f"{label:16s} {t * 1000:9.1f} ms  x{legacy_t / t:5.1f}  found={ok}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
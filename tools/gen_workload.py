@@ -0,0 +1,365 @@
+# login_test_app/tools/gen_workload.py
+"""
+ベンチマーク用の合成データ生成（クリックログ・users.json・login_users.json・settings.toml）。
+
+- クリックログは append_click_event が書くのと同じ形（キー順・区切り・ensure_ascii=False）の JSONL。
+  時刻順に並べ、書き込み側と同じ間隔で疎インデックス（.idx）も書く
+- ユーザー・ボタン・アプリの出現頻度は Zipf（指数 s、s=0 で一様）
+- 逐次生成してバッファ単位で書き出すので、出力サイズ（数 GB でも）に関係なくメモリは一定
+- --seed が同じなら同じ出力（出力ごとに別の乱数列なので、例えば --events を変えても users.json は同じ）
+
+出力（--out 以下）:
+    events/button_clicks.jsonl                … --shards 1（統合済みログと同じ名前）
+    events/button_clicks.<host>.<pid>.jsonl   … --shards N（このホストの、終了した書き手のシャード。
+                                                pid は pid_max より大きい番号なので生きている書き手と重ならない。
+                                                統合・スケッチの作り直しの対象になる。別ホストで使うなら作り直すこと）
+    portal/users.json / portal/login_users.json / portal/settings.toml
+
+使い方（login_test_app/ で実行）:
+    python tools/gen_workload.py --out /tmp/wl --users 150000 --events 10000000
+    python tools/gen_workload.py --out /tmp/wl --size 5G --shards 4 --months 24 --zipf-users 1.2 --seed 7
+    LOGIN_TEST_DATA_DIR=/tmp/wl AUTH_PORTAL_SETTINGS_FILE=/tmp/wl/portal/settings.toml streamlit run app.py
+"""
+from __future__ import annotations
+import argparse
+import calendar
+import datetime as dt
+import hashlib
+import itertools
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, IO, List, Optional, Sequence, Tuple
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib.event_store import (  # noqa: E402
+    DEFAULT_APP, DEFAULT_PAGE, INDEX_EVERY_BYTES, INDEX_EVERY_LINES, LOG_PREFIX, shard_name,
+)
+
+BATCH = 20_000                  # 1 回にまとめて乱数を引く・書き出すイベント数
+WRITE_BUFFER = 4 * 1024 * 1024
+DEFAULT_BUTTONS = ("like", "done", "star")
+
+# ─────────────────────────────────────────────────────────────
+# 分布・名前
+# ─────────────────────────────────────────────────────────────
+def zipf_cum_weights(n: int, s: float) -> List[float]:
+    """順位 k（1 始まり）の重み 1/k^s の累積（random.choices の cum_weights 用）。"""
+    return list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+
+def user_names(n: int) -> List[str]:
+    width = max(6, len(str(n)))
+    return [f"user{i:0{width}d}" for i in range(1, n + 1)]
+
+def app_names(n: int) -> List[str]:
+    """先頭は DEFAULT_APP（このアプリ）。残りは appNNN。"""
+    return [DEFAULT_APP] + [f"app{i:03d}" for i in range(1, max(1, n))]
+
+def parse_size(text: str) -> int:
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+    t = text.strip().lower().rstrip("b")
+    if t and t[-1] in units:
+        return int(float(t[:-1]) * units[t[-1]])
+    return int(t)
+
+def month_range(start_month: str, months: int) -> Tuple[int, int]:
+    """[start_month の 1 日 0:00, months か月後の 1 日 0:00)（ローカル時刻）の epoch 秒。"""
+    y, m = (int(x) for x in start_month.split("-"))
+    start = dt.datetime(y, m, 1)
+    y2, m2 = divmod(m - 1 + months, 12)
+    end = dt.datetime(y + y2, m2 + 1, 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+# ─────────────────────────────────────────────────────────────
+# クリックログ
+# ─────────────────────────────────────────────────────────────
+class _Clock:
+    """ts → (iso, month)。分単位でキャッシュ（タイムゾーンのずれは分単位なので秒だけ足せばよい）。"""
+
+    def __init__(self):
+        self._minute = -1
+        self._prefix = ""
+        self._month = ""
+
+    def __call__(self, ts: int) -> Tuple[str, str]:
+        minute, sec = divmod(ts, 60)
+        if minute != self._minute:
+            d = dt.datetime.fromtimestamp(minute * 60)
+            self._minute = minute
+            self._prefix = d.isoformat(timespec="seconds")[:-2]     # "YYYY-MM-DDTHH:MM:"
+            self._month = d.strftime("%Y-%m")
+        return f"{self._prefix}{sec:02d}", self._month
+
+class _ShardWriter:
+    """1 シャード分の追記と疎インデックス（event_store.rebuild_index と同じ間隔）。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.fh: IO[bytes] = path.open("wb", buffering=WRITE_BUFFER)
+        self.idx = path.with_suffix(".idx").open("w", encoding="ascii", buffering=1024 * 1024)
+        self.offset = 0
+        self.last_off = -INDEX_EVERY_BYTES
+        self.lines = INDEX_EVERY_LINES
+        self.events = 0
+        self._buf: List[bytes] = []
+
+    def add(self, ts: int, line: bytes) -> None:
+        self.lines += 1
+        if self.lines >= INDEX_EVERY_LINES or self.offset - self.last_off >= INDEX_EVERY_BYTES:
+            self.idx.write(f"{ts} {self.offset}\n")
+            self.last_off, self.lines = self.offset, 0
+        self._buf.append(line)
+        self.offset += len(line)
+        self.events += 1
+
+    def flush(self) -> None:
+        if self._buf:
+            self.fh.write(b"".join(self._buf))
+            self._buf.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.fh.close()
+        self.idx.close()
+
+def _json_str(s: str) -> str:
+    return json.dumps(s, ensure_ascii=False)
+
+def _dead_pid_base() -> int:
+    """生きているプロセスと重ならない pid の始まり（pid_max より大きい番号。読めなければ Linux の上限 2^22）。"""
+    try:
+        return int(Path("/proc/sys/kernel/pid_max").read_text().strip()) + 1
+    except (OSError, ValueError):
+        return 2 ** 22 + 1
+
+def generate_events(
+    out_dir: Path,
+    *,
+    users: Sequence[str],
+    apps: Sequence[str],
+    buttons: Sequence[str],
+    events: Optional[int],
+    size: Optional[int],
+    start_month: str,
+    months: int,
+    zipf_users: float,
+    zipf_buttons: float,
+    zipf_apps: float,
+    shards: int,
+    page: str,
+    seed: int,
+) -> Dict[str, Any]:
+    """
+    events 件（size 指定なら約 size バイト）を [start_month, +months) に時刻順で均等に並べて書く。
+    各イベントの user / button / app は Zipf で引き、シャードは一様に振り分ける。
+    """
+    rng = random.Random(f"{seed}:events")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start_ts, end_ts = month_range(start_month, months)
+    span = end_ts - start_ts
+
+    cw_users = zipf_cum_weights(len(users), zipf_users)
+    cw_buttons = zipf_cum_weights(len(buttons), zipf_buttons)
+    cw_apps = zipf_cum_weights(len(apps), zipf_apps)
+    # JSON の断片は先に作っておく（1 行 = f-string 1 回）
+    j_users = [_json_str(u) for u in users]
+    j_buttons = [_json_str(b) for b in buttons]
+    j_apps = [_json_str(a) for a in apps]
+    j_page = _json_str(page)
+
+    if shards <= 1:
+        paths = [out_dir / f"{LOG_PREFIX}.jsonl"]
+    else:
+        base = _dead_pid_base()
+        paths = [out_dir / shard_name(base + i) for i in range(shards)]
+    writers = [_ShardWriter(p) for p in paths]
+    clock = _Clock()
+
+    if events is None:
+        # 1 行の平均長を見積もって件数に換算（size 指定）
+        sample = [f'{{"ts": {start_ts}, "iso": "2000-01-01T00:00:00", "month": "2000-01", "app": {a}, '
+                  f'"page": {j_page}, "user": {u}, "button": {b}, "meta": {{}}}}\n'
+                  for u, b, a in zip(rng.choices(j_users, cum_weights=cw_users, k=1000),
+                                      rng.choices(j_buttons, cum_weights=cw_buttons, k=1000),
+                                      rng.choices(j_apps, cum_weights=cw_apps, k=1000))]
+        avg = sum(len(s.encode("utf-8")) for s in sample) / len(sample)
+        events = max(1, int((size or 0) / avg))
+
+    t0 = time.perf_counter()
+    done = 0
+    while done < events:
+        k = min(BATCH, events - done)
+        us = rng.choices(j_users, cum_weights=cw_users, k=k)
+        bs = rng.choices(j_buttons, cum_weights=cw_buttons, k=k)
+        aps = rng.choices(j_apps, cum_weights=cw_apps, k=k)
+        ws = rng.choices(writers, k=k) if len(writers) > 1 else itertools.repeat(writers[0], k)
+        for i, u, b, a, w in zip(range(done, done + k), us, bs, aps, ws):
+            ts = start_ts + (i * span) // events
+            iso, month = clock(ts)
+            w.add(ts, f'{{"ts": {ts}, "iso": "{iso}", "month": "{month}", "app": {a}, "page": {j_page}, '
+                      f'"user": {u}, "button": {b}, "meta": {{}}}}\n'.encode("utf-8"))
+        for w in writers:
+            w.flush()
+        done += k
+    for w in writers:
+        w.close()
+    elapsed = time.perf_counter() - t0
+    total = sum(w.offset for w in writers)
+    return {
+        "events": events,
+        "bytes": total,
+        "shards": [str(p) for p in paths],
+        "range": [dt.datetime.fromtimestamp(start_ts).isoformat(), dt.datetime.fromtimestamp(end_ts).isoformat()],
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(total / 2**20 / elapsed, 1) if elapsed else 0.0,
+    }
+
+# ─────────────────────────────────────────────────────────────
+# ユーザー・権限
+# ─────────────────────────────────────────────────────────────
+def _user_apps(rng: random.Random, apps: Sequence[str], cw_apps: List[float], max_apps: int) -> List[str]:
+    n = rng.randint(1, max(1, min(max_apps, len(apps))))
+    return sorted(set(rng.choices(apps, cum_weights=cw_apps, k=n)))
+
+def write_users_json(path: Path, users: Sequence[str], apps: Sequence[str], *,
+                     zipf_apps: float, max_apps: int, seed: int) -> int:
+    """{"users": {name: {"pw": ..., "apps": [...]}}} を 1 ユーザーずつ書く（indent=2 相当）。"""
+    rng = random.Random(f"{seed}:users")
+    cw_apps = zipf_cum_weights(len(apps), zipf_apps)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
+        f.write('{\n  "users": {')
+        for i, name in enumerate(users):
+            rec = {"pw": hashlib.sha256(f"{seed}:{name}".encode()).hexdigest(),
+                   "apps": _user_apps(rng, apps, cw_apps, max_apps)}
+            f.write(("," if i else "") + f"\n    {_json_str(name)}: {json.dumps(rec, ensure_ascii=False)}")
+        f.write("\n  }\n}\n")
+    return path.stat().st_size
+
+def write_login_users_json(path: Path, users: Sequence[str], apps: Sequence[str], *, logged_in: float,
+                           zipf_apps: float, max_apps: int, seed: int, now: Optional[int] = None) -> int:
+    """{name: {"login_time": iso, "apps": [...]}}（users の logged_in 割合）。"""
+    rng = random.Random(f"{seed}:login_users")
+    cw_apps = zipf_cum_weights(len(apps), zipf_apps)
+    now = int(time.time()) if now is None else now
+    picked = [u for u in users if rng.random() < logged_in]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
+        f.write("{")
+        for i, name in enumerate(picked):
+            login = dt.datetime.fromtimestamp(now - rng.randint(0, 8 * 3600)).isoformat(timespec="seconds")
+            rec = {"login_time": login, "apps": _user_apps(rng, apps, cw_apps, max_apps)}
+            f.write(("," if i else "") + f"\n  {_json_str(name)}: {json.dumps(rec, ensure_ascii=False)}")
+        f.write("\n}\n")
+    return len(picked)
+
+def _toml_list(items: Sequence[str]) -> str:
+    return "[" + ", ".join(_json_str(x) for x in items) + "]"
+
+def write_settings_toml(path: Path, users: Sequence[str], apps: Sequence[str], *,
+                        admins: int, restricted_users: int, zipf_users: float, seed: int) -> Dict[str, int]:
+    """
+    access.{public,user,restricted,admin}.apps・restricted_users・admin_users。
+    DEFAULT_APP は user 層。残りのアプリを 1:5:3:1 で各層へ。
+    """
+    rng = random.Random(f"{seed}:settings")
+    rest = list(apps[1:])
+    rng.shuffle(rest)
+    n = len(rest)
+    cuts = [round(n * c) for c in (0.1, 0.6, 0.9)]
+    layers = {
+        "public": sorted(rest[:cuts[0]]),
+        "user": sorted([apps[0]] + rest[cuts[0]:cuts[1]]),
+        "restricted": sorted(rest[cuts[1]:cuts[2]]),
+        "admin": sorted(rest[cuts[2]:]),
+    }
+    cw_users = zipf_cum_weights(len(users), zipf_users)
+    admin_users = sorted(set(rng.choices(users, cum_weights=cw_users, k=admins))) if admins else []
+    lines = [f"admin_users = {_toml_list(admin_users)}", ""]
+    for name, layer_apps in layers.items():
+        lines += [f"[access.{name}]", f"apps = {_toml_list(layer_apps)}", ""]
+    lines.append("[restricted_users]")
+    for app in layers["restricted"]:
+        members = sorted(set(rng.choices(users, cum_weights=cw_users, k=restricted_users)))
+        lines.append(f"{app} = {_toml_list(members)}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return {k: len(v) for k, v in layers.items()}
+
+# ─────────────────────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────────────────────
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="ベンチマーク用の合成データ生成")
+    ap.add_argument("--out", required=True, help="出力先ディレクトリ（LOGIN_TEST_DATA_DIR に指定できる形）")
+    ap.add_argument("--what", default="events,users,login_users,settings",
+                    help="生成するもの（カンマ区切り: events,users,login_users,settings）")
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--apps", type=int, default=20, help="アプリ数（先頭は login_test）")
+    ap.add_argument("--buttons", default=",".join(DEFAULT_BUTTONS), help="ボタン ID（カンマ区切り）")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--events", type=int, default=None, help="イベント数（既定 1,000,000）")
+    g.add_argument("--size", default=None, help="クリックログの目安サイズ（例: 500M, 5G）")
+    ap.add_argument("--start-month", default="2025-01")
+    ap.add_argument("--months", type=int, default=12)
+    ap.add_argument("--shards", type=int, default=1)
+    ap.add_argument("--page", default=DEFAULT_PAGE)
+    ap.add_argument("--zipf-users", type=float, default=1.1, help="ユーザーの偏り（0 で一様）")
+    ap.add_argument("--zipf-buttons", type=float, default=0.8)
+    ap.add_argument("--zipf-apps", type=float, default=1.0)
+    ap.add_argument("--max-apps", type=int, default=5, help="1 ユーザーあたりの apps の最大数")
+    ap.add_argument("--logged-in", type=float, default=0.05, help="login_users.json に入るユーザーの割合")
+    ap.add_argument("--admins", type=int, default=3)
+    ap.add_argument("--restricted-users", type=int, default=20, help="制限アプリごとの許可ユーザー数（抽選）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    what = {w.strip() for w in args.what.split(",") if w.strip()}
+    unknown = what - {"events", "users", "login_users", "settings"}
+    if unknown:
+        ap.error(f"--what に不明な値: {', '.join(sorted(unknown))}")
+    try:
+        dt.datetime.strptime(args.start_month, "%Y-%m")
+    except ValueError:
+        ap.error("--start-month は YYYY-MM")
+    if args.users < 1 or args.months < 1 or args.shards < 1:
+        ap.error("--users / --months / --shards は 1 以上")
+
+    out = Path(args.out)
+    users = user_names(args.users)
+    apps = app_names(args.apps)
+    buttons = [b.strip() for b in args.buttons.split(",") if b.strip()] or list(DEFAULT_BUTTONS)
+    report: Dict[str, Any] = {"seed": args.seed, "users": len(users), "apps": len(apps)}
+
+    if "users" in what:
+        t0 = time.perf_counter()
+        n = write_users_json(out / "portal" / "users.json", users, apps,
+                             zipf_apps=args.zipf_apps, max_apps=args.max_apps, seed=args.seed)
+        report["users_json"] = {"bytes": n, "seconds": round(time.perf_counter() - t0, 2)}
+    if "login_users" in what:
+        n = write_login_users_json(out / "portal" / "login_users.json", users, apps, logged_in=args.logged_in,
+                                   zipf_apps=args.zipf_apps, max_apps=args.max_apps, seed=args.seed)
+        report["login_users"] = n
+    if "settings" in what:
+        report["settings_layers"] = write_settings_toml(
+            out / "portal" / "settings.toml", users, apps, admins=args.admins,
+            restricted_users=args.restricted_users, zipf_users=args.zipf_users, seed=args.seed)
+    if "events" in what:
+        events = args.events if args.events is not None or args.size else 1_000_000
+        report["events"] = generate_events(
+            out / "events", users=users, apps=apps, buttons=buttons, events=events,
+            size=parse_size(args.size) if args.size else None, start_month=args.start_month,
+            months=args.months, zipf_users=args.zipf_users, zipf_buttons=args.zipf_buttons,
+            zipf_apps=args.zipf_apps, shards=args.shards, page=args.page, seed=args.seed)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"LOGIN_TEST_DATA_DIR={out} AUTH_PORTAL_SETTINGS_FILE={out / 'portal' / 'settings.toml'}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
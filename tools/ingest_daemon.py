@@ -0,0 +1,53 @@
+# login_test_app/tools/ingest_daemon.py
+"""
+クリックイベント取り込みデーモン（lib/ingest.py の IngestServer を起動する）。
+
+使い方（login_test_app/ で実行）:
+    python tools/ingest_daemon.py --socket /run/login_test/ingest.sock
+    # アプリ側: LOGIN_TEST_INGEST_SOCKET=/run/login_test/ingest.sock
+
+SIGINT / SIGTERM でキューを書き切ってから終了する。
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib.ingest import BATCH_MAX, BATCH_WAIT_SECONDS, QUEUE_MAX, IngestServer  # noqa: E402
+from lib.metrics import start_exporter  # noqa: E402
+
+async def _serve(args: argparse.Namespace) -> None:
+    server = IngestServer(Path(args.socket), queue_max=args.queue_max,
+                          batch_max=args.batch_max, batch_wait=args.batch_wait_ms / 1000)
+    await server.start()
+    print(f"listening on {args.socket}（pid={os.getpid()}）", file=sys.stderr)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.stop()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="クリックイベント取り込みデーモン（Unix ソケット）")
+    ap.add_argument("--socket", default=os.environ.get("LOGIN_TEST_INGEST_SOCKET"), help="待ち受けるソケットのパス")
+    ap.add_argument("--queue-max", type=int, default=QUEUE_MAX, help="書き込み待ちの上限（超えると受信を止める）")
+    ap.add_argument("--batch-max", type=int, default=BATCH_MAX)
+    ap.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_SECONDS * 1000)
+    args = ap.parse_args(argv)
+    if not args.socket:
+        ap.error("--socket か LOGIN_TEST_INGEST_SOCKET を指定してください")
+    start_exporter()    # LOGIN_TEST_METRICS_* があればデーモンのメトリクスも出す
+    asyncio.run(_serve(args))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
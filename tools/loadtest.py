@@ -0,0 +1,267 @@
+# login_test_app/tools/loadtest.py
+"""
+同時セッション負荷試験（streamlit.testing.v1.AppTest ベース）。
+
+1 セッション = 1 AppTest インスタンス。初回 run の後、保護テストページなら
+「いいね/完了/ブックマーク」を順にクリックして rerun を繰り返す。
+Cookie（CookieManager）と common_lib はローカルの偽物に差し替えるので、
+ポータルや本番 settings.toml が無い環境でも app.py / pages/* を駆動できる。
+
+使い方（login_test_app/ で実行）:
+    python tools/loadtest.py --sessions 200 --workers 16
+    python tools/loadtest.py --page app.py --sessions 50 --reruns 10
+    python tools/loadtest.py --mode process --workers 4 --json
+
+出力: スループット（rerun/秒）、レイテンシ p50/p90/p99/max、RSS 増分（セッションあたり）。
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import jwt
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+DEFAULT_PAGE = "pages/01_保護テスト.py"
+CLICK_KEYS = ("btn_like", "btn_done", "btn_star")        # 01_保護テスト のボタン key
+FAKE_SECRET = "loadtest-secret-0123456789abcdef0123456789"
+COOKIE_NAME = "prec_sso"
+SESSION_COOKIES_KEY = "_loadtest_cookies"                # 偽 CookieManager が参照する session_state キー
+
+# ─────────────────────────────────────────────────────────────
+# 偽物（Cookie / common_lib）
+# ─────────────────────────────────────────────────────────────
+class FakeCookieManager:
+    """stx.CookieManager の代替。Cookie は AppTest 側で session_state に仕込む。"""
+
+    def __init__(self, key: Optional[str] = None):
+        import streamlit as st
+        self._store: Dict[str, Any] = st.session_state.setdefault(SESSION_COOKIES_KEY, {})
+
+    def get(self, name: str):
+        return self._store.get(name)
+
+    def get_all(self, key: Optional[str] = None) -> Dict[str, Any]:
+        return dict(self._store)
+
+    def set(self, name: str, value: Any, **kwargs) -> None:
+        self._store[name] = value
+
+    def delete(self, name: str, **kwargs) -> None:
+        self._store.pop(name, None)
+
+def _fake_verify_jwt(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    # 本物と同程度のコスト（HS256 検証）を払う
+    try:
+        return jwt.decode(token, FAKE_SECRET, algorithms=["HS256"], options={"require": ["exp", "sub"]})
+    except jwt.InvalidTokenError:
+        return None
+
+def _install_fakes(workdir: Path) -> None:
+    """common_lib / extra_streamlit_components を差し替え、設定とデータ先を一時ディレクトリへ向ける。"""
+    def module(name: str, **attrs) -> types.ModuleType:
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        sys.modules[name] = m
+        return m
+
+    module("common_lib", __path__=[])
+    module("common_lib.ui", __path__=[])
+    module("common_lib.ui.ui_basics", thick_divider=lambda: None)
+    module("common_lib.auth", __path__=[])
+    module("common_lib.auth.jwt_utils", verify_jwt=_fake_verify_jwt)
+    module("common_lib.auth.config", COOKIE_NAME=COOKIE_NAME, PORTAL_URL="/auth_portal")
+
+    try:
+        import extra_streamlit_components as stx
+        stx.CookieManager = FakeCookieManager
+    except ImportError:
+        module("extra_streamlit_components", CookieManager=FakeCookieManager)
+
+    settings = workdir / "settings.toml"
+    settings.write_text(
+        '[access.public]\napps = []\n[access.user]\napps = ["login_test"]\n'
+        '[access.restricted]\napps = []\n[access.admin]\napps = []\n',
+        encoding="utf-8",
+    )
+    os.environ["AUTH_PORTAL_SETTINGS_FILE"] = str(settings)
+    os.environ["LOGIN_TEST_DATA_DIR"] = str(workdir / "data")
+    if str(APP_DIR) not in sys.path:
+        sys.path.insert(0, str(APP_DIR))
+
+def _issue_token(user: str) -> str:
+    now = int(time.time())
+    return jwt.encode({"sub": user, "iat": now, "exp": now + 3600}, FAKE_SECRET, algorithm="HS256")
+
+# ─────────────────────────────────────────────────────────────
+# 計測
+# ─────────────────────────────────────────────────────────────
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024   # macOS は bytes、Linux は KiB
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+def run_session(index: int, page: str, reruns: int, timeout: float) -> Dict[str, Any]:
+    """1 セッションを駆動し、各 run のレイテンシ（秒）を返す。"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_DIR / page), default_timeout=timeout)
+    at.session_state[SESSION_COOKIES_KEY] = {COOKIE_NAME: _issue_token(f"load{index:05d}")}
+
+    latencies: List[float] = []
+    errors = 0
+    t0 = time.perf_counter()
+    at.run()
+    latencies.append(time.perf_counter() - t0)
+    errors += len(at.exception)
+
+    clickable = [k for k in CLICK_KEYS if _has_button(at, k)]
+    for i in range(reruns):
+        t0 = time.perf_counter()
+        try:
+            if clickable:
+                at.button(key=clickable[i % len(clickable)]).click().run()
+            else:
+                at.run()
+        except KeyError:
+            # 直前の run が途中で失敗してボタンが描画されていない
+            errors += 1
+            at.run()
+        latencies.append(time.perf_counter() - t0)
+        errors += len(at.exception)
+    return {"latencies": latencies, "errors": errors, "app": at}
+
+def _has_button(at, key: str) -> bool:
+    try:
+        at.button(key=key)
+        return True
+    except KeyError:
+        return False
+
+def _run_chunk(indices: List[int], page: str, reruns: int, timeout: float, workdir: str) -> Dict[str, Any]:
+    """プロセスモード用：ワーカー内でセッションを順に実行（AppTest は保持して RSS を計る）。"""
+    _install_fakes(Path(workdir))
+    rss0 = _rss_bytes()
+    keep, latencies, errors = [], [], 0
+    for i in indices:
+        r = run_session(i, page, reruns, timeout)
+        latencies.extend(r["latencies"])
+        errors += r["errors"]
+        keep.append(r["app"])
+    return {"latencies": latencies, "errors": errors, "rss_delta": _rss_bytes() - rss0, "sessions": len(keep)}
+
+def run_load(
+    *,
+    sessions: int,
+    workers: int,
+    reruns: int,
+    page: str = DEFAULT_PAGE,
+    mode: str = "thread",
+    timeout: float = 30.0,
+) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="login_test_load_")
+    latencies: List[float] = []
+    errors = 0
+    rss_delta = 0
+
+    t_start = time.perf_counter()
+    if mode == "process":
+        chunks = [list(range(w, sessions, workers)) for w in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futs = [ex.submit(_run_chunk, c, page, reruns, timeout, workdir) for c in chunks if c]
+            for f in futs:
+                r = f.result()
+                latencies.extend(r["latencies"])
+                errors += r["errors"]
+                rss_delta += r["rss_delta"]
+    else:
+        _install_fakes(Path(workdir))
+        rss0 = _rss_bytes()
+        alive = []                      # セッションを生かしたまま RSS を計る
+        lock = threading.Lock()
+
+        def one(i: int) -> None:
+            nonlocal errors
+            r = run_session(i, page, reruns, timeout)
+            with lock:
+                latencies.extend(r["latencies"])
+                errors += r["errors"]
+                alive.append(r["app"])
+
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(one, range(sessions)))
+        rss_delta = _rss_bytes() - rss0
+    elapsed = time.perf_counter() - t_start
+
+    lat = sorted(latencies)
+    return {
+        "page": page,
+        "mode": mode,
+        "sessions": sessions,
+        "workers": workers,
+        "runs": len(lat),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_runs_per_s": round(len(lat) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(lat) * 1000, 2) if lat else 0.0,
+            "p50": round(_percentile(lat, 0.50) * 1000, 2),
+            "p90": round(_percentile(lat, 0.90) * 1000, 2),
+            "p99": round(_percentile(lat, 0.99) * 1000, 2),
+            "max": round(lat[-1] * 1000, 2) if lat else 0.0,
+        },
+        "rss_delta_mb": round(rss_delta / 2**20, 2),
+        "rss_per_session_kb": round(rss_delta / 1024 / sessions, 1) if sessions else 0.0,
+        "workdir": workdir,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="AppTest による同時セッション負荷試験")
+    ap.add_argument("--page", default=DEFAULT_PAGE, help="app.py または pages/xx.py（login_test_app 相対）")
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=8, help="同時実行数（スレッド/プロセス）")
+    ap.add_argument("--reruns", type=int, default=5, help="初回以降の rerun（クリック）回数")
+    ap.add_argument("--mode", choices=["thread", "process"], default="thread")
+    ap.add_argument("--timeout", type=float, default=30.0, help="1 run あたりのタイムアウト秒")
+    ap.add_argument("--json", action="store_true", help="結果を JSON 1 行で出力")
+    args = ap.parse_args(argv)
+
+    result = run_load(
+        sessions=args.sessions, workers=args.workers, reruns=args.reruns,
+        page=args.page, mode=args.mode, timeout=args.timeout,
+    )
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        lat = result["latency_ms"]
+        print(f"page={result['page']} mode={result['mode']} sessions={result['sessions']} workers={result['workers']}")
+        print(f"runs={result['runs']} errors={result['errors']} elapsed={result['elapsed_s']}s "
+              f"throughput={result['throughput_runs_per_s']} runs/s")
+        print(f"latency ms: mean={lat['mean']} p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+        print(f"RSS: +{result['rss_delta_mb']} MB（{result['rss_per_session_kb']} KB/セッション）")
+    return 1 if result["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+# login_test_app/tools/serve.py
+"""
+事前準備（lib/prewarm）をサーバー起動時に始めてから Streamlit を起動する（streamlit run の代わり）。
+
+streamlit run だとプロセス内で最初に動くのは最初の利用者のスクリプト実行なので、
+秘密鍵の読み込み・settings.toml の探索/パース・ACL の展開・イベントログの索引/ロールアップを
+その利用者が待つことになる。ここでは同じプロセスで先に prewarm.start() してから起動する
+（スクリプトからは同じ lib.prewarm モジュールが見えるので、ページは結果を使うだけ）。
+
+使い方（login_test_app/ で実行。.streamlit/config.toml はカレントから読まれる）:
+    python tools/serve.py
+    python tools/serve.py -- --server.port 8600      # -- 以降は streamlit run にそのまま渡す
+"""
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib import prewarm  # noqa: E402
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="事前準備を始めてから Streamlit を起動する")
+    ap.add_argument("--app", default=str(APP_DIR / "app.py"), help="起動するスクリプト")
+    ap.add_argument("streamlit_args", nargs=argparse.REMAINDER, help="streamlit run に渡す引数（-- の後）")
+    args = ap.parse_args(argv)
+    rest = args.streamlit_args[1:] if args.streamlit_args[:1] == ["--"] else args.streamlit_args
+
+    started = prewarm.start()     # LOGIN_TEST_PREWARM=0 なら何もしない（ページが従来どおりその場で実行）
+    print(f"prewarm: {'started' if started else 'skipped'}", file=sys.stderr)
+
+    from streamlit.web import cli as stcli
+    return stcli.main(args=["run", args.app, *rest], prog_name="streamlit")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# login_test_app/tools/verify_tokens.py
+"""
+アクセスログ等に残った prec_sso トークンの一括検証（セキュリティ監査用）。
+
+lib.sso.verify_many で同じトークンは 1 回だけ、プロセスプールで並列に検証し、
+1 行 1 件の JSONL（入力順）で出力する。iss/aud/leeway の扱いは verify_token と同じ。
+トークンそのものは出力せず、sha256 の先頭 16 桁（token_digest）で突き合わせる。
+
+    {"line": 12, "token_digest": "…", "sub": "alice", "exp": 1735689600, "outcome": "expired", "reason": "ExpiredSignatureError"}
+
+使い方（login_test_app/ で実行。秘密鍵は .streamlit/secrets.toml の AUTH_SECRET）:
+    python tools/verify_tokens.py /var/log/nginx/access.log --workers 8 > audit.jsonl
+    zcat access.log.*.gz | python tools/verify_tokens.py - --summary > audit.jsonl
+    python tools/verify_tokens.py tokens.txt --raw            # 1 行 1 トークン
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+
+APP_DIR = Path(__file__).resolve().parent.parent        # .../login_test_app
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+from lib.sso import verify_many  # noqa: E402
+
+def _cookie_re(name: str) -> "re.Pattern[str]":
+    # Cookie ヘッダ（"a=1; prec_sso=xxx"）・クエリ等のどこに出ても拾う
+    return re.compile(rf"(?:^|[\s;\"'&?]){re.escape(name)}=([A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]*)")
+
+def _open_inputs(paths: List[str]) -> Iterator[IO[str]]:
+    for p in paths or ["-"]:
+        if p == "-":
+            yield sys.stdin
+        else:
+            with open(p, encoding="utf-8", errors="replace") as f:
+                yield f
+
+def extract_tokens(paths: List[str], *, cookie: str, raw: bool) -> Iterator[Tuple[int, str]]:
+    """(行番号, トークン) を返す。トークンの無い行は飛ばす（行番号は入力全体の通し番号）。"""
+    pattern = _cookie_re(cookie)
+    n = 0
+    for f in _open_inputs(paths):
+        for line in f:
+            n += 1
+            if raw:
+                token = line.strip()
+                if token:
+                    yield n, token
+                continue
+            m = pattern.search(line)
+            if m:
+                yield n, m.group(1)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="prec_sso トークンの一括検証（JSONL 出力）")
+    ap.add_argument("inputs", nargs="*", help="入力ファイル（省略 / - で標準入力）")
+    ap.add_argument("--raw", action="store_true", help="1 行 1 トークン（既定はログ行から Cookie を抜き出す）")
+    ap.add_argument("--cookie", default="prec_sso", help="抜き出す Cookie 名")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="検証プロセス数（1 で直列）")
+    ap.add_argument("--no-iss", action="store_true", help="iss を照合しない（verify_token の check_iss=False）")
+    ap.add_argument("--no-aud", action="store_true", help="aud を照合しない（verify_token の check_aud=False）")
+    ap.add_argument("--leeway", type=int, default=30, help="時計ズレ許容（秒）")
+    ap.add_argument("--summary", action="store_true", help="結果別の件数を標準エラーに出す")
+    args = ap.parse_args(argv)
+
+    found = extract_tokens(args.inputs, cookie=args.cookie, raw=args.raw)
+    line_numbers: deque = deque()      # verify_many が読んだ分だけ（1 バッチ分）溜まる
+
+    def tokens() -> Iterator[str]:
+        for n, token in found:
+            line_numbers.append(n)
+            yield token
+
+    counts: Counter = Counter()
+    digests = {}
+    t0 = time.perf_counter()
+    out = sys.stdout
+    for token, (sub, exp, outcome, reason) in verify_many(
+            tokens(), workers=args.workers, check_iss=not args.no_iss, check_aud=not args.no_aud,
+            leeway_seconds=args.leeway):
+        digest = digests.get(token)
+        if digest is None:
+            if len(digests) > 100_000:
+                digests.clear()
+            digest = digests[token] = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+        out.write(json.dumps({"line": line_numbers.popleft(), "token_digest": digest, "sub": sub, "exp": exp,
+                              "outcome": outcome, "reason": reason or None}, ensure_ascii=False) + "\n")
+        counts[outcome] += 1
+    out.flush()
+
+    if args.summary:
+        elapsed = time.perf_counter() - t0
+        total = sum(counts.values())
+        print(json.dumps({"tokens": total, "outcomes": dict(counts), "seconds": round(elapsed, 2),
+                          "per_second": round(total / elapsed) if elapsed else None}, ensure_ascii=False),
+              file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())